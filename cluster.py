@@ -0,0 +1,258 @@
+# your_bot/cluster.py
+
+"""
+Многопроцессный режим: входной процесс получает обновления (polling или
+webhook) и раскладывает их по N процессам-обработчикам по user_id.
+Все обновления одного пользователя попадают в один процесс и внутри него
+обрабатываются строго по очереди, обновления разных пользователей - параллельно.
+Процессы-обработчики выполняют обычные роутеры бота; хранилища (SQLite/Redis)
+общие. Поскольку сессии FSM пользователя читает, пишет и удаляет по таймауту
+только его процесс (чистка каждого процесса видит лишь своих пользователей),
+кэш сессий SQLiteStorage в каждом процессе остается согласованным. Данные,
+общие для всех пользователей, в памяти процесса не держатся: результаты -
+только в SQLite (RESULT_STORE=sqlite проверяется в config.py), кэш карточек
+записей админки в процессах-обработчиках отключен.
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Маркер остановки процесса-обработчика
+_STOP = None
+
+
+def update_user_id(update: Dict[str, Any]) -> int:
+    """
+    ID пользователя, от которого пришло обновление (raw JSON Bot API).
+    Для обновлений без пользователя берется ID чата, иначе 0.
+    """
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        for field in ("from", "user"):
+            user = event.get(field)
+            if isinstance(user, dict) and "id" in user:
+                return user["id"]
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return 0
+
+
+def shard_for(update: Dict[str, Any], shards: int) -> int:
+    """Номер процесса-обработчика для обновления; не меняется, пока не меняется число процессов."""
+    return update_user_id(update) % shards
+
+
+class ShardRouter:
+    """Раскладывает обновления по очередям процессов-обработчиков."""
+
+    def __init__(self, queues: Sequence[Any]):
+        self.queues = list(queues)
+
+    # Сколько секунд поток ждет места в очереди; между попытками прием можно остановить
+    PUT_TIMEOUT = 1.0
+
+    async def route(self, update: Dict[str, Any]) -> None:
+        target = self.queues[shard_for(update, len(self.queues))]
+        try:
+            target.put_nowait(update)
+            return
+        except queue.Full:
+            pass
+        # Обработчик не успевает: ждем места, не блокируя цикл событий входного процесса
+        while True:
+            try:
+                await asyncio.to_thread(target.put, update, True, self.PUT_TIMEOUT)
+                return
+            except queue.Full:
+                continue
+
+
+class UpdateSequencer:
+    """
+    Выполняет обработку обновлений: по очереди для одного ключа (пользователя),
+    параллельно для разных, не больше limit одновременно.
+    Каждая задача ждет предыдущую задачу своего ключа, поэтому порядок сохраняется.
+    Место среди limit задача занимает, только когда ее очередь подошла: обновления,
+    ждущие своего пользователя, не задерживают обновления других пользователей.
+    Принятых, но не обработанных обновлений - не больше max_pending (по умолчанию 16 * limit).
+    """
+
+    def __init__(self, limit: int = 64, max_pending: Optional[int] = None):
+        limit = max(1, limit)
+        self._semaphore = asyncio.Semaphore(limit)
+        self._pending = asyncio.Semaphore(max(limit, max_pending or 16 * limit))
+        self._tails: Dict[Any, asyncio.Task] = {}
+
+    async def submit(self, key: Any, handler: Callable[[], Awaitable[Any]]) -> None:
+        """Ставит обработку в очередь ключа; ждет, только если принято max_pending обновлений."""
+        await self._pending.acquire()
+        previous = self._tails.get(key)
+        task = asyncio.create_task(self._run(previous, handler))
+        self._tails[key] = task
+        task.add_done_callback(lambda done: self._finished(key, done))
+
+    async def _run(self, previous: Optional[asyncio.Task], handler: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            if previous is not None:
+                # Ошибка предыдущего обновления не отменяет обработку следующего
+                await asyncio.wait([previous])
+            async with self._semaphore:
+                await handler()
+        except Exception:
+            logger.exception("Ошибка обработки обновления")
+        finally:
+            self._pending.release()
+
+    def _finished(self, key: Any, task: asyncio.Task) -> None:
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    @property
+    def active_keys(self) -> int:
+        return len(self._tails)
+
+    async def drain(self) -> None:
+        """Дожидается обработки всех принятых обновлений."""
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+
+async def poll_updates(
+    bot: Bot,
+    router: ShardRouter,
+    allowed_updates: Optional[List[str]] = None,
+    timeout: int = 30
+) -> None:
+    """Long polling во входном процессе: обновления не обрабатываются, а раскладываются по процессам."""
+    offset: Optional[int] = None
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=timeout, allowed_updates=allowed_updates, request_timeout=timeout + 10
+            )
+        except (TelegramNetworkError, TelegramServerError) as e:
+            logger.error(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await router.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+
+class ForwardingRequestHandler(SimpleRequestHandler):
+    """Webhook входного процесса: проверяет секрет и передает обновление в процесс-обработчик."""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, router: ShardRouter, secret_token: str):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token)
+        self.router = router
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        await self.router.route(await request.json(loads=bot.session.json_loads))
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+
+def build_ingress_app(dispatcher: Dispatcher, bot: Bot, router: ShardRouter, path: str, secret_token: str) -> web.Application:
+    app = web.Application()
+    ForwardingRequestHandler(dispatcher, bot, router, secret_token).register(app, path=path)
+    return app
+
+
+def start_workers(count: int, queue_size: int = 1000) -> Tuple[List[multiprocessing.Process], List[Any]]:
+    """Запускает процессы-обработчики, у каждого своя очередь обновлений."""
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(maxsize=queue_size) for _ in range(count)]
+    processes = [
+        context.Process(target=run_worker, args=(index, count, queues[index]), name=f"bot-worker-{index}")
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+    return processes, queues
+
+
+async def watch_workers(processes: Sequence[multiprocessing.Process], interval: float = 1.0) -> None:
+    """
+    Следит за процессами-обработчиками. Завершается ошибкой, как только один из них
+    завершился: его очередь больше никто не разбирает, и прием обновлений для его
+    пользователей встал бы, когда очередь заполнится.
+    """
+    while True:
+        for process in processes:
+            if not process.is_alive():
+                raise RuntimeError(f"Процесс {process.name} завершился (код {process.exitcode})")
+        await asyncio.sleep(interval)
+
+
+def stop_workers(processes: Sequence[multiprocessing.Process], queues: Sequence[Any], timeout: float = 30.0) -> None:
+    """Просит процессы дообработать очередь и завершиться; зависшие процессы прерываются."""
+    for process, worker_queue in zip(processes, queues):
+        if not process.is_alive():
+            continue
+        try:
+            worker_queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.error(f"Очередь процесса {process.name} заполнена, маркер остановки не передан.")
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            logger.error(f"Процесс {process.name} не завершился за {timeout} с и будет остановлен.")
+            process.terminate()
+            process.join()
+
+
+def run_worker(index: int, count: int, updates: Any) -> None:
+    """Точка входа процесса-обработчика."""
+    # Останавливается по маркеру из очереди, а не по Ctrl+C, чтобы дообработать принятые обновления
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s - worker-{index} - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_worker_main(index, count, updates))
+
+
+async def _worker_main(index: int, count: int, updates: Any) -> None:
+    # Импорт здесь: процесс-обработчик собирает тот же диспетчер, что и обычный запуск
+    import main as app
+    from config import WORKER_CONCURRENCY
+    from database.cache import record_cards
+
+    dp = app.create_dispatcher(shard=(index, count))
+    dp["worker_index"] = index
+    # Карточку может изменить другой процесс, а сброс кэша виден только своему
+    record_cards.maxsize = 0
+    # Общий лимит Telegram делится между процессами; лимит на чат - нет, чат живет в одном процессе
+    bot = app.create_bot(global_share=1 / count)
+    sequencer = UpdateSequencer(limit=WORKER_CONCURRENCY)
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+    await dp.emit_startup(bot=bot, **workflow_data)
+    logger.info(f"Процесс-обработчик {index + 1}/{count} запущен.")
+
+    async def process(update: Dict[str, Any]) -> None:
+        result = await dp.feed_raw_update(bot, update)
+        if isinstance(result, TelegramMethod):
+            await dp.silent_call_request(bot, result)
+
+    try:
+        while True:
+            update = await asyncio.to_thread(updates.get)
+            if update is _STOP:
+                break
+            await sequencer.submit(update_user_id(update), lambda update=update: process(update))
+        await sequencer.drain()
+    finally:
+        try:
+            await dp.emit_shutdown(bot=bot, **workflow_data)
+        finally:
+            await bot.session.close()
+        logger.info(f"Процесс-обработчик {index + 1}/{count} остановлен.")
@@ -1,4 +1,5 @@
 from os import getenv
+from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -6,12 +7,108 @@ load_dotenv()
 # Токен бота
 BOT_TOKEN = getenv("BOT_TOKEN")
 
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = getenv("BOT_MODE", "polling")
+# Webhook: публичный адрес (https://example.com), путь, адрес и порт локального сервера,
+# секретный токен (если не задан, генерируется при запуске), число параллельных
+# обработчиков и размер очереди принятых обновлений
+WEBHOOK_URL = getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = getenv("WEBHOOK_SECRET", "")
+WEBHOOK_WORKERS = int(getenv("WEBHOOK_WORKERS", "16"))
+WEBHOOK_QUEUE_SIZE = int(getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+# Многопроцессный режим: число процессов-обработчиков (0 или 1 - все в одном процессе),
+# размер очереди обновлений каждого процесса и сколько обновлений процесс
+# обрабатывает одновременно (обновления одного пользователя - всегда по очереди)
+WORKERS = int(getenv("WORKERS", "0"))
+WORKER_QUEUE_SIZE = int(getenv("WORKER_QUEUE_SIZE", "1000"))
+WORKER_CONCURRENCY = int(getenv("WORKER_CONCURRENCY", "64"))
+
 # ID админа (можно несколько через запятую)
 ADMIN_IDS = [int(id) for id in getenv("ADMIN_IDS", "").split(",") if id]
 
+# Защита от флуда: не больше THROTTLE_LIMIT сообщений и нажатий пользователя
+# за THROTTLE_WINDOW сек и THROTTLE_ADMIN_LIMIT - для админов из ADMIN_IDS
+# (0 - без ограничения). THROTTLE_WARN=0 - лишние обновления отбрасываются молча,
+# иначе пользователь один раз за окно получает предупреждение
+THROTTLE_LIMIT = int(getenv("THROTTLE_LIMIT", "10"))
+THROTTLE_ADMIN_LIMIT = int(getenv("THROTTLE_ADMIN_LIMIT", "30"))
+THROTTLE_WINDOW = float(getenv("THROTTLE_WINDOW", "10"))
+THROTTLE_WARN = getenv("THROTTLE_WARN", "1") != "0"
+
+# Уведомления админам: сколько отправлять одновременно и сколько раз повторять
+# при ошибках сети/сервера и ответе Telegram "слишком много запросов"
+NOTIFY_CONCURRENCY = int(getenv("NOTIFY_CONCURRENCY", "8"))
+NOTIFY_MAX_RETRIES = int(getenv("NOTIFY_MAX_RETRIES", "3"))
+# Режим сводки: результаты отправляются админам одним сообщением раз в
+# NOTIFY_DIGEST_INTERVAL секунд или по NOTIFY_DIGEST_SIZE штук (0 - каждый отдельно).
+# NOTIFY_URGENT - правила "поле=значение" через запятую для результатов, отправляемых сразу
+NOTIFY_DIGEST_INTERVAL = float(getenv("NOTIFY_DIGEST_INTERVAL", "0"))
+NOTIFY_DIGEST_SIZE = int(getenv("NOTIFY_DIGEST_SIZE", "50"))
+NOTIFY_URGENT = getenv("NOTIFY_URGENT", "")
+
+# Планировщик исходящих сообщений: общий лимит бота (сообщений/сек), лимит на чат
+# (сообщений/сек) и сколько сообщений подряд можно отправить в чат без ожидания
+OUTBOUND_GLOBAL_RATE = float(getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = float(getenv("OUTBOUND_CHAT_BURST", "3"))
+
+# Количество соединений SQLite для чтения (запись всегда идет через одно соединение)
+DB_READERS = int(getenv("DB_READERS", "2"))
+
+# Групповая запись результатов: размер пачки и предел, на который пачка
+# может дополняться под нагрузкой (сек); одиночная строка пишется сразу
+DB_WRITE_BATCH_SIZE = int(getenv("DB_WRITE_BATCH_SIZE", "100"))
+DB_WRITE_FLUSH_INTERVAL = float(getenv("DB_WRITE_FLUSH_INTERVAL", "0.5"))
+
+# Хранилище результатов: sqlite или memory (без сохранения между перезапусками)
+RESULT_STORE = getenv("RESULT_STORE", "sqlite")
+
+# Хранилище состояний FSM: sqlite (анкеты переживают перезапуск), memory
+# или redis (общие анкеты для нескольких процессов бота)
+FSM_STORAGE = getenv("FSM_STORAGE", "sqlite")
+REDIS_URL = getenv("REDIS_URL", "redis://localhost:6379/0")
+# Сколько недавно активных сессий FSM держать в кэше
+FSM_CACHE_SIZE = int(getenv("FSM_CACHE_SIZE", "1024"))
+# Заброшенные анкеты: сессия удаляется после FSM_SESSION_TTL_HOURS часов бездействия,
+# сверх FSM_MAX_SESSIONS вытесняются давно не использованные (0 - без ограничения)
+FSM_SESSION_TTL_HOURS = float(getenv("FSM_SESSION_TTL_HOURS", "24"))
+FSM_MAX_SESSIONS = int(getenv("FSM_MAX_SESSIONS", "10000"))
+# Обновления одного пользователя обрабатываются по очереди, разных - параллельно;
+# пользователи распределяются между FSM_LOCK_STRIPES блокировками
+FSM_LOCK_STRIPES = int(getenv("FSM_LOCK_STRIPES", "1024"))
+
+# Файл с описанием анкеты и период проверки его изменений (сек, 0 - не следить)
+FLOW_PATH = getenv("FLOW_PATH", str(Path(__file__).parent / "handlers" / "flow.json"))
+FLOW_RELOAD_INTERVAL = float(getenv("FLOW_RELOAD_INTERVAL", "5"))
+
+# Outbox: уведомления о результатах отправляет фоновый воркер пачками по
+# OUTBOX_BATCH_SIZE событий, проверяя очередь раз в OUTBOX_POLL_INTERVAL сек;
+# событие повторяется до OUTBOX_MAX_ATTEMPTS раз
+OUTBOX_BATCH_SIZE = int(getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(getenv("OUTBOX_POLL_INTERVAL", "1"))
+OUTBOX_MAX_ATTEMPTS = int(getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+
+# Архивация: записи старше RETENTION_DAYS дней переносятся в сжатые сегменты (0 - отключено)
+RETENTION_DAYS = int(getenv("RETENTION_DAYS", "0"))
+RETENTION_INTERVAL_HOURS = float(getenv("RETENTION_INTERVAL_HOURS", "24"))
+
 # Проверки
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден!")
 
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError(f"Неизвестный BOT_MODE: {BOT_MODE} (ожидается polling или webhook)")
+
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise ValueError("Для BOT_MODE=webhook нужен WEBHOOK_URL!")
+
+if WORKERS > 1 and RESULT_STORE != "sqlite":
+    # Хранилище memory у каждого процесса свое: результаты разошлись бы по процессам
+    raise ValueError("Для WORKERS > 1 нужен RESULT_STORE=sqlite!")
+
 if not ADMIN_IDS:
     print("⚠️ Внимание: ADMIN_IDS не установлены. Результаты не будут отправляться админам.")
\ No newline at end of file
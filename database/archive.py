@@ -0,0 +1,140 @@
+# your_bot/database/archive.py
+
+"""
+Архивация старых результатов тестов.
+Записи старше заданного возраста переносятся в сжатые сегменты
+(gzip JSON Lines, один файл на месяц прохождения), удаляются из рабочей
+таблицы, после чего освобожденное место возвращается через incremental_vacuum.
+Сегменты только дописываются и читаются выгрузкой и поиском по запросу.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, Dict, List, Optional
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+ConnectionFactory = Callable[[], AsyncContextManager[aiosqlite.Connection]]
+
+SEGMENT_PREFIX = "test_results-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+
+def segment_path(archive_dir: Path, month: str) -> Path:
+    """Путь к сегменту за месяц вида YYYY-MM."""
+    return archive_dir / f"{SEGMENT_PREFIX}{month}{SEGMENT_SUFFIX}"
+
+
+def _segment_month(path: Path) -> str:
+    return path.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+
+
+def _append_segments(archive_dir: Path, rows: List[Dict[str, Any]]) -> None:
+    """
+    Дописывает записи в сегменты по месяцам и сбрасывает их на диск.
+    Каждая дозапись - отдельный gzip-member, такой файл читается как единый поток.
+    """
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    by_month: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for row in rows:
+        by_month[row["completion_date"][:7]].append(row)
+
+    for month, month_rows in by_month.items():
+        payload = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in month_rows)
+        with open(segment_path(archive_dir, month), "ab") as file:
+            file.write(gzip.compress(payload.encode("utf-8")))
+            file.flush()
+            os.fsync(file.fileno())
+
+
+async def archive_old_results(
+    connection: ConnectionFactory,
+    archive_dir: Path,
+    max_age_days: int,
+    chunk_size: int = 500
+) -> List[int]:
+    """
+    Переносит записи старше max_age_days дней в сегменты и удаляет их из таблицы.
+    Работает порциями: сегмент дописывается и синхронизируется на диск до удаления
+    строк, поэтому сбой между шагами приводит к дублю в архиве, но не к потере данных.
+    Возвращает ID перенесенных записей.
+    """
+    cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat()
+    archived: List[int] = []
+    while True:
+        async with connection() as db:
+            async with db.execute(
+                "SELECT * FROM test_results WHERE completion_date < ? ORDER BY completion_date, id LIMIT ?",
+                (cutoff, chunk_size)
+            ) as cursor:
+                rows = [dict(row) for row in await cursor.fetchall()]
+            if not rows:
+                break
+            await asyncio.to_thread(_append_segments, archive_dir, rows)
+            ids = [row["id"] for row in rows]
+            await db.executemany("DELETE FROM test_results WHERE id = ?", [(record_id,) for record_id in ids])
+            await db.commit()
+        archived.extend(ids)
+        await asyncio.sleep(0)
+
+    if archived:
+        async with connection() as db:
+            # Прагма освобождает по странице на каждый шаг выполнения. Модуль sqlite3 делает
+            # только один шаг у запроса без колонок, даже при выборке результата,
+            # а executescript выполняет каждую команду до конца
+            await db.executescript("PRAGMA incremental_vacuum;")
+        logger.info(f"В архив перенесено записей: {len(archived)} (старше {cutoff}).")
+    return archived
+
+
+def _segments(archive_dir: Path, date_from: Optional[str], date_to: Optional[str]) -> List[Path]:
+    """Сегменты, месяцы которых пересекаются с периодом [date_from, date_to)."""
+    if not archive_dir.exists():
+        return []
+    segments = []
+    for path in sorted(archive_dir.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}")):
+        month = _segment_month(path)
+        if date_from and month < date_from[:7]:
+            continue
+        if date_to and month > date_to[:7]:
+            continue
+        segments.append(path)
+    return segments
+
+
+async def iter_archived(
+    archive_dir: Path,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    yield_every: int = 500
+) -> AsyncIterator[Dict[str, Any]]:
+    """Построчно отдает архивные записи за период [date_from, date_to)."""
+    count = 0
+    for path in _segments(archive_dir, date_from, date_to):
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                row = json.loads(line)
+                if date_from and row["completion_date"] < date_from:
+                    continue
+                if date_to and row["completion_date"] >= date_to:
+                    continue
+                yield row
+                count += 1
+                if count % yield_every == 0:
+                    # Чтение синхронное, периодически отдаем управление циклу событий
+                    await asyncio.sleep(0)
+
+
+async def find_archived(archive_dir: Path, record_id: int) -> Optional[Dict[str, Any]]:
+    """Ищет запись в архиве по ID. Просматривает сегменты целиком, поэтому вызывается только по запросу."""
+    async for row in iter_archived(archive_dir):
+        if row["id"] == record_id:
+            return row
+    return None
@@ -0,0 +1,63 @@
+# your_bot/database/cache.py
+
+"""
+Ограниченный LRU-кэш с временем жизни записей.
+Используется для готовых карточек записей в админке, чтобы повторный
+просмотр не ходил в SQLite и не собирал HTML заново.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """
+    Хранит не более maxsize значений, каждое не дольше ttl секунд.
+    При переполнении вытесняется давно не использованное значение.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Возвращает значение или None, если его нет или оно устарело."""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, *keys: Hashable) -> None:
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий и промахов."""
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+# Кэш отрендеренных карточек записей: ключ - ID записи в базе
+record_cards = TTLCache(maxsize=512, ttl=600.0)
@@ -4,69 +4,572 @@
 Модуль для управления базой данных SQLite.
 Содержит функции для инициализации БД и сохранения/извлечения результатов тестов.
 """
+import asyncio
+import json
 import logging
+import sqlite3
+import time
 import aiosqlite
+from contextlib import asynccontextmanager
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, Iterable, List, Dict, Any, Optional, Sequence, Tuple
+
+from .archive import archive_old_results, find_archived, iter_archived
+from .cache import record_cards
+from .migrations import apply_migrations, database_size, run_backfills
+from .models import ResultRow
+from .outbox import RESULT_SAVED, OutboxHandler, OutboxWorker, queue_event
+from .pool import ConnectionPool
+from .search import search_results
+from .stats import apply_stats, read_stats
+from .write_queue import ResultWriteQueue
 
 DB_PATH = Path(__file__).parent.parent / "database.db"
+ARCHIVE_DIR = Path(__file__).parent.parent / "archive"
 logger = logging.getLogger(__name__)
 
+# Пул соединений открывается в on_startup. Пока он не открыт (например, в тестах),
+# функции модуля открывают разовое соединение, как и раньше.
+_pool: Optional[ConnectionPool] = None
+
+# Очередь отложенной записи. Если она не запущена, результат пишется сразу.
+_write_queue: Optional[ResultWriteQueue] = None
+
+# Воркер outbox: побочные действия после сохранения результата
+_outbox: Optional[OutboxWorker] = None
+
+# Фоновая задача заполнения данных после миграций
+_backfill_task: Optional[asyncio.Task] = None
+
+# Фоновая задача архивации старых записей
+_retention_task: Optional[asyncio.Task] = None
+
+
+async def open_db(readers: int = 2) -> None:
+    """Открывает долгоживущий пул соединений к базе данных."""
+    global _pool
+    if _pool is not None:
+        return
+    pool = ConnectionPool(DB_PATH, readers=readers)
+    await pool.open()
+    _pool = pool
+
+
+async def start_write_queue(batch_size: int = 100, flush_interval: float = 0.5) -> None:
+    """Запускает групповую запись результатов тестов."""
+    global _write_queue
+    if _write_queue is not None:
+        return
+    _write_queue = ResultWriteQueue(
+        _upsert_results,
+        batch_size=batch_size,
+        flush_interval=flush_interval,
+        is_transient=_is_transient_error,
+        dead_letter=_quarantine_result
+    )
+    _write_queue.start()
+
+
+async def stop_write_queue() -> None:
+    """Останавливает очередь, дописав в базу все накопленные результаты."""
+    global _write_queue
+    if _write_queue is None:
+        return
+    queue, _write_queue = _write_queue, None
+    await queue.stop()
+
+
+async def start_outbox(
+    handlers: Dict[str, OutboxHandler],
+    batch_size: int = 50,
+    poll_interval: float = 1.0,
+    max_attempts: int = 10
+) -> None:
+    """Запускает разбор outbox: события, записанные вместе с результатами, передаются обработчикам."""
+    global _outbox
+    if _outbox is not None:
+        return
+    _outbox = OutboxWorker(
+        _write_connection, handlers, batch_size=batch_size, poll_interval=poll_interval, max_attempts=max_attempts
+    )
+    _outbox.start()
+
+
+async def stop_outbox() -> None:
+    """Останавливает разбор outbox, необработанные события дождутся следующего запуска."""
+    global _outbox
+    if _outbox is None:
+        return
+    worker, _outbox = _outbox, None
+    await worker.stop()
+
+
+async def archive_results(max_age_days: int) -> int:
+    """Переносит в архив записи старше max_age_days дней. Возвращает их количество."""
+    archived = await archive_old_results(_write_connection, ARCHIVE_DIR, max_age_days)
+    _records_changed(archived)
+    return len(archived)
+
+
+async def vacuum_db() -> Tuple[int, int]:
+    """
+    Полностью перестраивает файл базы (VACUUM) и включает отложенный миграцией режим auto_vacuum.
+    На время перестройки запись ждет. Возвращает размер базы до и после в байтах.
+    """
+    async with _write_connection() as db:
+        before = await database_size(db)
+        # Режим запоминается только соединением, поэтому задается заново перед VACUUM
+        await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await db.execute("VACUUM")
+        after = await database_size(db)
+    logger.info(f"VACUUM выполнен: {before} -> {after} байт.")
+    return before, after
+
+
+async def _retention_loop(max_age_days: int, interval: float) -> None:
+    while True:
+        try:
+            await archive_results(max_age_days)
+        except Exception as e:
+            logger.error(f"Ошибка архивации старых записей: {e}")
+        await asyncio.sleep(interval)
+
+
+async def start_retention(max_age_days: int, interval: float = 24 * 3600) -> None:
+    """Запускает периодическую архивацию записей старше max_age_days дней."""
+    global _retention_task
+    if _retention_task is not None or max_age_days <= 0:
+        return
+    _retention_task = asyncio.create_task(_retention_loop(max_age_days, interval), name="results-retention")
+
+
+async def stop_retention() -> None:
+    global _retention_task
+    if _retention_task is None:
+        return
+    task, _retention_task = _retention_task, None
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+async def close_db() -> None:
+    """Закрывает пул соединений."""
+    global _pool
+    if _pool is None:
+        return
+    pool, _pool = _pool, None
+    await pool.close()
+
+
+@asynccontextmanager
+async def _write_connection() -> AsyncIterator[aiosqlite.Connection]:
+    """Соединение для записи: из пула или разовое."""
+    if _pool is not None:
+        async with _pool.writer() as db:
+            yield db
+    else:
+        async with aiosqlite.connect(DB_PATH) as db:
+            db.row_factory = aiosqlite.Row
+            yield db
+
+
+@asynccontextmanager
+async def _read_connection() -> AsyncIterator[aiosqlite.Connection]:
+    """Соединение для чтения: из пула или разовое."""
+    if _pool is not None:
+        async with _pool.reader() as db:
+            yield db
+    else:
+        async with aiosqlite.connect(DB_PATH) as db:
+            db.row_factory = aiosqlite.Row
+            yield db
+
 
 async def init_db():
-    """Инициализирует базу данных и создает таблицу, если она не существует."""
+    """Инициализирует базу данных и приводит схему к последней версии."""
     async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS test_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                username TEXT,
-                name TEXT,                      -- НОВОЕ ПОЛЕ
-                citizenship TEXT,
-                card_arrests TEXT,              -- ПОЛЕ ПЕРЕИМЕНОВАНО
-                phone_number TEXT,
-                completion_date TEXT NOT NULL
-            )
-        ''')
-        await db.commit()
-    logger.info("База данных успешно инициализирована.")
+        version = await apply_migrations(db)
+    logger.info(f"База данных успешно инициализирована (версия схемы {version}).")
 
 
-async def save_test_result(state_data: dict):
-    """Сохраняет данные из FSM состояния в базу данных."""
-    params = (
-        state_data.get("user_id"),
-        state_data.get("username", "Без username"),
-        state_data.get("name"),         # <-- Добавлено
-        state_data.get("citizenship"),
-        state_data.get("card_arrests"), # <-- Обновлено
-        state_data.get("phone_number"),
-        datetime.now().isoformat()
+async def start_backfills(chunk_size: int = 500) -> None:
+    """Запускает в фоне заполнения данных, поставленные миграциями."""
+    global _backfill_task
+    if _backfill_task is not None and not _backfill_task.done():
+        return
+    _backfill_task = asyncio.create_task(
+        run_backfills(_write_connection, chunk_size=chunk_size), name="schema-backfills"
     )
-    async with aiosqlite.connect(DB_PATH) as db:
+
+
+async def stop_backfills() -> None:
+    """Прерывает фоновые заполнения. Прогресс сохранен, они продолжатся при следующем запуске."""
+    global _backfill_task
+    if _backfill_task is None:
+        return
+    task, _backfill_task = _backfill_task, None
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+async def save_test_result(state_data: dict):
+    """
+    Сохраняет данные из FSM состояния в базу данных.
+    Если кандидат уже проходил тест, его запись обновляется последними ответами.
+    С очередью записи результат пишется пачкой вместе с результатами других
+    кандидатов, но функция все равно возвращается только после коммита:
+    вызывающий код очищает состояние FSM, когда результат уже на диске.
+    """
+    row = ResultRow.from_state_data(state_data)
+    if _write_queue is not None:
+        await _write_queue.write(row)
+        logger.info(f"Результат для пользователя {state_data.get('user_id')} сохранен в БД в составе пачки.")
+        return
+    await _upsert_results([row])
+    logger.info(f"Результат для пользователя {state_data.get('user_id')} сохранен в БД.")
+
+
+async def _upsert_results(rows: Sequence[ResultRow]) -> None:
+    """
+    Записывает пачку результатов, события outbox и агрегаты одной транзакцией.
+    На кандидата хранится одна запись: повторное прохождение обновляет ответы
+    и увеличивает счетчик попыток, ID записи при этом не меняется.
+    """
+    record_ids = []
+    replaced = []
+    async with _write_connection() as db:
+        for row in rows:
+            # Прежние ответы кандидата больше не учитываются в агрегатах
+            async with db.execute(
+                "SELECT citizenship, card_arrests, phone_number, completion_date FROM test_results WHERE user_id = ?",
+                (row.user_id,)
+            ) as cursor:
+                previous = await cursor.fetchone()
+            if previous is not None:
+                citizenship, card_arrests, phone_number, completion_date = previous
+                replaced.append(ResultRow(row.user_id, None, None, citizenship, card_arrests, phone_number, None, completion_date))
+            async with db.execute(
+                '''INSERT INTO test_results 
+                   (user_id, username, name, citizenship, card_arrests, phone_number, phone_normalized, completion_date) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(user_id) DO UPDATE SET
+                       username = excluded.username,
+                       name = excluded.name,
+                       citizenship = excluded.citizenship,
+                       card_arrests = excluded.card_arrests,
+                       phone_number = excluded.phone_number,
+                       phone_normalized = excluded.phone_normalized,
+                       completion_date = excluded.completion_date,
+                       attempts = attempts + 1
+                   RETURNING id''',
+                row
+            ) as cursor:
+                record_ids.append((await cursor.fetchone())[0])
+            # Уведомление о результате уходит из outbox, только если результат записан
+            payload = row._asdict()
+            del payload["phone_normalized"]
+            await queue_event(db, RESULT_SAVED, payload)
+        await apply_stats(db, rows, replaced)
+        await db.commit()
+    _records_changed(record_ids)
+    if _outbox is not None:
+        _outbox.wakeup()
+
+
+def _is_transient_error(error: Exception) -> bool:
+    """Занятая другим соединением база освободится сама: такая запись повторяется, а не отбрасывается."""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+async def _quarantine_result(row: ResultRow, error: Exception) -> None:
+    """Сохраняет результат, который не записывается в test_results, в failed_results."""
+    async with _write_connection() as db:
         await db.execute(
-            '''INSERT INTO test_results 
-               (user_id, username, name, citizenship, card_arrests, phone_number, completion_date) 
-               VALUES (?, ?, ?, ?, ?, ?, ?)''', # <-- Обновлено
-            params
+            "INSERT INTO failed_results (payload, error, created_at) VALUES (?, ?, ?)",
+            (json.dumps(row._asdict(), ensure_ascii=False), repr(error), datetime.now().isoformat())
         )
         await db.commit()
-    logger.info(f"Результат для пользователя {state_data.get('user_id')} сохранен в БД.")
+    logger.error(f"Результат пользователя {row.user_id} не записан и сохранен в failed_results: {error!r}")
 
 
-async def get_all_results() -> List[Dict[str, Any]]:
-    """Возвращает список всех пользователей, прошедших тест."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT id, user_id, username FROM test_results ORDER BY id DESC") as cursor:
-            return [dict(row) for row in await cursor.fetchall()]
+def _records_changed(record_ids: Iterable[int]) -> None:
+    """Сбрасывает закэшированные карточки измененных записей."""
+    record_cards.invalidate(*record_ids)
 
 
-async def get_result_by_id(record_id: int) -> Optional[Dict[str, Any]]:
-    """Возвращает полную информацию о записи по её ID в базе."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+async def count_results() -> int:
+    """Возвращает количество записей в рабочей таблице (без архива)."""
+    async with _read_connection() as db:
+        async with db.execute("SELECT COUNT(*) FROM test_results") as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def get_results_page(
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = 10
+) -> List[Dict[str, Any]]:
+    """
+    Возвращает страницу записей (от новых к старым) с keyset-пагинацией.
+    before_id - следующая страница (записи старее), after_id - предыдущая (записи новее).
+    Поиск идет по первичному ключу, поэтому стоимость страницы не зависит от размера таблицы.
+    """
+    columns = "id, user_id, username, name"
+    if after_id is not None:
+        query = f"SELECT {columns} FROM test_results WHERE id > ? ORDER BY id ASC LIMIT ?"
+        params = (after_id, limit)
+    elif before_id is not None:
+        query = f"SELECT {columns} FROM test_results WHERE id < ? ORDER BY id DESC LIMIT ?"
+        params = (before_id, limit)
+    else:
+        query = f"SELECT {columns} FROM test_results ORDER BY id DESC LIMIT ?"
+        params = (limit,)
+
+    async with _read_connection() as db:
+        async with db.execute(query, params) as cursor:
+            rows = [dict(row) for row in await cursor.fetchall()]
+
+    if after_id is not None:
+        rows.reverse()
+    return rows
+
+
+async def iter_results(
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    chunk_size: int = 500,
+    include_archive: bool = False
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Построчно отдает записи за период [date_from, date_to) в порядке прохождения.
+    Даты - строки ISO (YYYY-MM-DD). Записи читаются страницами по chunk_size
+    с keyset-пагинацией по (completion_date, id), поэтому потребление памяти
+    не зависит от размера таблицы. Соединение-читатель берется из пула только
+    на время чтения страницы: медленная выгрузка не занимает его между страницами.
+    С include_archive сначала отдаются записи из архивных сегментов (они всегда старше).
+    """
+    if include_archive:
+        async for row in iter_archived(ARCHIVE_DIR, date_from, date_to):
+            yield row
+
+    conditions, params = [], []
+    if date_from:
+        conditions.append("completion_date >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("completion_date < ?")
+        params.append(date_to)
+
+    last: Optional[Tuple[str, int]] = None
+    while True:
+        page_conditions, page_params = list(conditions), list(params)
+        if last is not None:
+            page_conditions.append("(completion_date, id) > (?, ?)")
+            page_params.extend(last)
+        where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+        async with _read_connection() as db:
+            async with db.execute(
+                f"SELECT * FROM test_results {where} ORDER BY completion_date, id LIMIT ?",
+                (*page_params, chunk_size)
+            ) as cursor:
+                rows = [dict(row) for row in await cursor.fetchall()]
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            break
+        last = (rows[-1]["completion_date"], rows[-1]["id"])
+
+
+async def find_results(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Ищет записи по имени, username и телефону через полнотекстовый индекс."""
+    async with _read_connection() as db:
+        return await search_results(db, query, limit=limit)
+
+
+async def get_stats(days: int = 7, hours: int = 24) -> Dict[str, Dict[str, int]]:
+    """Возвращает агрегаты: общие, за последние days дней и hours часов."""
+    async with _read_connection() as db:
+        return await read_stats(db, datetime.now(), days=days, hours=hours)
+
+
+async def get_result_by_id(record_id: int, include_archive: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Возвращает полную информацию о записи по её ID в базе.
+    С include_archive запись, которой нет в таблице, ищется в архиве.
+    """
+    async with _read_connection() as db:
         async with db.execute("SELECT * FROM test_results WHERE id = ?", (record_id,)) as cursor:
             row = await cursor.fetchone()
-            return dict(row) if row else None
\ No newline at end of file
+    if row:
+        return dict(row)
+    if include_archive:
+        return await find_archived(ARCHIVE_DIR, record_id)
+    return None
+
+
+async def load_fsm_session(key: str, owner: Optional[str] = None) -> Optional[Tuple[Optional[str], str]]:
+    """
+    Возвращает состояние FSM и его данные (JSON) по ключу или None, если сессии нет.
+    Сессия без владельца (записанная до их учета) сначала закрепляется за owner,
+    чтобы ее не удалила чистка другого процесса, пока она лежит в кэше этого.
+    """
+    query = "SELECT state, data, owner FROM fsm_sessions WHERE key = ?"
+    async with _read_connection() as db:
+        async with db.execute(query, (key,)) as cursor:
+            row = await cursor.fetchone()
+    if row and row[2] is None and owner is not None:
+        async with _write_connection() as db:
+            await db.execute("UPDATE fsm_sessions SET owner = ? WHERE key = ? AND owner IS NULL", (owner, key))
+            await db.commit()
+            # Чистка могла удалить сессию до закрепления
+            async with db.execute(query, (key,)) as cursor:
+                row = await cursor.fetchone()
+    return (row[0], row[1]) if row else None
+
+
+async def save_fsm_field(key: str, field: str, value: Optional[str], owner: Optional[str] = None) -> None:
+    """
+    Записывает состояние (field='state') или данные (field='data') сессии FSM.
+    owner - ключ aiogram в JSON, по нему сессия удаляется под блокировкой пользователя.
+    Пустая сессия (без состояния и данных) удаляется, чтобы таблица не росла.
+    """
+    if field not in ("state", "data"):
+        raise ValueError(f"Неизвестное поле сессии FSM: {field}")
+    async with _write_connection() as db:
+        await db.execute(
+            f"INSERT INTO fsm_sessions (key, {field}, owner, updated_at) VALUES (?, ?, ?, ?) "
+            f"ON CONFLICT(key) DO UPDATE SET {field} = excluded.{field}, "
+            f"owner = COALESCE(excluded.owner, owner), updated_at = excluded.updated_at",
+            (key, value, owner, time.time())
+        )
+        await db.execute("DELETE FROM fsm_sessions WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+        await db.commit()
+
+
+async def save_fsm_session(key: str, state: Optional[str], data: str, owner: Optional[str] = None) -> None:
+    """Записывает состояние и данные сессии FSM одной командой (пустая сессия удаляется)."""
+    async with _write_connection() as db:
+        if state is None and data == "{}":
+            await db.execute("DELETE FROM fsm_sessions WHERE key = ?", (key,))
+        else:
+            await db.execute(
+                "INSERT INTO fsm_sessions (key, state, data, owner, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "owner = COALESCE(excluded.owner, owner), updated_at = excluded.updated_at",
+                (key, state, data, owner, time.time())
+            )
+        await db.commit()
+
+
+def _shard_filter(shard: Optional[Tuple[int, int]]) -> Tuple[str, Tuple[int, ...]]:
+    """
+    Условие на сессии процесса index из count (shard), как при раскладке обновлений
+    по user_id. Сессии без владельца относятся к первому процессу.
+    """
+    if shard is None:
+        return "1", ()
+    index, count = shard
+    # Остаток как в Python: неотрицательный и для отрицательных ID
+    condition = "(json_extract(owner, '$.user_id') % ? + ?) % ? = ?"
+    if index == 0:
+        condition = f"(owner IS NULL OR {condition})"
+    return condition, (count, count, count, index)
+
+
+async def idle_fsm_sessions(
+    before: float,
+    limit: int,
+    shard: Optional[Tuple[int, int]] = None
+) -> List[Tuple[str, Optional[str], float]]:
+    """
+    Сессии FSM (ключ, владелец, время записи), не менявшиеся с момента before, старые первыми.
+    shard - (index, count): только сессии пользователей процесса index из count.
+    """
+    condition, params = _shard_filter(shard)
+    async with _read_connection() as db:
+        async with db.execute(
+            f"SELECT key, owner, updated_at FROM fsm_sessions WHERE updated_at < ? AND {condition} "
+            "ORDER BY updated_at LIMIT ?",
+            (before, *params, limit)
+        ) as cursor:
+            return [(row[0], row[1], row[2]) for row in await cursor.fetchall()]
+
+
+async def oldest_fsm_sessions(
+    keep: int,
+    limit: int,
+    shard: Optional[Tuple[int, int]] = None
+) -> List[Tuple[str, Optional[str], float]]:
+    """До limit самых давно менявшихся сессий FSM сверх keep самых свежих (в пределах shard)."""
+    condition, params = _shard_filter(shard)
+    async with _read_connection() as db:
+        async with db.execute(
+            f"SELECT key, owner, updated_at FROM fsm_sessions WHERE {condition} ORDER BY updated_at "
+            f"LIMIT MIN(?, MAX(0, (SELECT COUNT(*) FROM fsm_sessions WHERE {condition}) - ?))",
+            (*params, limit, *params, keep)
+        ) as cursor:
+            return [(row[0], row[1], row[2]) for row in await cursor.fetchall()]
+
+
+async def delete_fsm_session(key: str, updated_at: float, owner: Optional[str] = None) -> bool:
+    """
+    Удаляет сессию FSM, если она не менялась после updated_at и ее владелец по-прежнему owner.
+    False - сессии уже нет, в нее успели записать или ее закрепил другой процесс.
+    """
+    async with _write_connection() as db:
+        cursor = await db.execute(
+            "DELETE FROM fsm_sessions WHERE key = ? AND updated_at <= ? AND owner IS ?", (key, updated_at, owner)
+        )
+        await db.commit()
+        return cursor.rowcount > 0
+
+
+async def fsm_sessions_stats() -> Dict[str, int]:
+    """Количество сессий FSM и их объем в байтах."""
+    async with _read_connection() as db:
+        async with db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(COALESCE(state, '') AS BLOB)) "
+            "+ LENGTH(CAST(data AS BLOB))), 0) FROM fsm_sessions"
+        ) as cursor:
+            count, size = await cursor.fetchone()
+    return {"sessions": count, "bytes": size}
+
+
+async def queue_digest_entry(chat_ids: Sequence[int], entry: str) -> None:
+    """Сохраняет запись сводки для каждого админа; она удаляется после отправки ему сводки."""
+    created_at = datetime.now().isoformat()
+    async with _write_connection() as db:
+        await db.executemany(
+            "INSERT INTO admin_digest (chat_id, entry, created_at) VALUES (?, ?, ?)",
+            [(chat_id, entry, created_at) for chat_id in chat_ids]
+        )
+        await db.commit()
+
+
+async def load_digest_entries(max_attempts: int, limit: int = 1000) -> List[Tuple[int, int, str]]:
+    """До limit записей сводки (id, chat_id, entry) в порядке добавления, без исчерпавших попытки."""
+    async with _read_connection() as db:
+        async with db.execute(
+            "SELECT id, chat_id, entry FROM admin_digest WHERE attempts < ? ORDER BY id LIMIT ?",
+            (max_attempts, limit)
+        ) as cursor:
+            return [(row[0], row[1], row[2]) for row in await cursor.fetchall()]
+
+
+async def complete_digest_entries(sent: Sequence[int], failed: Sequence[int], error: Optional[str] = None) -> None:
+    """Удаляет отправленные записи сводки, неотправленным увеличивает счетчик попыток."""
+    async with _write_connection() as db:
+        await db.executemany("DELETE FROM admin_digest WHERE id = ?", [(entry_id,) for entry_id in sent])
+        await db.executemany(
+            "UPDATE admin_digest SET attempts = attempts + 1, last_error = ? WHERE id = ?",
+            [(error, entry_id) for entry_id in failed]
+        )
+        await db.commit()
@@ -0,0 +1,228 @@
+# your_bot/database/fsm_storage.py
+
+"""
+Хранилище FSM aiogram поверх базы данных бота.
+Незавершенные анкеты (TestStates) переживают перезапуск и деплой,
+а не живут только в памяти процесса, как в MemoryStorage.
+На ключ хранится одна строка (state, data в JSON). Недавно использованные
+ключи держатся в кэше со сквозной записью, поэтому повторное чтение
+состояния во время анкеты не обращается к базе.
+StripedEventIsolation упорядочивает обработку обновлений одного пользователя.
+"""
+import asyncio
+import dataclasses
+import json
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (
+    BaseEventIsolation, BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+)
+
+from . import db_manager
+from .cache import TTLCache
+from .session_limits import ExpiringStorage, IdleSession
+
+
+def _dump_data(data: Mapping[str, Any]) -> str:
+    return json.dumps(dict(data), ensure_ascii=False, separators=(",", ":"))
+
+
+def _dump_owner(key: StorageKey) -> str:
+    return json.dumps(dataclasses.asdict(key), separators=(",", ":"))
+
+
+def _load_owner(owner: Optional[str]) -> Optional[StorageKey]:
+    return StorageKey(**json.loads(owner)) if owner else None
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_sessions.
+    Запись идет сразу в базу, затем обновляет кэш; чтение сначала смотрит в кэш.
+    Отсутствие сессии тоже кэшируется, чтобы новые пользователи не вызывали лишних запросов.
+    Кэш локален для процесса: сессию пользователя должен читать и писать один процесс
+    (в многопроцессном режиме - тот, за которым закреплен пользователь).
+    Каждая запись отмечает время в строке сессии, поэтому хранилище само служит
+    индексом сессий для ExpiringStorage и чистка идет запросами к базе.
+    shard - (index, count): чистка видит только сессии пользователей этого процесса,
+    поэтому удаляет их под его блокировками и сбрасывает его кэш.
+    """
+
+    def __init__(
+        self,
+        cache_size: int = 1024,
+        cache_ttl: float = 600.0,
+        key_builder: Optional[KeyBuilder] = None,
+        shard: Optional[Tuple[int, int]] = None
+    ):
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self.shard = shard
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        # Блокировки ключей со счетчиком ожидающих: чтение из базы при промахе
+        # не должно положить в кэш значение, которое параллельно уже перезаписано
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def _key_lock(self, key: str) -> AsyncIterator[None]:
+        lock, waiters = self._locks.get(key, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._locks[key] = (lock, waiters + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, waiters = self._locks[key]
+            if waiters == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, waiters - 1)
+
+    async def _load(self, key: str, owner: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Сессия из кэша или из базы. Вызывается под блокировкой ключа."""
+        entry = self.cache.get(key)
+        if entry is None:
+            row = await db_manager.load_fsm_session(key, _dump_owner(owner))
+            entry = (row[0], json.loads(row[1])) if row else (None, {})
+            self.cache.put(key, entry)
+        return entry
+
+    async def _get(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        storage_key = self.key_builder.build(key)
+        entry = self.cache.get(storage_key)
+        if entry is not None:
+            return entry
+        async with self._key_lock(storage_key):
+            return await self._load(storage_key, key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        storage_key = self.key_builder.build(key)
+        async with self._key_lock(storage_key):
+            _, data = await self._load(storage_key, key)
+            await db_manager.save_fsm_field(storage_key, "state", state, _dump_owner(key))
+            # Кэш обновляется только после успешной записи в базу
+            self.cache.put(storage_key, (state, data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        payload = _dump_data(data)
+        async with self._key_lock(storage_key):
+            state, _ = await self._load(storage_key, key)
+            await db_manager.save_fsm_field(storage_key, "data", payload, _dump_owner(key))
+            self.cache.put(storage_key, (state, dict(data)))
+
+    async def update_data_and_set_state(
+        self,
+        key: StorageKey,
+        data: Mapping[str, Any],
+        state: StateType = None
+    ) -> Dict[str, Any]:
+        """
+        Дополняет данные и меняет состояние одной записью в базу.
+        Текущие данные для слияния обычно берутся из кэша, без чтения из базы.
+        """
+        state = state.state if isinstance(state, State) else state
+        storage_key = self.key_builder.build(key)
+        async with self._key_lock(storage_key):
+            _, current = await self._load(storage_key, key)
+            merged = {**current, **data}
+            await db_manager.save_fsm_session(storage_key, state, _dump_data(merged), _dump_owner(key))
+            self.cache.put(storage_key, (state, merged))
+        return merged.copy()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get(key)
+        # Копия, чтобы изменения у вызывающего кода не попадали в кэш
+        return data.copy()
+
+    async def idle_sessions(self, before: float, limit: int) -> List[IdleSession]:
+        rows = await db_manager.idle_fsm_sessions(before, limit, self.shard)
+        return [IdleSession(_load_owner(owner), key, updated_at) for key, owner, updated_at in rows]
+
+    async def overflow_sessions(self, keep: int, limit: int) -> List[IdleSession]:
+        rows = await db_manager.oldest_fsm_sessions(keep, limit, self.shard)
+        return [IdleSession(_load_owner(owner), key, updated_at) for key, owner, updated_at in rows]
+
+    async def expire_session(self, session: IdleSession) -> bool:
+        async with self._key_lock(session.index_key):
+            owner = _dump_owner(session.key) if session.key is not None else None
+            expired = await db_manager.delete_fsm_session(session.index_key, session.touched_at, owner)
+            if expired:
+                self.cache.invalidate(session.index_key)
+        return expired
+
+    async def session_stats(self) -> Dict[str, int]:
+        return await db_manager.fsm_sessions_stats()
+
+    async def close(self) -> None:
+        self.cache.clear()
+
+
+class StripedEventIsolation(BaseEventIsolation):
+    """
+    Изоляция событий для диспетчера: обновления одного пользователя обрабатываются
+    по очереди (asyncio.Lock пропускает ожидающих в порядке прихода), поэтому
+    два быстрых сообщения не затирают друг другу state.update_data.
+    Пользователи делятся между stripes блокировками по хэшу: память не растет
+    с числом пользователей, а разные пользователи ждут друг друга, только
+    попав на одну блокировку.
+    """
+
+    def __init__(self, stripes: int = 1024):
+        self.stripes = max(1, stripes)
+        self._locks: List[asyncio.Lock] = [asyncio.Lock() for _ in range(self.stripes)]
+
+    def _stripe(self, key: StorageKey) -> asyncio.Lock:
+        # По пользователю, а не по чату: его обновления из разных чатов тоже идут по очереди
+        return self._locks[hash((key.bot_id, key.user_id)) % self.stripes]
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncIterator[None]:
+        async with self._stripe(key):
+            yield
+
+    async def close(self) -> None:
+        # Новые блокировки не привязаны к циклу событий, в котором работали старые
+        self._locks = [asyncio.Lock() for _ in range(self.stripes)]
+
+
+def create_fsm_storage(
+    backend: str,
+    cache_size: int = 1024,
+    session_ttl: float = 0,
+    max_sessions: int = 0,
+    redis_url: Optional[str] = None,
+    isolation: Optional[BaseEventIsolation] = None,
+    shard: Optional[Tuple[int, int]] = None
+) -> BaseStorage:
+    """
+    Создает хранилище FSM по имени бэкенда из конфигурации.
+    При ненулевых session_ttl (сек) или max_sessions заброшенные сессии удаляются
+    под блокировкой isolation (та же изоляция событий, что у диспетчера).
+    shard - (index, count) для процесса-обработчика: он чистит только сессии своих
+    пользователей, а лимит max_sessions делится между процессами.
+    """
+    if shard is not None and max_sessions > 0:
+        max_sessions = -(-max_sessions // shard[1])
+    if backend == "sqlite":
+        storage: BaseStorage = SQLiteStorage(cache_size=cache_size, shard=shard)
+    elif backend == "memory":
+        from aiogram.fsm.storage.memory import MemoryStorage
+        storage = MemoryStorage()
+    elif backend == "redis":
+        # Общее хранилище нескольких процессов: время жизни сессий отслеживает сам Redis,
+        # учет сессий в памяти одного процесса здесь неприменим
+        from .redis_storage import RedisHashStorage
+        return RedisHashStorage.from_url(redis_url, session_ttl=int(session_ttl))
+    else:
+        raise ValueError(f"Неизвестное хранилище FSM: {backend}")
+
+    if session_ttl > 0 or max_sessions > 0:
+        storage = ExpiringStorage(storage, ttl=session_ttl, max_sessions=max_sessions, isolation=isolation)
+    return storage
@@ -0,0 +1,429 @@
+# your_bot/database/migrations.py
+
+"""
+Версионные миграции схемы базы данных.
+Текущая версия схемы хранится в PRAGMA user_version. При старте применяются
+все миграции с номером больше текущего, каждая в своей транзакции.
+Тяжелые заполнения данных (backfill) выполняются в фоне небольшими порциями,
+чтобы бот продолжал обслуживать пользователей во время миграции.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import AsyncContextManager, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from .models import ResultRow
+from .normalize import normalize_phone
+from .stats import apply_stats
+
+logger = logging.getLogger(__name__)
+
+ConnectionFactory = Callable[[], AsyncContextManager[aiosqlite.Connection]]
+# Шаг заполнения: получает ID последней обработанной записи и размер порции,
+# возвращает новый последний ID или None, если заполнять больше нечего
+BackfillStep = Callable[[aiosqlite.Connection, int, int], Awaitable[Optional[int]]]
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    statements: List[str]
+    # Имена фоновых заполнений, которые миграция ставит в очередь
+    backfills: Tuple[str, ...] = ()
+    # Некоторые команды (например, VACUUM) нельзя выполнять внутри транзакции
+    transactional: bool = True
+    # Действие после statements, когда шаг зависит от состояния базы
+    action: Optional[Callable[[aiosqlite.Connection], Awaitable[None]]] = None
+
+
+# VACUUM при миграции выполняется только для небольшой базы: он перестраивает
+# весь файл и держит запись, большая база сжимается командой /vacuum
+VACUUM_ON_MIGRATION_MAX_BYTES = 64 * 1024 * 1024
+
+
+async def database_size(db: aiosqlite.Connection) -> int:
+    """Размер файла базы в байтах."""
+    async with db.execute("PRAGMA page_count") as cursor:
+        pages = (await cursor.fetchone())[0]
+    async with db.execute("PRAGMA page_size") as cursor:
+        return pages * (await cursor.fetchone())[0]
+
+
+async def _vacuum_if_small(db: aiosqlite.Connection) -> None:
+    size = await database_size(db)
+    if size <= VACUUM_ON_MIGRATION_MAX_BYTES:
+        await db.execute("VACUUM")
+        return
+    logger.warning(
+        f"База занимает {size / 2 ** 20:.0f} МБ, VACUUM при запуске пропущен: "
+        f"режим auto_vacuum включится после команды /vacuum."
+    )
+
+
+# Запись old уже есть в полнотекстовом индексе: она новее границы фонового
+# заполнения индекса или заполнение до нее уже дошло
+_FTS_INDEXED = (
+    "old.id > (SELECT max_id FROM test_results_fts_backfill) "
+    "OR old.id <= (SELECT last_id FROM schema_backfills WHERE name = 'test_results_fts')"
+)
+
+
+# ===> МИГРАЦИИ <===
+# Новые миграции добавляются только в конец списка с увеличением версии.
+MIGRATIONS: List[Migration] = [
+    Migration(
+        version=1,
+        description="Таблица результатов тестов",
+        statements=[
+            '''
+            CREATE TABLE IF NOT EXISTS test_results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                username TEXT,
+                name TEXT,
+                citizenship TEXT,
+                card_arrests TEXT,
+                phone_number TEXT,
+                completion_date TEXT NOT NULL
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS schema_backfills (
+                name TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL DEFAULT 0,
+                done INTEGER NOT NULL DEFAULT 0
+            )
+            ''',
+        ],
+    ),
+    Migration(
+        version=2,
+        description="Нормализованный номер телефона",
+        statements=[
+            "ALTER TABLE test_results ADD COLUMN phone_normalized TEXT",
+        ],
+        backfills=("phone_normalized",),
+    ),
+    Migration(
+        version=3,
+        description="Индекс по дате прохождения для выгрузки по периоду",
+        statements=[
+            "CREATE INDEX IF NOT EXISTS idx_test_results_completion_date ON test_results (completion_date)",
+        ],
+    ),
+    Migration(
+        version=4,
+        description="Агрегаты для /stats",
+        statements=[
+            '''
+            CREATE TABLE IF NOT EXISTS result_stats (
+                bucket TEXT PRIMARY KEY,
+                total INTEGER NOT NULL DEFAULT 0,
+                citizenship_yes INTEGER NOT NULL DEFAULT 0,
+                citizenship_no INTEGER NOT NULL DEFAULT 0,
+                arrests_yes INTEGER NOT NULL DEFAULT 0,
+                arrests_no INTEGER NOT NULL DEFAULT 0,
+                with_phone INTEGER NOT NULL DEFAULT 0
+            )
+            ''',
+            # Пересчет по уже накопленным данным выполняет фоновое заполнение, а не запуск бота.
+            # Граница фиксируется здесь: новые записи считает сама запись результата
+            '''
+            CREATE TABLE IF NOT EXISTS result_stats_backfill AS
+            SELECT COALESCE(MAX(id), 0) AS max_id FROM test_results
+            ''',
+        ],
+        backfills=("result_stats",),
+    ),
+    Migration(
+        version=5,
+        description="Одна запись на кандидата: счетчик попыток и уникальный user_id",
+        statements=[
+            "ALTER TABLE test_results ADD COLUMN attempts INTEGER NOT NULL DEFAULT 1",
+            # Разовая очистка дублей: остается последняя запись кандидата с числом его попыток
+            '''
+            CREATE TEMP TABLE dedup_results AS
+            SELECT user_id, MAX(id) AS keep_id, COUNT(*) AS attempts
+            FROM test_results GROUP BY user_id HAVING COUNT(*) > 1
+            ''',
+            '''
+            UPDATE test_results
+            SET attempts = (SELECT attempts FROM dedup_results WHERE keep_id = test_results.id)
+            WHERE id IN (SELECT keep_id FROM dedup_results)
+            ''',
+            '''
+            DELETE FROM test_results
+            WHERE user_id IN (SELECT user_id FROM dedup_results)
+              AND id NOT IN (SELECT keep_id FROM dedup_results)
+            ''',
+            "DROP TABLE dedup_results",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_test_results_user_id ON test_results (user_id)",
+        ],
+    ),
+    Migration(
+        version=6,
+        description="Инкрементальная очистка места после архивации",
+        statements=[
+            "PRAGMA auto_vacuum = INCREMENTAL",
+        ],
+        # Режим auto_vacuum для существующей базы вступает в силу только после VACUUM
+        action=lambda db: _vacuum_if_small(db),
+        transactional=False,
+    ),
+    Migration(
+        version=7,
+        description="Полнотекстовый индекс для /find",
+        statements=[
+            # Индекс без собственной копии данных (content=''): строки читаются из test_results.
+            # prefix ускоряет поиск по началу слова и номера
+            '''
+            CREATE VIRTUAL TABLE IF NOT EXISTS test_results_fts USING fts5(
+                name, username, phone, content='', prefix='2 3'
+            )
+            ''',
+            # Уже накопленные записи индексирует фоновое заполнение до этой границы,
+            # записи новее индексируют триггеры
+            '''
+            CREATE TABLE IF NOT EXISTS test_results_fts_backfill AS
+            SELECT COALESCE(MAX(id), 0) AS max_id FROM test_results
+            ''',
+            # Для удаления из такого индекса нужны ровно те значения, что были проиндексированы.
+            # Запись, до которой фоновое заполнение еще не дошло, в индексе отсутствует:
+            # триггеры её пропускают, заполнение проиндексирует её актуальные значения
+            '''
+            CREATE TRIGGER IF NOT EXISTS test_results_fts_insert AFTER INSERT ON test_results BEGIN
+                INSERT INTO test_results_fts (rowid, name, username, phone)
+                VALUES (new.id, new.name, new.username, new.phone_normalized);
+            END
+            ''',
+            f'''
+            CREATE TRIGGER IF NOT EXISTS test_results_fts_delete AFTER DELETE ON test_results
+            WHEN {_FTS_INDEXED} BEGIN
+                INSERT INTO test_results_fts (test_results_fts, rowid, name, username, phone)
+                VALUES ('delete', old.id, old.name, old.username, old.phone_normalized);
+            END
+            ''',
+            f'''
+            CREATE TRIGGER IF NOT EXISTS test_results_fts_update
+            AFTER UPDATE OF name, username, phone_normalized ON test_results
+            WHEN {_FTS_INDEXED} BEGIN
+                INSERT INTO test_results_fts (test_results_fts, rowid, name, username, phone)
+                VALUES ('delete', old.id, old.name, old.username, old.phone_normalized);
+                INSERT INTO test_results_fts (rowid, name, username, phone)
+                VALUES (new.id, new.name, new.username, new.phone_normalized);
+            END
+            ''',
+        ],
+        backfills=("test_results_fts",),
+    ),
+    Migration(
+        version=8,
+        description="Состояния FSM незавершенных анкет",
+        statements=[
+            # Одна строка на ключ, без rowid: ключ и есть первичный индекс
+            '''
+            CREATE TABLE IF NOT EXISTS fsm_sessions (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}'
+            ) WITHOUT ROWID
+            ''',
+        ],
+    ),
+    Migration(
+        version=9,
+        description="Outbox побочных действий после сохранения результата",
+        statements=[
+            # Строки пишутся в одной транзакции с результатом и удаляются после обработки
+            '''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at TEXT NOT NULL
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at)",
+        ],
+    ),
+    Migration(
+        version=10,
+        description="Результаты, которые не удалось записать",
+        statements=[
+            # Строка попадает сюда, только если не записывается и отдельно от пачки;
+            # разбирается вручную, кандидат свой результат при этом не теряет
+            '''
+            CREATE TABLE IF NOT EXISTS failed_results (
+                id INTEGER PRIMARY KEY,
+                payload TEXT NOT NULL,
+                error TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            ''',
+        ],
+    ),
+    Migration(
+        version=11,
+        description="Время последней записи и владелец сессии FSM",
+        statements=[
+            # owner - ключ aiogram (JSON), чтобы удалять сессию под блокировкой ее пользователя
+            "ALTER TABLE fsm_sessions ADD COLUMN owner TEXT",
+            "ALTER TABLE fsm_sessions ADD COLUMN updated_at REAL NOT NULL DEFAULT 0",
+            # Время жизни существующих сессий отсчитывается с момента миграции
+            "UPDATE fsm_sessions SET updated_at = CAST(strftime('%s', 'now') AS REAL)",
+            "CREATE INDEX IF NOT EXISTS idx_fsm_sessions_updated ON fsm_sessions (updated_at)",
+        ],
+    ),
+    Migration(
+        version=12,
+        description="Записи сводки для администраторов",
+        statements=[
+            # Строка на результат и админа; удаляется, только когда админ получил сводку с ней
+            '''
+            CREATE TABLE IF NOT EXISTS admin_digest (
+                id INTEGER PRIMARY KEY,
+                chat_id INTEGER NOT NULL,
+                entry TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at TEXT NOT NULL
+            )
+            ''',
+        ],
+    ),
+]
+
+
+async def _backfill_phone_normalized(db: aiosqlite.Connection, last_id: int, chunk_size: int) -> Optional[int]:
+    async with db.execute(
+        "SELECT id, phone_number FROM test_results WHERE id > ? ORDER BY id LIMIT ?",
+        (last_id, chunk_size)
+    ) as cursor:
+        rows = await cursor.fetchall()
+    if not rows:
+        return None
+    await db.executemany(
+        "UPDATE test_results SET phone_normalized = ? WHERE id = ?",
+        [(normalize_phone(phone), record_id) for record_id, phone in rows]
+    )
+    return rows[-1][0]
+
+
+async def _backfill_result_stats(db: aiosqlite.Connection, last_id: int, chunk_size: int) -> Optional[int]:
+    # Только записи, существовавшие до миграции: более новые уже учтены при сохранении
+    async with db.execute(
+        "SELECT id, citizenship, card_arrests, phone_number, completion_date FROM test_results "
+        "WHERE id > ? AND id <= (SELECT max_id FROM result_stats_backfill) ORDER BY id LIMIT ?",
+        (last_id, chunk_size)
+    ) as cursor:
+        rows = await cursor.fetchall()
+    if not rows:
+        await db.execute("DROP TABLE IF EXISTS result_stats_backfill")
+        return None
+    await apply_stats(db, [
+        ResultRow(None, None, None, citizenship, card_arrests, phone, None, completion_date)
+        for _, citizenship, card_arrests, phone, completion_date in rows
+    ])
+    return rows[-1][0]
+
+
+async def _backfill_test_results_fts(db: aiosqlite.Connection, last_id: int, chunk_size: int) -> Optional[int]:
+    async with db.execute(
+        "SELECT id, name, username, phone_normalized FROM test_results "
+        "WHERE id > ? AND id <= (SELECT max_id FROM test_results_fts_backfill) ORDER BY id LIMIT ?",
+        (last_id, chunk_size)
+    ) as cursor:
+        rows = [tuple(row) for row in await cursor.fetchall()]
+    if not rows:
+        return None
+    await db.executemany("INSERT INTO test_results_fts (rowid, name, username, phone) VALUES (?, ?, ?, ?)", rows)
+    return rows[-1][0]
+
+
+BACKFILLS: Dict[str, BackfillStep] = {
+    "phone_normalized": _backfill_phone_normalized,
+    "result_stats": _backfill_result_stats,
+    "test_results_fts": _backfill_test_results_fts,
+}
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1].version
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    async with db.execute("PRAGMA user_version") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def apply_migrations(db: aiosqlite.Connection) -> int:
+    """
+    Применяет недостающие миграции по порядку и возвращает итоговую версию схемы.
+    Миграция и обновление user_version коммитятся вместе, поэтому прерванная
+    миграция при следующем запуске повторяется целиком. Нетранзакционные
+    миграции должны быть идемпотентными.
+    """
+    current = await get_schema_version(db)
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        if migration.transactional:
+            await db.execute("BEGIN")
+        try:
+            for statement in migration.statements:
+                await db.execute(statement)
+            if migration.action is not None:
+                await migration.action(db)
+            for name in migration.backfills:
+                await db.execute(
+                    "INSERT OR REPLACE INTO schema_backfills (name, last_id, done) VALUES (?, 0, 0)",
+                    (name,)
+                )
+            await db.execute(f"PRAGMA user_version = {migration.version}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logger.exception(f"Миграция {migration.version} ({migration.description}) не применена.")
+            raise
+        current = migration.version
+        logger.info(f"Применена миграция {migration.version}: {migration.description}.")
+    return current
+
+
+async def run_backfills(connection: ConnectionFactory, chunk_size: int = 500, pause: float = 0.05) -> None:
+    """
+    Выполняет незавершенные фоновые заполнения.
+    Каждая порция - отдельная короткая транзакция на соединении-писателе,
+    между порциями запись результатов кандидатов идет как обычно.
+    Прогресс сохраняется, поэтому после перезапуска заполнение продолжается с места остановки.
+    """
+    async with connection() as db:
+        async with db.execute("SELECT name, last_id FROM schema_backfills WHERE done = 0") as cursor:
+            pending = [tuple(row) for row in await cursor.fetchall()]
+
+    for name, last_id in pending:
+        step = BACKFILLS.get(name)
+        if step is None:
+            logger.warning(f"Неизвестное фоновое заполнение '{name}' пропущено.")
+            continue
+        logger.info(f"Фоновое заполнение '{name}' начато с ID {last_id}.")
+        while True:
+            async with connection() as db:
+                new_last_id = await step(db, last_id, chunk_size)
+                if new_last_id is None:
+                    await db.execute("UPDATE schema_backfills SET done = 1 WHERE name = ?", (name,))
+                else:
+                    await db.execute("UPDATE schema_backfills SET last_id = ? WHERE name = ?", (new_last_id, name))
+                await db.commit()
+            if new_last_id is None:
+                break
+            last_id = new_last_id
+            # Отдаем управление обработчикам между порциями
+            await asyncio.sleep(pause)
+        logger.info(f"Фоновое заполнение '{name}' завершено.")
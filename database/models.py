@@ -0,0 +1,35 @@
+# your_bot/database/models.py
+
+"""
+Структуры строк, которые записываются в базу.
+"""
+from datetime import datetime
+from typing import Any, Dict, NamedTuple, Optional
+
+from .normalize import normalize_phone
+
+
+class ResultRow(NamedTuple):
+    """Строка таблицы test_results в порядке колонок INSERT."""
+    user_id: int
+    username: Optional[str]
+    name: Optional[str]
+    citizenship: Optional[str]
+    card_arrests: Optional[str]
+    phone_number: Optional[str]
+    phone_normalized: Optional[str]
+    completion_date: str
+
+    @classmethod
+    def from_state_data(cls, state_data: Dict[str, Any]) -> "ResultRow":
+        """Собирает строку из данных FSM состояния."""
+        return cls(
+            user_id=state_data.get("user_id"),
+            username=state_data.get("username", "Без username"),
+            name=state_data.get("name"),
+            citizenship=state_data.get("citizenship"),
+            card_arrests=state_data.get("card_arrests"),
+            phone_number=state_data.get("phone_number"),
+            phone_normalized=normalize_phone(state_data.get("phone_number")),
+            completion_date=datetime.now().isoformat(),
+        )
@@ -0,0 +1,24 @@
+# your_bot/database/normalize.py
+
+"""
+Нормализация значений перед сохранением в базу.
+"""
+import re
+from typing import Optional
+
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """
+    Приводит номер телефона к виду 7XXXXXXXXXX (только цифры).
+    Номера, которые не похожи на российские, возвращаются как набор цифр.
+    """
+    if not phone:
+        return None
+    digits = re.sub(r'\D', '', phone)
+    if not digits:
+        return None
+    if len(digits) == 11 and digits.startswith('8'):
+        return '7' + digits[1:]
+    if len(digits) == 10:
+        return '7' + digits
+    return digits
@@ -0,0 +1,158 @@
+# your_bot/database/outbox.py
+
+"""
+Transactional outbox для побочных действий после сохранения результата.
+Событие (например, "результат сохранен" - уведомить админов) записывается
+в таблицу outbox в той же транзакции, что и сам результат, поэтому
+сохраненный результат не может остаться без уведомления, даже если бот
+упадет сразу после записи. Фоновый воркер забирает события пачками,
+выполняет обработчики и удаляет обработанные строки; при ошибке событие
+повторяется с экспоненциальной задержкой.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+ConnectionFactory = Callable[[], AsyncContextManager[aiosqlite.Connection]]
+
+# Обработчик события. Вернуть словарь - повторить событие позже с этими данными
+# (например, только для админов, которым не удалось доставить), None - событие обработано.
+OutboxHandler = Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+
+# Событие, которое ставит каждое сохранение результата
+RESULT_SAVED = "result_saved"
+
+
+async def queue_event(db: aiosqlite.Connection, kind: str, payload: Dict[str, Any]) -> None:
+    """Добавляет событие в outbox. Коммит - забота вызывающего, вместе с основной записью."""
+    await db.execute(
+        "INSERT INTO outbox (kind, payload, created_at) VALUES (?, ?, ?)",
+        (kind, json.dumps(payload, ensure_ascii=False), datetime.now().isoformat())
+    )
+
+
+class OutboxWorker:
+    """
+    Разбирает outbox пачками до batch_size событий. Проверяет таблицу раз в
+    poll_interval секунд, а после записи новых событий - сразу (см. wakeup).
+    Событие, не обработанное за max_attempts попыток, остается в таблице с last_error.
+    """
+
+    def __init__(
+        self,
+        connection: ConnectionFactory,
+        handlers: Dict[str, OutboxHandler],
+        batch_size: int = 50,
+        poll_interval: float = 1.0,
+        max_attempts: int = 10,
+        backoff: float = 2.0,
+        max_backoff: float = 300.0,
+    ):
+        self._connection = connection
+        self.handlers = handlers
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(), name="outbox-worker")
+
+    def wakeup(self) -> None:
+        """Сообщает воркеру о новых событиях, чтобы не ждать следующего опроса."""
+        self._wakeup.set()
+
+    async def stop(self) -> None:
+        """
+        Останавливает воркер после текущей пачки, чтобы обработанные события
+        не повторились после перезапуска. Остальные события останутся в таблице.
+        """
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        self._stopping = True
+        self._wakeup.set()
+        await task
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                processed = await self.process_batch()
+            except Exception as e:
+                logger.error(f"Ошибка обработки outbox: {e}")
+                processed = 0
+            if processed >= self.batch_size or self._stopping:
+                # Очередь не разобрана - следующая пачка сразу; при остановке не ждем опроса
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def process_batch(self) -> int:
+        """Обрабатывает одну пачку готовых к отправке событий. Возвращает их количество."""
+        async with self._connection() as db:
+            async with db.execute(
+                "SELECT id, kind, payload, attempts FROM outbox "
+                "WHERE next_attempt_at <= ? AND attempts < ? ORDER BY next_attempt_at, id LIMIT ?",
+                (time.time(), self.max_attempts, self.batch_size)
+            ) as cursor:
+                events = [tuple(row) for row in await cursor.fetchall()]
+        if not events:
+            return 0
+
+        outcomes = await asyncio.gather(*(self._handle(kind, json.loads(payload)) for _, kind, payload, _ in events))
+
+        done: List[Tuple[int]] = []
+        retries: List[Tuple[Any, ...]] = []
+        now = time.time()
+        for (event_id, kind, payload, attempts), (retry_payload, error) in zip(events, outcomes):
+            if retry_payload is None and error is None:
+                done.append((event_id,))
+                continue
+            attempts += 1
+            delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+            if attempts >= self.max_attempts:
+                logger.error(f"Событие outbox {event_id} ({kind}) не обработано за {attempts} попыток: {error}")
+            new_payload = json.dumps(retry_payload, ensure_ascii=False) if retry_payload is not None else payload
+            retries.append((attempts, now + delay, error, new_payload, event_id))
+
+        # Итоги всей пачки - одним коммитом
+        async with self._connection() as db:
+            await db.executemany("DELETE FROM outbox WHERE id = ?", done)
+            await db.executemany(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ?, payload = ? WHERE id = ?",
+                retries
+            )
+            await db.commit()
+        return len(events)
+
+    async def _handle(self, kind: str, payload: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        handler = self.handlers.get(kind)
+        if handler is None:
+            return None, f"Нет обработчика для события '{kind}'"
+        try:
+            retry_payload = await handler(payload)
+        except Exception as e:
+            logger.exception(f"Ошибка обработчика события outbox '{kind}'")
+            return None, repr(e)
+        return retry_payload, ("Часть действий не выполнена" if retry_payload is not None else None)
@@ -0,0 +1,99 @@
+# your_bot/database/pool.py
+
+"""
+Пул долгоживущих соединений с SQLite.
+Одно соединение используется для записи, несколько - для чтения.
+База переводится в режим WAL, поэтому чтение в админке не блокирует
+сохранение результатов кандидатов.
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """
+    Открывается один раз при старте бота и закрывается при остановке.
+    Запись сериализуется через asyncio.Lock, читатели выдаются из очереди.
+    """
+
+    def __init__(self, path: Path, readers: int = 2, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.readers = max(1, readers)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._idle_readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._all_readers: List[aiosqlite.Connection] = []
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, read_only: bool) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.path)
+        db.row_factory = aiosqlite.Row
+        await db.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        await db.execute("PRAGMA synchronous = NORMAL")
+        if read_only:
+            await db.execute("PRAGMA query_only = ON")
+        return db
+
+    async def open(self) -> None:
+        """Открывает соединение-писатель и пул читателей."""
+        if self.is_open:
+            return
+        self._writer = await self._connect(read_only=False)
+        # WAL сохраняется в файле БД, достаточно включить его один раз писателем
+        async with self._writer.execute("PRAGMA journal_mode = WAL") as cursor:
+            mode = (await cursor.fetchone())[0]
+        for _ in range(self.readers):
+            reader = await self._connect(read_only=True)
+            self._all_readers.append(reader)
+            self._idle_readers.put_nowait(reader)
+        logger.info(f"Пул соединений открыт: режим журнала {mode}, читателей {self.readers}.")
+
+    async def close(self) -> None:
+        """Закрывает все соединения пула."""
+        if not self.is_open:
+            return
+        async with self._write_lock:
+            await self._writer.close()
+            self._writer = None
+        for reader in self._all_readers:
+            await reader.close()
+        self._all_readers.clear()
+        self._idle_readers = asyncio.Queue()
+        logger.info("Пул соединений закрыт.")
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Выдает единственное соединение для записи.
+        Незакоммиченная транзакция откатывается, если блок завершился ошибкой.
+        """
+        if not self.is_open:
+            raise RuntimeError("Пул соединений не открыт")
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Выдает свободное соединение для чтения и возвращает его в пул после использования."""
+        if not self.is_open:
+            raise RuntimeError("Пул соединений не открыт")
+        db = await self._idle_readers.get()
+        try:
+            yield db
+        finally:
+            self._idle_readers.put_nowait(db)
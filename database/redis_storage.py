@@ -0,0 +1,104 @@
+# your_bot/database/redis_storage.py
+
+"""
+Хранилище FSM в Redis для запуска нескольких процессов бота с общими анкетами.
+Данные сессии хранятся хэшем (поле анкеты -> JSON-значение), поэтому
+дополнение данных не требует их предварительного чтения: обновление данных
+и переход к следующему шагу отправляются одним конвейером (MULTI/EXEC)
+за один сетевой обмен.
+Требует пакет redis (pip install redis).
+"""
+import json
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from redis.asyncio import Redis
+
+
+class RedisHashStorage(BaseStorage):
+    """
+    Состояние - строковый ключ, данные - хэш рядом с ним.
+    С session_ttl оба ключа живут не дольше session_ttl секунд с последней записи,
+    так что брошенные анкеты Redis удаляет сам.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        key_builder: Optional[KeyBuilder] = None,
+        session_ttl: Optional[int] = None
+    ):
+        self.redis = redis
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self.session_ttl = session_ttl or None
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs: Any) -> "RedisHashStorage":
+        return cls(Redis.from_url(url), **kwargs)
+
+    def _queue_state(self, pipe: Any, key: StorageKey, state: StateType) -> None:
+        state_key = self.key_builder.build(key, "state")
+        if state is None:
+            pipe.delete(state_key)
+        else:
+            pipe.set(state_key, state.state if isinstance(state, State) else state, ex=self.session_ttl)
+            if self.session_ttl:
+                # Переход по шагам продлевает жизнь и данным анкеты
+                pipe.expire(self.key_builder.build(key, "data"), self.session_ttl)
+
+    def _queue_data_update(self, pipe: Any, key: StorageKey, data: Mapping[str, Any]) -> None:
+        data_key = self.key_builder.build(key, "data")
+        if data:
+            pipe.hset(data_key, mapping={field: json.dumps(value, ensure_ascii=False) for field, value in data.items()})
+            if self.session_ttl:
+                pipe.expire(data_key, self.session_ttl)
+
+    def _decode_data(self, raw: Mapping[Any, Any]) -> Dict[str, Any]:
+        return {
+            (field.decode("utf-8") if isinstance(field, bytes) else field): json.loads(value)
+            for field, value in raw.items()
+        }
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            self._queue_state(pipe, key, state)
+            await pipe.execute()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        value = await self.redis.get(self.key_builder.build(key, "state"))
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self.key_builder.build(key, "data"))
+            self._queue_data_update(pipe, key, data)
+            await pipe.execute()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._decode_data(await self.redis.hgetall(self.key_builder.build(key, "data")))
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        """Дописывает поля и возвращает итоговые данные за один обмен с Redis."""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            self._queue_data_update(pipe, key, data)
+            pipe.hgetall(self.key_builder.build(key, "data"))
+            results = await pipe.execute()
+        return self._decode_data(results[-1])
+
+    async def update_data_and_set_state(
+        self,
+        key: StorageKey,
+        data: Mapping[str, Any],
+        state: StateType = None
+    ) -> Dict[str, Any]:
+        """Дописывает поля данных и меняет состояние атомарно, за один обмен с Redis."""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            self._queue_data_update(pipe, key, data)
+            self._queue_state(pipe, key, state)
+            pipe.hgetall(self.key_builder.build(key, "data"))
+            results = await pipe.execute()
+        return self._decode_data(results[-1])
+
+    async def close(self) -> None:
+        await self.redis.aclose()
@@ -0,0 +1,124 @@
+# your_bot/database/search.py
+
+"""
+Полнотекстовый поиск кандидатов для команды /find.
+Индекс test_results_fts (FTS5) хранит только токены имени, username и
+нормализованного телефона и поддерживается триггерами на test_results,
+поэтому поиск идет по индексу, а не сканированием таблицы через LIKE.
+Пока фоновое заполнение индекса после миграции не закончено, поиск идет
+без индекса (см. scan_results).
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+import aiosqlite
+
+# Запрос из одних цифр и символов номера считается поиском по телефону
+_PHONE_QUERY = re.compile(r'^[\d\s()+\-]+$')
+_MIN_PHONE_DIGITS = 3
+
+# Сколько самых новых совпадений ранжируется. Частое имя совпадает с десятками тысяч
+# записей, и bm25 по всем из них стоил бы сотни миллисекунд
+SEARCH_CANDIDATES = 1000
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    Превращает ввод администратора в выражение MATCH.
+    Каждое слово ищется по префиксу, слова объединяются через AND.
+    Номер приводится к виду 7XXXXXXXXXX и ищется по префиксу в колонке phone.
+    Возвращает None, если искать нечего.
+    """
+    query = query.strip()
+    if _PHONE_QUERY.match(query):
+        digits = re.sub(r'\D', '', query)
+        if len(digits) >= _MIN_PHONE_DIGITS:
+            # Номер вводят по-разному: +7..., 8..., или сразу с кода оператора
+            if digits.startswith('8'):
+                digits = '7' + digits[1:]
+            elif not digits.startswith('7'):
+                digits = '7' + digits
+            return f'phone : "{digits}"*'
+
+    # Слова разбиваются так же, как их режет токенизатор unicode61 (по небуквенным символам),
+    # поэтому кавычки и операторы FTS5 в выражение не попадают
+    words = re.findall(r'[^\W_]+', query.lower())
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def record_matches(match: str, record: Dict[str, Any]) -> bool:
+    """Проверяет запись по выражению build_match_query без индекса: по началу слов или номера."""
+    words = re.findall(r'"(\w+)"', match)
+    if match.startswith("phone"):
+        return (record.get("phone_normalized") or "").startswith(words[0])
+    tokens = re.findall(r'[^\W_]+', f"{record.get('name') or ''} {record.get('username') or ''}".lower())
+    return all(any(token.startswith(word) for token in tokens) for word in words)
+
+
+async def index_ready(db: aiosqlite.Connection) -> bool:
+    """Индекс содержит все записи: фоновое заполнение после миграции завершено."""
+    async with db.execute(
+        "SELECT b.done OR b.last_id >= f.max_id FROM schema_backfills AS b, test_results_fts_backfill AS f "
+        "WHERE b.name = 'test_results_fts'"
+    ) as cursor:
+        row = await cursor.fetchone()
+    return row is None or bool(row[0])
+
+
+async def scan_results(db: aiosqlite.Connection, match: str, limit: int = 10, chunk_size: int = 500) -> List[Dict[str, Any]]:
+    """
+    Поиск без индекса, от новых записей к старым, без ранжирования.
+    Номер ищется через LIKE по префиксу; слова сравниваются в Python, потому что
+    LIKE в SQLite не различает регистр только для латиницы.
+    """
+    columns = "id, user_id, username, name, phone_number"
+    if match.startswith("phone"):
+        digits = re.findall(r'"(\w+)"', match)[0]
+        async with db.execute(
+            f"SELECT {columns} FROM test_results WHERE phone_normalized LIKE ? ORDER BY id DESC LIMIT ?",
+            (f"{digits}%", limit)
+        ) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+    found: List[Dict[str, Any]] = []
+    async with db.execute(f"SELECT {columns}, phone_normalized FROM test_results ORDER BY id DESC") as cursor:
+        while len(found) < limit:
+            rows = await cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                record = dict(row)
+                if record_matches(match, record):
+                    del record["phone_normalized"]
+                    found.append(record)
+                    if len(found) == limit:
+                        break
+    return found
+
+
+async def search_results(db: aiosqlite.Connection, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Возвращает до limit записей, упорядоченных по релевантности (bm25).
+    Ранжируются только SEARCH_CANDIDATES самых новых совпадений.
+    """
+    match = build_match_query(query)
+    if match is None:
+        return []
+    if not await index_ready(db):
+        return await scan_results(db, match, limit=limit)
+    async with db.execute(
+        # Обход индекса по rowid останавливается после SEARCH_CANDIDATES совпадений,
+        # bm25 считается только для них, с таблицей соединяются только лучшие limit
+        '''SELECT r.id, r.user_id, r.username, r.name, r.phone_number
+           FROM (
+               SELECT rowid, rank FROM test_results_fts
+               WHERE test_results_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+           ) AS found
+           JOIN test_results AS r ON r.id = found.rowid
+           ORDER BY found.rank, found.rowid DESC
+           LIMIT ?''',
+        (match, SEARCH_CANDIDATES, limit)
+    ) as cursor:
+        return [dict(row) for row in await cursor.fetchall()]
@@ -0,0 +1,260 @@
+# your_bot/database/session_limits.py
+
+"""
+Ограничение времени жизни и количества сессий FSM.
+Кандидаты, бросившие анкету на середине, оставляют в хранилище состояние
+и данные навсегда. Обертка вокруг хранилища aiogram удаляет сессии,
+которые не использовались дольше ttl, и при превышении лимита вытесняет
+давно не использованные.
+Время обращения к сессиям ведет индекс сессий: хранилище в базе хранит его
+в той же таблице (переживает перезапуск, чистка - запросом к базе),
+для остальных хранилищ оно учитывается в памяти процесса.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Any, Dict, Hashable, List, Mapping, NamedTuple, Optional, Protocol, runtime_checkable
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import DisabledEventIsolation
+
+logger = logging.getLogger(__name__)
+
+
+def _data_size(data: Mapping[str, Any]) -> int:
+    """Примерный объем данных сессии в байтах (по их JSON-представлению)."""
+    if not data:
+        return 0
+    return len(json.dumps(dict(data), ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def _state_size(state: StateType) -> int:
+    state = state.state if isinstance(state, State) else state
+    return len(state.encode("utf-8")) if state else 0
+
+
+class IdleSession(NamedTuple):
+    """
+    Кандидат на удаление: ключ aiogram для блокировки пользователя (None - неизвестен),
+    ключ в индексе и время последнего обращения, которое видела чистка.
+    """
+    key: Optional[StorageKey]
+    index_key: Hashable
+    touched_at: float
+
+
+@runtime_checkable
+class SessionIndex(Protocol):
+    """Учет времени обращения к сессиям, по которому их удаляет ExpiringStorage."""
+
+    async def idle_sessions(self, before: float, limit: int) -> List[IdleSession]:
+        """До limit сессий без обращений с момента before, старые первыми."""
+
+    async def overflow_sessions(self, keep: int, limit: int) -> List[IdleSession]:
+        """До limit самых старых сессий сверх keep самых свежих."""
+
+    async def expire_session(self, session: IdleSession) -> bool:
+        """Удаляет сессию, если к ней не обращались после session.touched_at."""
+
+    async def session_stats(self) -> Dict[str, int]:
+        """Количество сессий и их объем в байтах."""
+
+
+class MemorySessionIndex:
+    """
+    Индекс для хранилищ без собственного учета (MemoryStorage): ключи
+    в порядке последнего обращения (LRU), поэтому чистка просматривает
+    только устаревшие записи. Сессии, созданные до перезапуска процесса,
+    учитываются с первого обращения к ним.
+    """
+
+    def __init__(self, storage: BaseStorage):
+        self.storage = storage
+        # Ключ -> время последнего обращения и объем state и data в байтах
+        self._sessions: "OrderedDict[StorageKey, Dict[str, float]]" = OrderedDict()
+
+    def __contains__(self, key: StorageKey) -> bool:
+        return key in self._sessions
+
+    def touch(self, key: StorageKey, state: Optional[int] = None, data: Optional[int] = None) -> None:
+        """Отмечает обращение к сессии; state и data - новый объем полей, если он известен."""
+        entry = self._sessions.get(key)
+        if entry is None:
+            entry = self._sessions[key] = {"accessed_at": 0.0, "state_bytes": 0, "data_bytes": 0}
+        entry["accessed_at"] = time.time()
+        self._sessions.move_to_end(key)
+        if state is not None:
+            entry["state_bytes"] = state
+        if data is not None:
+            entry["data_bytes"] = data
+        if not entry["state_bytes"] and not entry["data_bytes"]:
+            del self._sessions[key]
+
+    def _candidates(self, keys: List[StorageKey]) -> List[IdleSession]:
+        return [IdleSession(key, key, self._sessions[key]["accessed_at"]) for key in keys]
+
+    async def idle_sessions(self, before: float, limit: int) -> List[IdleSession]:
+        expired = []
+        for key, entry in self._sessions.items():
+            if entry["accessed_at"] >= before or len(expired) >= limit:
+                break
+            expired.append(key)
+        return self._candidates(expired)
+
+    async def overflow_sessions(self, keep: int, limit: int) -> List[IdleSession]:
+        excess = min(limit, max(0, len(self._sessions) - keep))
+        return self._candidates([key for key, _ in zip(self._sessions, range(excess))])
+
+    async def expire_session(self, session: IdleSession) -> bool:
+        entry = self._sessions.get(session.index_key)
+        if entry is None or entry["accessed_at"] > session.touched_at:
+            return False
+        del self._sessions[session.index_key]
+        await self.storage.set_state(session.key, None)
+        await self.storage.set_data(session.key, {})
+        return True
+
+    async def session_stats(self) -> Dict[str, int]:
+        return {
+            "sessions": len(self._sessions),
+            "bytes": int(sum(entry["state_bytes"] + entry["data_bytes"] for entry in self._sessions.values())),
+        }
+
+
+class ExpiringStorage(BaseStorage):
+    """
+    Фоновая чистка раз в sweep_interval секунд удаляет сессии старше ttl
+    и самые давние сессии сверх max_sessions (лимит соблюдается с точностью
+    до интервала чистки). Сессия удаляется под блокировкой isolation для ее
+    пользователя, поэтому не пропадает посреди обработки его обновления;
+    сессию, к которой обратились, пока чистка ждала блокировку, она не трогает.
+    """
+
+    # Сколько сессий чистка удаляет за один проход по индексу
+    SWEEP_BATCH = 500
+
+    def __init__(
+        self,
+        storage: BaseStorage,
+        ttl: float = 24 * 3600,
+        max_sessions: int = 10000,
+        sweep_interval: float = 60.0,
+        isolation: Optional[BaseEventIsolation] = None
+    ):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+        self.isolation = isolation or DisabledEventIsolation()
+        self.index: SessionIndex = storage if isinstance(storage, SessionIndex) else MemorySessionIndex(storage)
+        self._sweep_task: Optional[asyncio.Task] = None
+        self.evicted_idle = 0
+        self.evicted_overflow = 0
+
+    async def stats(self) -> Dict[str, int]:
+        """Счетчики живых сессий, вытеснений и занятого объема."""
+        return {
+            **await self.index.session_stats(),
+            "evicted_idle": self.evicted_idle,
+            "evicted_overflow": self.evicted_overflow,
+        }
+
+    def _touch(self, key: StorageKey, state: Optional[int] = None, data: Optional[int] = None) -> None:
+        """Запускает чистку и отмечает обращение в индексе в памяти (индекс в базе ведет само хранилище)."""
+        if self._sweep_task is None and (self.ttl > 0 or self.max_sessions > 0):
+            self._sweep_task = asyncio.create_task(self._sweep_loop(), name="fsm-sessions-sweep")
+        if isinstance(self.index, MemorySessionIndex):
+            self.index.touch(key, state, data)
+
+    async def _expire(self, sessions: List[IdleSession]) -> int:
+        expired = 0
+        for session in sessions:
+            # Сессии без известного владельца записаны до учета владельцев и с тех пор не менялись
+            lock = self.isolation.lock(session.key) if session.key is not None else nullcontext()
+            async with lock:
+                expired += await self.index.expire_session(session)
+        return expired
+
+    async def sweep(self, now: Optional[float] = None) -> int:
+        """
+        Удаляет сессии, к которым не обращались дольше ttl, и вытесняет лишние сверх лимита.
+        Возвращает количество удаленных сессий.
+        """
+        deadline = (time.time() if now is None else now) - self.ttl
+        evicted = 0
+        while self.ttl > 0:
+            sessions = await self.index.idle_sessions(deadline, self.SWEEP_BATCH)
+            expired = await self._expire(sessions)
+            self.evicted_idle += expired
+            evicted += expired
+            if len(sessions) < self.SWEEP_BATCH or not expired:
+                break
+        while self.max_sessions > 0:
+            sessions = await self.index.overflow_sessions(self.max_sessions, self.SWEEP_BATCH)
+            expired = await self._expire(sessions)
+            self.evicted_overflow += expired
+            evicted += expired
+            if len(sessions) < self.SWEEP_BATCH or not expired:
+                break
+        return evicted
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                evicted = await self.sweep()
+                if evicted:
+                    logger.info(f"Удалено заброшенных сессий FSM: {evicted}. Состояние: {await self.stats()}")
+            except Exception as e:
+                logger.error(f"Ошибка очистки сессий FSM: {e}")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self.storage.set_state(key, state)
+        self._touch(key, state=_state_size(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state = await self.storage.get_state(key)
+        # Пользователи без сессии не учитываются, иначе каждое сообщение занимало бы место в индексе
+        if state is not None or (isinstance(self.index, MemorySessionIndex) and key in self.index):
+            self._touch(key, state=_state_size(state))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self.storage.set_data(key, data)
+        self._touch(key, data=_data_size(data))
+
+    async def update_data_and_set_state(
+        self,
+        key: StorageKey,
+        data: Mapping[str, Any],
+        state: StateType = None
+    ) -> Dict[str, Any]:
+        """Дополняет данные и меняет состояние, одной операцией, если ее поддерживает хранилище."""
+        combined = getattr(self.storage, "update_data_and_set_state", None)
+        if combined is not None:
+            result = await combined(key, data, state)
+        else:
+            result = await self.storage.update_data(key, data)
+            await self.storage.set_state(key, state)
+        self._touch(key, state=_state_size(state), data=_data_size(result))
+        return result
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = await self.storage.get_data(key)
+        if isinstance(self.index, MemorySessionIndex) and key in self.index:
+            self._touch(key)
+        return data
+
+    async def close(self) -> None:
+        if self._sweep_task is not None:
+            task, self._sweep_task = self._sweep_task, None
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.storage.close()
@@ -0,0 +1,94 @@
+# your_bot/database/stats.py
+
+"""
+Инкрементальные агрегаты по результатам тестов.
+Счетчики хранятся в таблице result_stats по «корзинам»: общая ('all'),
+за день ('day:YYYY-MM-DD') и за час ('hour:YYYY-MM-DDTHH').
+Они обновляются в той же транзакции, что и запись результатов,
+поэтому /stats читает фиксированное число строк, а не всю таблицу.
+Счетчики описывают записи кандидатов: повторное прохождение заменяет вклад
+прежних ответов (в том числе в корзинах их дня и часа), а не добавляет новый.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+
+import aiosqlite
+
+from .models import ResultRow
+
+STATS_COUNTERS = ("total", "citizenship_yes", "citizenship_no", "arrests_yes", "arrests_no", "with_phone")
+
+TOTAL_BUCKET = "all"
+
+
+def day_bucket(moment: datetime) -> str:
+    return f"day:{moment:%Y-%m-%d}"
+
+
+def hour_bucket(moment: datetime) -> str:
+    return f"hour:{moment:%Y-%m-%dT%H}"
+
+
+def _row_counters(row: ResultRow) -> List[int]:
+    return [
+        1,
+        int(row.citizenship == "Да"),
+        int(row.citizenship == "Нет"),
+        int(row.card_arrests == "Да"),
+        int(row.card_arrests == "Нет"),
+        int(bool(row.phone_number)),
+    ]
+
+
+def stats_deltas(rows: Iterable[ResultRow], replaced: Iterable[ResultRow] = ()) -> Dict[str, List[int]]:
+    """Прибавки к счетчикам по корзинам для строк; вклад замененных строк replaced вычитается."""
+    deltas: Dict[str, List[int]] = defaultdict(lambda: [0] * len(STATS_COUNTERS))
+    for sign, group in ((1, rows), (-1, replaced)):
+        for row in group:
+            counters = [sign * counter for counter in _row_counters(row)]
+            # completion_date хранится в ISO, корзины - префиксы строки даты
+            for bucket in (TOTAL_BUCKET, f"day:{row.completion_date[:10]}", f"hour:{row.completion_date[:13]}"):
+                deltas[bucket] = [a + b for a, b in zip(deltas[bucket], counters)]
+    return deltas
+
+
+async def apply_stats(db: aiosqlite.Connection, rows: Iterable[ResultRow], replaced: Iterable[ResultRow] = ()) -> None:
+    """
+    Прибавляет строки к счетчикам и вычитает прежние версии перезаписанных строк.
+    Коммит выполняет вызывающий код, чтобы агрегаты и сами результаты попали в одну транзакцию.
+    """
+    deltas = stats_deltas(rows, replaced)
+    columns = ", ".join(STATS_COUNTERS)
+    placeholders = ", ".join("?" * len(STATS_COUNTERS))
+    updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in STATS_COUNTERS)
+    await db.executemany(
+        f"INSERT INTO result_stats (bucket, {columns}) VALUES (?, {placeholders}) "
+        f"ON CONFLICT(bucket) DO UPDATE SET {updates}",
+        [(bucket, *values) for bucket, values in deltas.items()]
+    )
+
+
+def stats_buckets(now: datetime, days: int = 7, hours: int = 24) -> List[str]:
+    """Общая корзина и корзины за последние days дней и hours часов."""
+    buckets = [TOTAL_BUCKET]
+    buckets += [day_bucket(now - timedelta(days=i)) for i in range(days)]
+    buckets += [hour_bucket(now - timedelta(hours=i)) for i in range(hours)]
+    return buckets
+
+
+async def read_stats(db: aiosqlite.Connection, now: datetime, days: int = 7, hours: int = 24) -> Dict[str, Dict[str, int]]:
+    """
+    Читает общую корзину и корзины за последние days дней и hours часов.
+    Возвращает словарь корзина -> счетчики; пустые корзины заполняются нулями.
+    """
+    buckets = stats_buckets(now, days=days, hours=hours)
+    result = {bucket: dict.fromkeys(STATS_COUNTERS, 0) for bucket in buckets}
+    placeholders = ", ".join("?" * len(buckets))
+    async with db.execute(
+        f"SELECT bucket, {', '.join(STATS_COUNTERS)} FROM result_stats WHERE bucket IN ({placeholders})",
+        buckets
+    ) as cursor:
+        async for row in cursor:
+            result[row[0]] = dict(zip(STATS_COUNTERS, row[1:]))
+    return result
@@ -0,0 +1,202 @@
+# your_bot/database/store.py
+
+"""
+Интерфейс хранилища результатов тестов и его реализации.
+Обработчики получают хранилище через workflow data диспетчера (dp["result_store"]),
+поэтому бэкенд можно заменить, не трогая обработчики.
+"""
+import bisect
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Protocol, runtime_checkable
+
+from . import db_manager
+from .cache import record_cards
+from .models import ResultRow
+from .search import build_match_query, record_matches
+from .stats import STATS_COUNTERS, stats_buckets, stats_deltas
+
+
+@runtime_checkable
+class ResultStore(Protocol):
+    """Операции с результатами тестов, которые нужны обработчикам."""
+
+    # True - событие о сохранении пишется в outbox вместе с результатом,
+    # и уведомления админам отправляет воркер outbox, а не обработчик
+    outbox: bool
+
+    async def save(self, state_data: Dict[str, Any]) -> None:
+        """
+        Сохраняет результат кандидата (повторное прохождение обновляет запись).
+        Возвращается, когда результат записан: после этого можно очищать состояние анкеты.
+        """
+
+    async def page(
+        self,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        """Страница записей от новых к старым с keyset-пагинацией по ID."""
+
+    async def get(self, record_id: int, include_archive: bool = False) -> Optional[Dict[str, Any]]:
+        """Полная запись по ID или None."""
+
+    async def count(self) -> int:
+        """Количество записей."""
+
+    def stream(
+        self,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        include_archive: bool = False
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Построчно отдает записи за период [date_from, date_to) в порядке прохождения."""
+
+    async def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """До limit записей, подходящих под запрос по имени, username или телефону, лучшие первыми."""
+
+    async def stats(self, days: int = 7, hours: int = 24) -> Dict[str, Dict[str, int]]:
+        """Счетчики прохождений: общие, за последние days дней и hours часов (см. database/stats.py)."""
+
+
+class SQLiteResultStore:
+    """Хранилище поверх функций db_manager (пул соединений, очередь записи, архив, outbox)."""
+
+    outbox = True
+
+    async def save(self, state_data: Dict[str, Any]) -> None:
+        await db_manager.save_test_result(state_data)
+
+    async def page(
+        self,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        return await db_manager.get_results_page(before_id=before_id, after_id=after_id, limit=limit)
+
+    async def get(self, record_id: int, include_archive: bool = False) -> Optional[Dict[str, Any]]:
+        return await db_manager.get_result_by_id(record_id, include_archive=include_archive)
+
+    async def count(self) -> int:
+        return await db_manager.count_results()
+
+    def stream(
+        self,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        include_archive: bool = False
+    ) -> AsyncIterator[Dict[str, Any]]:
+        return db_manager.iter_results(date_from, date_to, include_archive=include_archive)
+
+    async def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return await db_manager.find_results(query, limit=limit)
+
+    async def stats(self, days: int = 7, hours: int = 24) -> Dict[str, Dict[str, int]]:
+        return await db_manager.get_stats(days=days, hours=hours)
+
+
+class MemoryResultStore:
+    """
+    Хранилище в памяти процесса с той же семантикой, что и SQLite.
+    Подходит для тестов и сравнительных замеров; данные теряются при перезапуске.
+    """
+
+    outbox = False
+
+    def __init__(self):
+        self._records: Dict[int, Dict[str, Any]] = {}
+        self._ids: List[int] = []  # ID по возрастанию для keyset-пагинации
+        self._by_user: Dict[int, int] = {}
+        self._next_id = 1
+        # Счетчики по корзинам, как в таблице result_stats
+        self._stats: Dict[str, List[int]] = {}
+
+    async def save(self, state_data: Dict[str, Any]) -> None:
+        result = ResultRow.from_state_data(state_data)
+        row = result._asdict()
+        record_id = self._by_user.get(row["user_id"])
+        # Как и в SQLite: прежние ответы кандидата заменяются в счетчиках новыми
+        replaced = [] if record_id is None else [ResultRow(**{
+            field: self._records[record_id][field] for field in ResultRow._fields
+        })]
+        for bucket, delta in stats_deltas([result], replaced).items():
+            current = self._stats.get(bucket, [0] * len(STATS_COUNTERS))
+            self._stats[bucket] = [a + b for a, b in zip(current, delta)]
+        if record_id is not None:
+            record = self._records[record_id]
+            record.update(row, attempts=record["attempts"] + 1)
+            # Как и в SQLite: карточка измененной записи собирается заново
+            record_cards.invalidate(record_id)
+            return
+        record_id, self._next_id = self._next_id, self._next_id + 1
+        self._records[record_id] = {"id": record_id, **row, "attempts": 1}
+        self._ids.append(record_id)
+        self._by_user[row["user_id"]] = record_id
+
+    async def page(
+        self,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+        limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        if after_id is not None:
+            start = bisect.bisect_right(self._ids, after_id)
+            ids = self._ids[start:start + limit][::-1]
+        else:
+            end = len(self._ids) if before_id is None else bisect.bisect_left(self._ids, before_id)
+            ids = self._ids[max(0, end - limit):end][::-1]
+        return [
+            {key: self._records[record_id][key] for key in ("id", "user_id", "username", "name")}
+            for record_id in ids
+        ]
+
+    async def get(self, record_id: int, include_archive: bool = False) -> Optional[Dict[str, Any]]:
+        record = self._records.get(record_id)
+        return dict(record) if record else None
+
+    async def count(self) -> int:
+        return len(self._records)
+
+    async def stream(
+        self,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        include_archive: bool = False
+    ) -> AsyncIterator[Dict[str, Any]]:
+        records = sorted(self._records.values(), key=lambda r: (r["completion_date"], r["id"]))
+        for record in records:
+            if date_from and record["completion_date"] < date_from:
+                continue
+            if date_to and record["completion_date"] >= date_to:
+                continue
+            yield dict(record)
+
+    async def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        # Линейный просмотр: тот же смысл запроса, что и у FTS-индекса, без ранжирования
+        match = build_match_query(query)
+        if match is None:
+            return []
+        found = []
+        for record_id in reversed(self._ids):
+            record = self._records[record_id]
+            if record_matches(match, record):
+                found.append({key: record[key] for key in ("id", "user_id", "username", "name", "phone_number")})
+                if len(found) == limit:
+                    break
+        return found
+
+    async def stats(self, days: int = 7, hours: int = 24) -> Dict[str, Dict[str, int]]:
+        return {
+            bucket: dict(zip(STATS_COUNTERS, self._stats.get(bucket, [0] * len(STATS_COUNTERS))))
+            for bucket in stats_buckets(datetime.now(), days=days, hours=hours)
+        }
+
+
+def create_result_store(backend: str) -> ResultStore:
+    """Создает хранилище по имени бэкенда из конфигурации."""
+    if backend == "sqlite":
+        return SQLiteResultStore()
+    if backend == "memory":
+        return MemoryResultStore()
+    raise ValueError(f"Неизвестное хранилище результатов: {backend}")
@@ -0,0 +1,171 @@
+# your_bot/database/write_queue.py
+
+"""
+Очередь отложенной записи (write-behind) для результатов тестов.
+Строки записываются пачками: одна транзакция и один коммит на пачку вместо
+коммита на каждого кандидата. Пачку составляют строки, накопившиеся, пока
+записывалась предыдущая (групповой коммит): одиночная строка в простаивающей
+очереди записывается сразу, а под нагрузкой пачки растут сами.
+Если пачка не записалась, строки записываются по одной, и только строки,
+которые не записываются и поодиночке, передаются в dead_letter. Временные
+ошибки (например, занятая другим соединением база) повторяются с растущей
+задержкой, пока запись не пройдет.
+put возвращает future, которое завершается после коммита пачки со строкой:
+вызывающий код может дождаться записи, не отказываясь от группового коммита.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Маркер остановки воркера
+_STOP = object()
+
+
+class ResultWriteQueue:
+    """
+    Сбрасывает строки функцией flush, как только очередь опустела, но не больше
+    batch_size строк за раз. Пока строки продолжают поступать, пачка дополняется
+    не дольше flush_interval секунд с первой строки.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[Sequence[Any]], Awaitable[None]],
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        max_retries: int = 3,
+        retry_delay: float = 0.1,
+        max_retry_delay: float = 30.0,
+        is_transient: Callable[[Exception], bool] = lambda error: False,
+        dead_letter: Optional[Callable[[Any, Exception], Awaitable[None]]] = None,
+    ):
+        self._flush = flush
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max(1, max_retries)
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.is_transient = is_transient
+        self._dead_letter = dead_letter
+        self._queue: "asyncio.Queue[Any]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def pending(self) -> int:
+        """Количество строк, еще не переданных на запись."""
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        self._task = asyncio.create_task(self._run(), name="result-write-queue")
+
+    def put(self, row: Any) -> "asyncio.Future[None]":
+        """
+        Ставит строку в очередь без ожидания записи на диск. Возвращает future,
+        которое завершится, когда строка записана (или сохранена через dead_letter),
+        и завершится ошибкой, если строку сохранить не удалось.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((row, future))
+        return future
+
+    async def write(self, row: Any) -> None:
+        """Ставит строку в очередь и ждет коммита пачки, в которую она попала."""
+        await self.put(row)
+
+    async def stop(self) -> None:
+        """Останавливает воркер, предварительно записав все накопленные строки."""
+        if not self.is_running:
+            return
+        self._queue.put_nowait(_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch: List[Tuple[Any, asyncio.Future]] = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if self._queue.empty():
+                    # Один проход цикла событий дает поставить строки обработчикам, которые
+                    # завершаются одновременно; если новых строк нет, пачка пишется сразу
+                    if loop.time() >= deadline:
+                        break
+                    await asyncio.sleep(0)
+                    if self._queue.empty():
+                        break
+                item = self._queue.get_nowait()
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._write_batch(batch)
+
+    async def _write_batch(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        rows = [row for row, _ in batch]
+        error = await self._try_flush(rows, self.max_retries)
+        if error is None:
+            logger.debug(f"Записана пачка из {len(batch)} строк.")
+            for _, future in batch:
+                _resolve(future)
+            return
+        if len(batch) > 1:
+            # Одна плохая строка не должна потянуть за собой остальные строки пачки
+            logger.warning(f"Пачка из {len(batch)} строк не записана ({error}), строки записываются по одной.")
+        for row, future in batch:
+            row_error = error if len(batch) == 1 else await self._try_flush([row], 1)
+            if row_error is not None:
+                row_error = await self._quarantine(row, row_error)
+            _resolve(future, row_error)
+
+    async def _try_flush(self, rows: List[Any], retries: int) -> Optional[Exception]:
+        """
+        Записывает строки. Временные ошибки повторяются без ограничения числа попыток,
+        остальные - до retries раз. Возвращает последнюю ошибку или None.
+        """
+        attempt = failures = 0
+        while True:
+            attempt += 1
+            try:
+                await self._flush(rows)
+                return None
+            except Exception as e:
+                if not self.is_transient(e):
+                    failures += 1
+                    if failures >= retries:
+                        return e
+                logger.error(f"Ошибка записи {len(rows)} строк (попытка {attempt}): {e}")
+                await asyncio.sleep(min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay))
+
+    async def _quarantine(self, row: Any, error: Exception) -> Optional[Exception]:
+        """Передает строку в dead_letter. Возвращает ошибку, если строка потеряна."""
+        if self._dead_letter is not None:
+            try:
+                await self._dead_letter(row, error)
+                return None
+            except Exception as e:
+                logger.error(f"Не удалось сохранить незаписанную строку отдельно: {e}")
+        logger.critical(f"Строка не записана и будет потеряна ({error!r}): {row}")
+        return error
+
+
+def _resolve(future: asyncio.Future, error: Optional[Exception] = None) -> None:
+    # Ожидающий мог отмениться, пока строка записывалась
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
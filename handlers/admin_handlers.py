@@ -4,85 +4,286 @@
 Обработчики для команд администратора.
 """
 import logging
-import re
+import time
 from datetime import datetime
+from typing import Any, Dict, Optional
 
-from aiogram import Router, F
-from aiogram.filters import Command, StateFilter
-from aiogram.types import Message, ReplyKeyboardRemove
+from aiogram import Router
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery, FSInputFile, Message
 
 from .filters import IsAdmin
-from .states import AdminStates
-from .keyboards import get_users_keyboard
-from database.db_manager import get_all_results, get_result_by_id
+from .callbacks import UsersPage, UserCard
+from .keyboards import get_users_page_keyboard
+from .outbound import ScheduledSession
+from .export import EXPORT_FORMATS, export_to_file, parse_export_args
+from database.cache import record_cards
+from database.db_manager import vacuum_db
+from database.session_limits import ExpiringStorage
+from database.store import ResultStore
+from database.stats import TOTAL_BUCKET
 
 logger = logging.getLogger(__name__)
 admin_router = Router(name="admin_router")
 
 # Применяем фильтр IsAdmin ко всем обработчикам в этом роутере
 admin_router.message.filter(IsAdmin())
+admin_router.callback_query.filter(IsAdmin())
+
+# Количество записей на одной странице списка пользователей
+USERS_PAGE_SIZE = 10
+
+
+async def load_users_page(
+    result_store: ResultStore,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Загружает страницу пользователей и определяет, есть ли соседние страницы.
+    Запрашивает на одну запись больше, чтобы узнать о продолжении без COUNT(*).
+    """
+    rows = await result_store.page(before_id=before_id, after_id=after_id, limit=USERS_PAGE_SIZE + 1)
+    if not rows:
+        return None
+
+    has_more = len(rows) > USERS_PAGE_SIZE
+    if after_id is not None:
+        # При движении к новым записям лишняя запись - самая новая, она первая в списке
+        users = rows[1:] if has_more else rows
+        return {"users": users, "has_prev": has_more, "has_next": True}
+
+    users = rows[:USERS_PAGE_SIZE]
+    return {"users": users, "has_prev": before_id is not None, "has_next": has_more}
 
 
 @admin_router.message(Command("all"), StateFilter(None))
-async def show_all_users(message: Message, state: FSMContext):
+async def show_all_users(message: Message, result_store: ResultStore):
     """
     Обработчик команды /all.
-    Получает всех пользователей из БД и предлагает выбрать одного.
+    Показывает первую страницу пользователей с инлайн-навигацией.
     """
-    all_users = await get_all_results()
-    
-    if not all_users:
+    page = await load_users_page(result_store)
+
+    if not page:
         await message.answer("В базе данных пока нет записей.")
         return
 
     await message.answer(
         "Выберите пользователя для просмотра информации:",
-        reply_markup=get_users_keyboard(all_users)
+        reply_markup=get_users_page_keyboard(**page)
     )
-    await state.set_state(AdminStates.choosing_user)
 
 
-@admin_router.message(F.text == "Отмена", StateFilter(AdminStates.choosing_user))
-async def cancel_user_choice(message: Message, state: FSMContext):
-    """Обработчик отмены выбора пользователя."""
-    await message.answer("Действие отменено.", reply_markup=ReplyKeyboardRemove())
-    await state.clear()
+@admin_router.callback_query(UsersPage.filter())
+async def switch_users_page(callback: CallbackQuery, callback_data: UsersPage, result_store: ResultStore):
+    """Переключает страницу списка пользователей."""
+    page = await load_users_page(result_store, before_id=callback_data.before, after_id=callback_data.after)
 
+    if not page:
+        await callback.answer("Записей больше нет.")
+        return
+
+    await callback.message.edit_reply_markup(reply_markup=get_users_page_keyboard(**page))
+    await callback.answer()
 
-@admin_router.message(StateFilter(AdminStates.choosing_user))
-async def show_user_info(message: Message, state: FSMContext):
+
+@admin_router.callback_query(UserCard.filter())
+async def show_user_info(callback: CallbackQuery, callback_data: UserCard, result_store: ResultStore):
     """
-    Обрабатывает выбор пользователя из клавиатуры и показывает по нему информацию.
+    Показывает информацию по записи, выбранной в списке пользователей.
     """
-    match = re.search(r"\(ID: (\d+)\)", message.text)
-    if not match:
-        await message.answer("Пожалуйста, выберите пользователя с помощью кнопок.")
-        return
+    # Повторный просмотр обходится без запроса к базе и сборки HTML
+    card = record_cards.get(callback_data.record_id)
+    if card is None:
+        user_data = await result_store.get(callback_data.record_id)
+
+        if not user_data:
+            await callback.answer("Не удалось найти информацию по данному пользователю.", show_alert=True)
+            return
+
+        card = format_user_card(user_data)
+        record_cards.put(callback_data.record_id, card)
+
+    await callback.message.answer(card, parse_mode="HTML")
+    await callback.answer()
 
-    record_id = int(match.group(1))
-    user_data = await get_result_by_id(record_id)
 
+@admin_router.message(Command("record"), StateFilter(None))
+async def show_record(message: Message, command: CommandObject, result_store: ResultStore):
+    """
+    Обработчик команды /record <ID>.
+    Показывает карточку записи, в том числе уже перенесенной в архив.
+    """
+    if not command.args or not command.args.strip().isdigit():
+        await message.answer("Использование: /record <ID записи>")
+        return
+
+    user_data = await result_store.get(int(command.args), include_archive=True)
     if not user_data:
-        await message.answer("Не удалось найти информацию по данному пользователю.", reply_markup=ReplyKeyboardRemove())
-        await state.clear()
+        await message.answer("Запись не найдена ни в базе, ни в архиве.")
+        return
+
+    await message.answer(format_user_card(user_data), parse_mode="HTML")
+
+
+@admin_router.message(Command("find"), StateFilter(None))
+async def find_users(message: Message, command: CommandObject, result_store: ResultStore):
+    """
+    Обработчик команды /find <запрос>.
+    Ищет кандидатов по имени, username или номеру телефона, лучшие совпадения первыми.
+    """
+    if not command.args or not command.args.strip():
+        await message.answer("Использование: /find <имя, username или номер телефона>")
+        return
+
+    users = await result_store.search(command.args, limit=USERS_PAGE_SIZE)
+    if not users:
+        await message.answer("Ничего не найдено.")
+        return
+
+    await message.answer(
+        f"Найдено записей: {len(users)}. Выберите пользователя:",
+        reply_markup=get_users_page_keyboard(users, has_prev=False, has_next=False)
+    )
+
+
+@admin_router.message(Command("export"), StateFilter(None))
+async def export_results(message: Message, command: CommandObject, result_store: ResultStore):
+    """
+    Обработчик команды /export [csv|jsonl] [С] [ПО] [archive].
+    Выгружает результаты (при необходимости за период и вместе с архивом) файлом-документом.
+    """
+    try:
+        export_format, date_from, date_to, include_archive = parse_export_args(command.args)
+    except ValueError:
+        await message.answer(
+            "Использование: /export [csv|jsonl] [ГГГГ-ММ-ДД] [ГГГГ-ММ-ДД] [archive]\n"
+            "Например: /export jsonl 2025-01-01 2025-01-31 archive"
+        )
         return
 
+    rows = result_store.stream(date_from, date_to, include_archive=include_archive)
+    path, count = await export_to_file(rows, export_format)
+    try:
+        if not count:
+            await message.answer("За выбранный период записей нет.")
+            return
+        await message.answer_document(
+            FSInputFile(path, filename=f"test_results{EXPORT_FORMATS[export_format]}"),
+            caption=f"Выгружено записей: {count}"
+        )
+        logger.info(f"Админ {message.from_user.id} выгрузил {count} записей ({export_format})")
+    finally:
+        path.unlink(missing_ok=True)
+
+
+@admin_router.message(Command("stats"), StateFilter(None))
+async def show_stats(message: Message, state: FSMContext, result_store: ResultStore):
+    """
+    Обработчик команды /stats.
+    Читает заранее посчитанные агрегаты, поэтому отвечает за постоянное время.
+    """
+    stats = await result_store.stats(days=7, hours=24)
+    # Счетчики сессий есть, только если включено ограничение сессий FSM
+    sessions = await state.storage.stats() if isinstance(state.storage, ExpiringStorage) else None
+    session = getattr(message.bot, "session", None)
+    outbound = session.scheduler.stats() if isinstance(session, ScheduledSession) else None
+    await message.answer(format_stats(stats, sessions, outbound, record_cards.stats()), parse_mode="HTML")
+
+
+@admin_router.message(Command("vacuum"), StateFilter(None))
+async def vacuum_database(message: Message):
+    """
+    Обработчик команды /vacuum: полное сжатие базы после больших удалений
+    и включение инкрементальной очистки для баз, созданных до нее.
+    Пока команда выполняется, запись в базу ждет, поэтому запускать её лучше в спокойное время.
+    """
+    await message.answer("🧹 Сжатие базы запущено. Сохранение ответов приостановлено до его окончания.")
+    started = time.monotonic()
+    try:
+        before, after = await vacuum_db()
+    except Exception as e:
+        logger.error(f"Ошибка сжатия базы: {e}")
+        await message.answer("❌ Не удалось сжать базу. Подробности в логах.")
+        return
+    await message.answer(
+        f"✅ Сжатие завершено за {time.monotonic() - started:.1f} с: "
+        f"{before / 2 ** 20:.1f} МБ → {after / 2 ** 20:.1f} МБ."
+    )
+
+
+def format_stats(
+    stats: Dict[str, Dict[str, int]],
+    sessions: Optional[Dict[str, int]] = None,
+    outbound: Optional[Dict[str, Any]] = None,
+    cards: Optional[Dict[str, int]] = None
+) -> str:
+    """Формирует HTML-отчет по агрегатам и, если переданы, по сессиям FSM, очереди отправки и кэшу карточек."""
+    total = stats[TOTAL_BUCKET]
+    if not total["total"]:
+        return "В базе данных пока нет записей."
+
+    phone_share = total["with_phone"] / total["total"] * 100
+    lines = [
+        "<b>📊 Статистика прохождений</b>\n",
+        f"<b>Всего:</b> {total['total']}",
+        f"<b>Гражданство РФ:</b> да {total['citizenship_yes']} / нет {total['citizenship_no']}",
+        f"<b>Аресты по картам:</b> да {total['arrests_yes']} / нет {total['arrests_no']}",
+        f"<b>Оставили телефон:</b> {total['with_phone']} ({phone_share:.1f}%)",
+        "\n<b>По дням:</b>",
+    ]
+    lines += [
+        f"{bucket[len('day:'):]}: {counters['total']}"
+        for bucket, counters in stats.items() if bucket.startswith("day:")
+    ]
+
+    hours = [
+        f"{bucket[len('hour:'):].replace('T', ' ')}:00 — {counters['total']}"
+        for bucket, counters in stats.items() if bucket.startswith("hour:") and counters["total"]
+    ]
+    lines.append("\n<b>За последние 24 часа:</b>")
+    lines += hours or ["нет прохождений"]
+
+    if sessions is not None:
+        lines += [
+            "\n<b>Незавершенные анкеты:</b>",
+            f"в работе {sessions['sessions']} ({sessions['bytes'] / 1024:.1f} КБ), "
+            f"удалено по таймауту {sessions['evicted_idle']}, по лимиту {sessions['evicted_overflow']}",
+        ]
+    if outbound is not None:
+        lines += [
+            "\n<b>Очередь отправки:</b>",
+            f"ждут: пользователям {outbound['queued']['user']}, админам {outbound['queued']['admin']}",
+            f"отправлено: пользователям {outbound['sent']['user']}, админам {outbound['sent']['admin']}, "
+            f"с ожиданием {outbound['delayed']}, макс. ожидание {outbound['max_wait']:.1f} с",
+        ]
+    if cards is not None:
+        requests = cards["hits"] + cards["misses"]
+        hit_rate = cards["hits"] / requests * 100 if requests else 0.0
+        lines += [
+            "\n<b>Кэш карточек:</b>",
+            f"в кэше {cards['size']}, попаданий {cards['hits']}, промахов {cards['misses']} ({hit_rate:.1f}% попаданий)",
+        ]
+    return "\n".join(lines)
+
+
+def format_user_card(user_data: Dict[str, Any]) -> str:
+    """Формирует HTML-карточку записи для администратора."""
     # Форматируем дату для красивого вывода
     try:
         completion_date = datetime.fromisoformat(user_data['completion_date']).strftime('%Y-%m-%d %H:%M:%S')
     except (TypeError, ValueError):
         completion_date = "N/A"
-        
+
     # Формируем красивый ответ с новыми полями
-    response_text = (
+    return (
         f"<b>ℹ️ Информация по пользователю {user_data.get('username', 'N/A')} (ID: {user_data.get('user_id')})</b>\n\n"
         f"<b>Имя:</b> {user_data.get('name') or 'Не указано'}\n"
         f"<b>Гражданство РФ:</b> {user_data.get('citizenship') or 'Не указано'}\n"
         f"<b>Аресты по картам:</b> {user_data.get('card_arrests') or 'Не указано'}\n"
         f"<b>Номер телефона:</b> <code>{user_data.get('phone_number') or 'Не указан'}</code>\n\n"
-        f"<b>Дата прохождения:</b> {completion_date}"
+        f"<b>Дата прохождения:</b> {completion_date}\n"
+        f"<b>Попыток:</b> {user_data.get('attempts') or 1}"
     )
-
-    await message.answer(response_text, reply_markup=ReplyKeyboardRemove(), parse_mode="HTML")
-    await state.clear()
\ No newline at end of file
@@ -0,0 +1,22 @@
+# your_bot/handlers/callbacks.py
+
+"""
+Типизированные callback-данные для инлайн-клавиатур.
+"""
+from typing import Optional
+
+from aiogram.filters.callback_data import CallbackData
+
+
+class UsersPage(CallbackData, prefix="users"):
+    """
+    Переход по страницам списка пользователей в админке.
+    before - показать записи старее указанного ID, after - новее.
+    """
+    before: Optional[int] = None
+    after: Optional[int] = None
+
+
+class UserCard(CallbackData, prefix="user"):
+    """Просмотр карточки записи по её ID в базе."""
+    record_id: int
@@ -0,0 +1,79 @@
+# your_bot/handlers/delivery.py
+
+"""
+Рассылка сообщений нескольким чатам (уведомления администраторов).
+Сообщения отправляются параллельно, но не больше concurrency одновременно.
+Лимиты Telegram соблюдает сессия бота (ScheduledSession, см. outbound.py):
+она одна на все исходящие запросы, поэтому своего ограничителя у рассылки нет.
+На TelegramRetryAfter отправка ждет указанное Telegram время, на сетевые
+ошибки и ошибки сервера - повторяет попытку с экспоненциальной задержкой.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Iterable, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class DeliveryResult:
+    chat_id: int
+    ok: bool
+    attempts: int
+    error: Optional[str] = None
+
+
+async def send_with_retry(
+    bot: Bot,
+    chat_id: int,
+    text: str,
+    max_retries: int = 3,
+    backoff: float = 1.0,
+    **kwargs: Any
+) -> DeliveryResult:
+    """
+    Отправляет одно сообщение с повторными попытками.
+    Ошибки не пробрасываются, а возвращаются в результате.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            return DeliveryResult(chat_id, ok=True, attempts=attempt)
+        except TelegramRetryAfter as e:
+            if attempt > max_retries:
+                return DeliveryResult(chat_id, ok=False, attempts=attempt, error=str(e))
+            logger.warning(f"Лимит Telegram для чата {chat_id}, повтор через {e.retry_after} с")
+            # Планировщик сессии тоже откладывает этот чат на retry_after, повтор не ждет дважды
+            await asyncio.sleep(e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if attempt > max_retries:
+                return DeliveryResult(chat_id, ok=False, attempts=attempt, error=str(e))
+            await asyncio.sleep(backoff * 2 ** (attempt - 1))
+        except TelegramAPIError as e:
+            # Бот заблокирован, чат не найден и т.п. - повтор не поможет
+            return DeliveryResult(chat_id, ok=False, attempts=attempt, error=str(e))
+        except Exception as e:
+            logger.exception(f"Непредвиденная ошибка при отправке сообщения в чат {chat_id}")
+            return DeliveryResult(chat_id, ok=False, attempts=attempt, error=repr(e))
+
+
+async def fan_out(
+    bot: Bot,
+    chat_ids: Iterable[int],
+    text: str,
+    concurrency: int = 8,
+    **kwargs: Any
+) -> List[DeliveryResult]:
+    """Отправляет сообщение во все чаты параллельно, не больше concurrency одновременно."""
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def deliver(chat_id: int) -> DeliveryResult:
+        async with semaphore:
+            return await send_with_retry(bot, chat_id, text, **kwargs)
+
+    return list(await asyncio.gather(*(deliver(chat_id) for chat_id in dict.fromkeys(chat_ids))))
@@ -0,0 +1,180 @@
+# your_bot/handlers/digest.py
+
+"""
+Режим сводки для уведомлений администраторов.
+Вместо отдельного сообщения на каждого кандидата результаты копятся и
+уходят одним сообщением раз в interval секунд или по набору batch_size
+результатов. Длинная сводка делится на части по лимиту длины сообщения Telegram.
+Срочные результаты (см. parse_urgent_rules) отправляются сразу, минуя сводку.
+Накопленные записи хранятся в базе до доставки (см. AdminDigest).
+"""
+import asyncio
+import html
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from database import db_manager
+from .delivery import DeliveryResult
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+UrgentFilter = Callable[[Dict[str, Any]], bool]
+
+
+def parse_urgent_rules(spec: str) -> UrgentFilter:
+    """
+    Строит фильтр срочных результатов из строки вида "поле=значение,поле=значение".
+    Результат срочный, если совпало хотя бы одно правило. Пустая строка - срочных нет.
+    """
+    rules = []
+    for rule in spec.split(","):
+        if not rule.strip():
+            continue
+        field, sep, value = rule.partition("=")
+        if not sep or not field.strip():
+            raise ValueError(f"Правило срочности '{rule}' должно иметь вид поле=значение")
+        rules.append((field.strip(), value.strip()))
+
+    def is_urgent(state_data: Dict[str, Any]) -> bool:
+        return any(str(state_data.get(field)) == value for field, value in rules)
+
+    return is_urgent
+
+
+def format_digest_entry(state_data: Dict[str, Any], completion_time: str) -> str:
+    """Одна строка сводки. Ответы экранируются: одна запись не должна ломать разметку всей сводки."""
+    def field(name: str, default: str = "—") -> str:
+        return html.escape(str(state_data.get(name, default)))
+
+    return (
+        f"• @{field('username', 'N/A')} (ID: {field('user_id')}), {field('name')}\n"
+        f"  РФ: {field('citizenship')}, аресты: {field('card_arrests')}, "
+        f"<code>{field('phone_number')}</code>, {completion_time}"
+    )
+
+
+def build_digest_chunks(entries: Sequence[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Собирает записи в сообщения не длиннее limit, не разрывая записи между сообщениями."""
+    chunks: List[str] = []
+    current: List[str] = []
+    length = 0
+    for entry in entries:
+        if len(entry) > limit:
+            entry = entry[:limit - 1] + "…"
+        if current and length + len(entry) + 2 > limit:
+            chunks.append("\n\n".join(current))
+            current, length = [], 0
+        current.append(entry)
+        length += len(entry) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+
+    total = len(chunks)
+    header = f"📋 <b>Сводка результатов: {len(entries)}</b>"
+    return [
+        f"{header}" + (f" ({i}/{total})" if total > 1 else "") + f"\n\n{chunk}"
+        for i, chunk in enumerate(chunks, 1)
+    ]
+
+
+class AdminDigest:
+    """
+    Сводка для администраторов. Записи хранятся в таблице admin_digest отдельно
+    для каждого админа и удаляются, только когда админ получил сводку с ними:
+    событие outbox обработано, как только запись сохранена, а сбой отправки
+    или перезапуск бота уведомление не теряют.
+    Сводка отправляется раз в interval секунд или сразу, как набралось
+    batch_size новых записей. Запись, не доставленная за max_attempts сводок,
+    остается в таблице с last_error.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, Sequence[int]], Awaitable[Sequence[DeliveryResult]]],
+        interval: float = 60.0,
+        batch_size: int = 50,
+        urgent: UrgentFilter = lambda data: False,
+        max_attempts: int = 10,
+    ):
+        self._send = send
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.urgent = urgent
+        self.max_attempts = max_attempts
+        # Записей добавлено с последней сводки
+        self._added = 0
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(), name="admin-digest")
+
+    async def add(self, entry: str, chat_ids: Sequence[int]) -> None:
+        """Сохраняет запись в сводку для админов chat_ids. Возвращается после записи в базу."""
+        await db_manager.queue_digest_entry(chat_ids, entry)
+        self._added += 1
+        if self._added >= self.batch_size:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        """Останавливает сводку, отправив накопленные записи; неотправленные дождутся следующего запуска."""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        self._stopping = True
+        self._wakeup.set()
+        await task
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка отправки сводки: {e}")
+
+    async def flush(self) -> int:
+        """Отправляет каждому админу сводку из его записей. Возвращает количество доставленных записей."""
+        self._added = 0
+        by_chat: Dict[int, List[Tuple[int, str]]] = {}
+        for entry_id, chat_id, entry in await db_manager.load_digest_entries(self.max_attempts):
+            by_chat.setdefault(chat_id, []).append((entry_id, entry))
+
+        sent: List[int] = []
+        failed: List[int] = []
+        errors: List[str] = []
+        for chat_id, items in by_chat.items():
+            error = await self._send_chat(chat_id, [entry for _, entry in items])
+            (sent if error is None else failed).extend(entry_id for entry_id, _ in items)
+            if error is not None:
+                errors.append(f"{chat_id}: {error}")
+        await db_manager.complete_digest_entries(sent, failed, "; ".join(errors) or None)
+        if sent:
+            logger.info(f"Отправлена сводка: {len(sent)} записей.")
+        if failed:
+            logger.error(f"Сводка не доставлена ({len(failed)} записей), повтор со следующей сводкой: {errors}")
+        return len(sent)
+
+    async def _send_chat(self, chat_id: int, entries: Sequence[str]) -> Optional[str]:
+        """Отправляет сводку одному админу. Возвращает ошибку или None, если доставлены все части."""
+        # Оставляем место под заголовок сводки
+        for chunk in build_digest_chunks(entries, limit=MESSAGE_LIMIT - 64):
+            for result in await self._send(chunk, [chat_id]):
+                if not result.ok:
+                    return result.error or "Сообщение не доставлено"
+        return None
@@ -0,0 +1,92 @@
+# your_bot/handlers/export.py
+
+"""
+Потоковая выгрузка результатов тестов в файл.
+Записи приходят из асинхронного генератора и сразу пишутся на диск,
+в памяти одновременно находится не больше одной порции строк.
+"""
+import csv
+import gzip
+import json
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+# Колонки выгрузки в порядке следования
+EXPORT_COLUMNS = (
+    "id", "user_id", "username", "name", "citizenship",
+    "card_arrests", "phone_number", "completion_date", "attempts",
+)
+
+EXPORT_FORMATS = {
+    "csv": ".csv",
+    "jsonl": ".jsonl.gz",
+}
+
+
+async def write_csv(rows: AsyncIterator[Dict[str, Any]], path: Path) -> int:
+    """Пишет записи в CSV (UTF-8 с BOM, чтобы Excel корректно открыл кириллицу)."""
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8-sig") as file:
+        writer = csv.DictWriter(file, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        async for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+async def write_jsonl_gz(rows: AsyncIterator[Dict[str, Any]], path: Path) -> int:
+    """Пишет записи в сжатый gzip JSON Lines: одна запись - одна строка."""
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8") as file:
+        async for row in rows:
+            record = {column: row.get(column) for column in EXPORT_COLUMNS}
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+async def export_to_file(rows: AsyncIterator[Dict[str, Any]], export_format: str) -> Tuple[Path, int]:
+    """
+    Выгружает записи во временный файл указанного формата.
+    Возвращает путь к файлу и количество записей. Файл удаляет вызывающий код.
+    """
+    suffix = EXPORT_FORMATS[export_format]
+    with tempfile.NamedTemporaryFile(prefix="export_", suffix=suffix, delete=False) as tmp:
+        path = Path(tmp.name)
+
+    writer = write_csv if export_format == "csv" else write_jsonl_gz
+    try:
+        count = await writer(rows, path)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path, count
+
+
+def parse_export_args(args: Optional[str]) -> Tuple[str, Optional[str], Optional[str], bool]:
+    """
+    Разбирает аргументы команды /export: [csv|jsonl] [С YYYY-MM-DD] [ПО YYYY-MM-DD] [archive].
+    Возвращает формат, полуинтервал дат [date_from, date_to) для запроса
+    и признак чтения архивных сегментов.
+    Вызывает ValueError при некорректных аргументах.
+    """
+    parts = (args or "").split()
+    export_format = "csv"
+    if parts and parts[0].lower() in EXPORT_FORMATS:
+        export_format = parts.pop(0).lower()
+    include_archive = bool(parts) and parts[-1].lower() == "archive"
+    if include_archive:
+        parts.pop()
+    if len(parts) > 2:
+        raise ValueError("Слишком много аргументов")
+
+    dates = [date.fromisoformat(part) for part in parts]
+    date_from = dates[0].isoformat() if dates else None
+    # Дата окончания включается в выгрузку целиком
+    date_to = (dates[1] + timedelta(days=1)).isoformat() if len(dates) > 1 else None
+    if date_from and date_to and date_from >= date_to:
+        raise ValueError("Дата начала позже даты окончания")
+    return export_format, date_from, date_to, include_archive
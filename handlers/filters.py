@@ -1,13 +1,39 @@
 """
 Кастомные фильтры для обработчиков.
 """
+from typing import Any, Dict, Optional, Union
+
 from aiogram.filters import BaseFilter
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, Message
 from config import ADMIN_IDS
 
+from .test_flow import FLOWS
+
 class IsAdmin(BaseFilter):
     """
     Фильтр для проверки, является ли пользователь администратором бота.
     """
-    async def __call__(self, message: Message) -> bool:
-        return message.from_user.id in ADMIN_IDS
\ No newline at end of file
+    async def __call__(self, event: Union[Message, CallbackQuery]) -> bool:
+        return event.from_user.id in ADMIN_IDS
+
+
+class InFlowStep(BaseFilter):
+    """
+    Пропускает сообщения пользователей, которые находятся на шаге анкеты.
+    Передает в обработчик анкету (flow) и шаг (step), найденные по raw_state.
+    """
+    async def __call__(self, message: Message, raw_state: Optional[str] = None) -> Union[bool, Dict[str, Any]]:
+        resolved = FLOWS.resolve(raw_state)
+        if resolved is None:
+            return False
+        flow, step = resolved
+        return {"flow": flow, "step": step}
+
+
+class InStaleFlowStep(BaseFilter):
+    """
+    Пропускает сообщения пользователей, чье состояние относится к анкете,
+    но шага нет ни в одной известной версии (шаг удален, версия потеряна при перезапуске).
+    """
+    async def __call__(self, message: Message, raw_state: Optional[str] = None) -> bool:
+        return FLOWS.is_flow_state(raw_state) and FLOWS.resolve(raw_state) is None
@@ -3,16 +3,98 @@
 """
 Модуль с клавиатурами для бота.
 Централизованное хранение всех клавиатур упрощает их переиспользование и модификацию.
+Постоянные клавиатуры собираются один раз, хранятся в реестре MARKUPS неизменяемыми
+и отправляются уже сериализованными (см. MarkupCachingSession).
 """
 
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Type, Union
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
 from aiogram.types import (
     ReplyKeyboardMarkup, 
+    ReplyKeyboardRemove,
     KeyboardButton,
     InlineKeyboardMarkup,
     InlineKeyboardButton
 )
-from aiogram.utils.keyboard import ReplyKeyboardBuilder
+from aiogram.types.base import TelegramObject
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiohttp import FormData
+from pydantic import ConfigDict
+
+from .callbacks import UsersPage, UserCard
+
+Markup = Union[InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove]
+
+
+@lru_cache(maxsize=None)
+def _frozen_type(cls: Type[TelegramObject]) -> Type[TelegramObject]:
+    """Подкласс типа aiogram, запрещающий изменение полей."""
+    return type(f"Frozen{cls.__name__}", (cls,), {"model_config": ConfigDict(frozen=True), "__module__": __name__})
+
+
+def _freeze(value: Any) -> Any:
+    """Копия объекта, в которой разметка и все кнопки неизменяемы."""
+    if isinstance(value, TelegramObject):
+        fields = {name: _freeze(getattr(value, name)) for name in type(value).model_fields}
+        return _frozen_type(type(value)).model_construct(_fields_set=value.model_fields_set, **fields)
+    if isinstance(value, list):
+        return [_freeze(item) for item in value]
+    return value
+
+
+class MarkupRegistry:
+    """
+    Реестр постоянных клавиатур: каждая собирается один раз при первом запросе,
+    дальше обработчики получают тот же неизменяемый объект.
+    JSON разметки кэшируется при первой отправке.
+    """
+
+    def __init__(self):
+        self._markups: Dict[Hashable, Markup] = {}
+        # id разметки -> сериализованный JSON; объекты живут в _markups, так что id не переиспользуются
+        self._serialized: Dict[int, Optional[str]] = {}
+
+    def get(self, key: Hashable, build: Callable[[], Markup]) -> Markup:
+        markup = self._markups.get(key)
+        if markup is None:
+            markup = self._markups[key] = _freeze(build())
+            self._serialized[id(markup)] = None
+        return markup
+
+    def __contains__(self, markup: Any) -> bool:
+        return id(markup) in self._serialized
+
+    def serialized(self, markup: Any, serialize: Callable[[Markup], str]) -> Optional[str]:
+        """JSON зарегистрированной разметки, None - если разметка не из реестра."""
+        if markup not in self:
+            return None
+        cached = self._serialized[id(markup)]
+        if cached is None:
+            cached = self._serialized[id(markup)] = serialize(markup)
+        return cached
+
+
+MARKUPS = MarkupRegistry()
+
+
+class MarkupCachingSession(AiohttpSession):
+    """
+    Сессия бота, которая подставляет в запрос готовый JSON клавиатур из реестра
+    вместо их сериализации при каждой отправке.
+    """
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod[Any]) -> FormData:
+        markup = getattr(method, "reply_markup", None)
+        serialized = MARKUPS.serialized(markup, lambda m: self.prepare_value(m, bot=bot, files={}))
+        if serialized is None:
+            return super().build_form_data(bot, method)
+        form = super().build_form_data(bot, method.model_copy(update={"reply_markup": None}))
+        form.add_field("reply_markup", serialized)
+        return form
 
 
 def get_start_test_keyboard() -> InlineKeyboardMarkup:
@@ -20,7 +102,7 @@ def get_start_test_keyboard() -> InlineKeyboardMarkup:
     Инлайн клавиатура с кнопкой начала теста.
     Используется в приветственном сообщении.
     """
-    return InlineKeyboardMarkup(
+    return MARKUPS.get("start_test", lambda: InlineKeyboardMarkup(
         inline_keyboard=[
             [
                 InlineKeyboardButton(
@@ -29,7 +111,7 @@ def get_start_test_keyboard() -> InlineKeyboardMarkup:
                 )
             ]
         ]
-    )
+    ))
 
 
 def get_yes_no_keyboard(placeholder: str = "Выберите ответ") -> ReplyKeyboardMarkup:
@@ -40,17 +122,24 @@ def get_yes_no_keyboard(placeholder: str = "Выберите ответ") -> Rep
     Args:
         placeholder: Текст-подсказка в поле ввода.
     """
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [
-                KeyboardButton(text="Да"),
-                KeyboardButton(text="Нет")
-            ]
-        ],
+    return get_choice_keyboard(("Да", "Нет"), placeholder)
+
+
+def get_choice_keyboard(options: Sequence[str], placeholder: str = "Выберите ответ") -> ReplyKeyboardMarkup:
+    """
+    Клавиатура с вариантами ответа в одну строку.
+    Используется для шагов анкеты с выбором ответа.
+    
+    Args:
+        options: Варианты ответа.
+        placeholder: Текст-подсказка в поле ввода.
+    """
+    return MARKUPS.get(("choice", tuple(options), placeholder), lambda: ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=option) for option in options]],
         resize_keyboard=True,
         one_time_keyboard=True,
         input_field_placeholder=placeholder
-    )
+    ))
 
 
 def get_phone_keyboard() -> ReplyKeyboardMarkup:
@@ -58,7 +147,7 @@ def get_phone_keyboard() -> ReplyKeyboardMarkup:
     Клавиатура для запроса номера телефона.
     Содержит кнопку быстрой отправки контакта.
     """
-    return ReplyKeyboardMarkup(
+    return MARKUPS.get("phone", lambda: ReplyKeyboardMarkup(
         keyboard=[
             [
                 KeyboardButton(
@@ -70,31 +159,49 @@ def get_phone_keyboard() -> ReplyKeyboardMarkup:
         resize_keyboard=True,
         one_time_keyboard=True,
         input_field_placeholder="Нажмите кнопку или введите номер"
-    )
+    ))
+
+
+def get_remove_keyboard() -> ReplyKeyboardRemove:
+    """Убирает клавиатуру с ответами (после вопросов с выбором и в конце теста)."""
+    return MARKUPS.get("remove", ReplyKeyboardRemove)
 
 
-def get_users_keyboard(users: List[Dict[str, Any]]) -> ReplyKeyboardMarkup:
+def get_users_page_keyboard(
+    users: List[Dict[str, Any]],
+    has_prev: bool,
+    has_next: bool
+) -> InlineKeyboardMarkup:
     """
-    Создает Reply-клавиатуру со списком пользователей для администратора.
+    Создает инлайн-клавиатуру с одной страницей списка пользователей.
     
     Args:
-        users: Список словарей с данными пользователей (id, username).
+        users: Записи страницы (id, username), от новых к старым.
+        has_prev: Есть ли более новые записи.
+        has_next: Есть ли более старые записи.
     """
-    # Используем билдер для динамического создания клавиатуры
-    builder = ReplyKeyboardBuilder()
+    builder = InlineKeyboardBuilder()
     
     for user in users:
-        # Текст кнопки содержит и ник, и ID из базы для уникальности
-        builder.button(text=f"{user['username']} (ID: {user['id']})")
-    
-    # Добавляем кнопку "Отмена" для выхода из состояния выбора
-    builder.button(text="Отмена")
-    
-    # Выстраиваем кнопки в один столбец для лучшей читаемости
+        builder.button(
+            text=f"{user['username']} (ID: {user['id']})",
+            callback_data=UserCard(record_id=user['id'])
+        )
     builder.adjust(1)
     
-    return builder.as_markup(
-        resize_keyboard=True, 
-        one_time_keyboard=True,
-        input_field_placeholder="Выберите пользователя из списка"
-    )
\ No newline at end of file
+    # Кнопки навигации в отдельной строке
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(
+            text="⬅️ Новее",
+            callback_data=UsersPage(after=users[0]['id']).pack()
+        ))
+    if has_next:
+        navigation.append(InlineKeyboardButton(
+            text="Старее ➡️",
+            callback_data=UsersPage(before=users[-1]['id']).pack()
+        ))
+    if navigation:
+        builder.row(*navigation)
+    
+    return builder.as_markup()
\ No newline at end of file
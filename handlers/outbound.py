@@ -0,0 +1,229 @@
+# your_bot/handlers/outbound.py
+
+"""
+Планировщик исходящих сообщений.
+Все запросы бота, адресованные чату (ответы кандидатам, сообщения админам,
+уведомления), проходят через сессию ScheduledSession. Прежде чем уйти в
+Bot API, запрос берет токен из общего ведра (лимит на бота) и из ведра
+своего чата. Если токенов нет, запрос ждет в очереди с приоритетом:
+ответы пользователям уходят раньше уведомлений администраторам.
+Запросы без чата (getUpdates, answerCallbackQuery) не ограничиваются.
+"""
+import asyncio
+import bisect
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+from .keyboards import MarkupCachingSession
+
+logger = logging.getLogger(__name__)
+
+ChatId = Union[int, str]
+
+
+class Priority(IntEnum):
+    """Классы приоритета: меньшее значение обслуживается раньше."""
+    USER = 0
+    ADMIN = 1
+
+
+# Приоритет запросов текущей задачи; рассылки админам выставляют его через send_priority
+outbound_priority: ContextVar[Priority] = ContextVar("outbound_priority", default=Priority.USER)
+
+
+@contextmanager
+def send_priority(priority: Priority) -> Iterator[None]:
+    """Выполняет запросы внутри блока (и в созданных в нем задачах) с заданным приоритетом."""
+    token = outbound_priority.set(priority)
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд появится токен (0 - уже есть)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float) -> None:
+        """Следующий токен появится не раньше чем через seconds секунд."""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundScheduler:
+    """
+    Очередь исходящих запросов с общим и початовым ограничением скорости.
+    Первым обслуживается самый приоритетный запрос, у чата которого есть токен,
+    поэтому занятый чат не задерживает остальные.
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_rate, time.monotonic())
+        self._chats: Dict[ChatId, TokenBucket] = {}
+        # Ожидающие запросы, отсортированные по (приоритет, порядок поступления)
+        self._waiting: List[Tuple[int, int, ChatId, float, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._sent = {priority: 0 for priority in Priority}
+        self._delayed = 0
+        self._max_wait = 0.0
+
+    def _chat(self, chat_id: ChatId, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Полные ведра ничем не отличаются от новых, их можно забыть
+            if len(self._chats) > 4096:
+                self._chats = {chat: b for chat, b in self._chats.items() if not b.is_full(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _take(self, chat_id: ChatId, priority: int, now: float) -> None:
+        self._global.take(now)
+        self._chat(chat_id, now).take(now)
+        self._sent[Priority(priority)] += 1
+
+    async def acquire(self, chat_id: ChatId, priority: Priority = Priority.USER) -> None:
+        """Ждет разрешения отправить запрос в чат."""
+        now = time.monotonic()
+        if not self._waiting and self._global.wait_time(now) == 0 and self._chat(chat_id, now).wait_time(now) == 0:
+            self._take(chat_id, priority, now)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (int(priority), next(self._seq), chat_id, now, future)
+        # Порядковый номер уникален, поэтому до сравнения future дело не доходит
+        bisect.insort(self._waiting, entry)
+        self._delayed += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="outbound-scheduler")
+        self._wakeup.set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+            raise
+
+    def pause(self, chat_id: ChatId, seconds: float) -> None:
+        """Откладывает запросы в чат, например после ответа 429 от Telegram."""
+        self._chat(chat_id, time.monotonic()).pause(time.monotonic(), seconds)
+        self._wakeup.set()
+
+    async def _sleep(self, delay: float) -> None:
+        # Новый запрос может оказаться готов раньше, поэтому ждем и его
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self) -> None:
+        while True:
+            if not self._waiting:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            global_wait = self._global.wait_time(now)
+            if global_wait > 0:
+                await self._sleep(global_wait)
+                continue
+
+            chat_wait = None
+            for i, (priority, _, chat_id, enqueued, future) in enumerate(self._waiting):
+                wait = self._chat(chat_id, now).wait_time(now)
+                if wait == 0:
+                    del self._waiting[i]
+                    if not future.done():
+                        self._take(chat_id, priority, now)
+                        self._max_wait = max(self._max_wait, now - enqueued)
+                        future.set_result(None)
+                    break
+                chat_wait = wait if chat_wait is None else min(chat_wait, wait)
+            else:
+                await self._sleep(chat_wait)
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди по приоритетам и счетчики с момента запуска."""
+        queued = {priority.name.lower(): 0 for priority in Priority}
+        for priority, *_ in self._waiting:
+            queued[Priority(priority).name.lower()] += 1
+        return {
+            "queued": queued,
+            "sent": {priority.name.lower(): count for priority, count in self._sent.items()},
+            "delayed": self._delayed,
+            "max_wait": self._max_wait,
+        }
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for *_, future in self._waiting:
+            future.cancel()
+        self._waiting.clear()
+
+
+class ScheduledSession(MarkupCachingSession):
+    """Сессия бота, пропускающая запросы в чаты через OutboundScheduler."""
+
+    def __init__(self, scheduler: Optional[OutboundScheduler] = None, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.scheduler = scheduler or OutboundScheduler()
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: Optional[int] = None) -> Any:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await super().make_request(bot, method, timeout)
+        await self.scheduler.acquire(chat_id, outbound_priority.get())
+        try:
+            return await super().make_request(bot, method, timeout)
+        except TelegramRetryAfter as e:
+            self.scheduler.pause(chat_id, e.retry_after)
+            raise
+
+    async def close(self) -> None:
+        await self.scheduler.close()
+        await super().close()
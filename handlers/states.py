@@ -25,7 +25,3 @@ class TestStates(StatesGroup):
                 return state_obj
         return None
 
-
-class AdminStates(StatesGroup):
-    """Группа состояний для админ-панели"""
-    choosing_user = State()
\ No newline at end of file
@@ -2,69 +2,277 @@
 
 """
 Конфигурация и логика прохождения теста.
-Этот файл описывает каждый шаг теста в виде структуры данных,
-что позволяет легко изменять вопросы, порядок и логику ветвления.
+Шаги анкеты описываются в файле flow.json: текст вопроса, тип ответа,
+переход к следующему шагу, провальные ответы и дополнительные сообщения.
+Файл проверяется и компилируется в неизменяемую таблицу шагов, которую
+выполняет один общий обработчик. Бот следит за файлом и подменяет
+скомпилированную анкету без перезапуска; кандидаты, уже начавшие тест,
+проходят его до конца в той версии, в которой начали.
+Версии хранятся только в памяти: после перезапуска начатые прохождения
+продолжаются по текущей анкете, а если их шага в ней нет - начинаются заново.
 """
-from aiogram import F
-
-from .states import TestStates
-from .keyboards import get_yes_no_keyboard, get_phone_keyboard
-
-# Описываем весь флоу теста в виде словаря.
-# Ключ - текущее состояние FSM.
-TEST_FLOW = {
-    # ШАГ 1: Вопрос об имени
-    TestStates.name_question: {
-        "type": "text", # Указываем, что ожидаем произвольный текст
-        "text": "Как вас зовут?",
-        "keyboard": None, # Клавиатура не нужна
-        "success_path": TestStates.citizenship_question,
-    },
-    
-    # ШАГ 2: Вопрос о гражданстве
-    TestStates.citizenship_question: {
-        "type": "yes_no", # Указываем тип вопроса
-        "text": "Есть ли у Вас Российское гражданство?",
-        "keyboard": get_yes_no_keyboard,
-        "success_path": TestStates.card_arrests_question, # Куда идти при ответе 'Да'
-        "failure_path": { # Что делать при ответе 'Нет'
-            "message": "Извините, предложение только для обладателей Российского гражданства."
-        }
-    },
-
-    # ШАГ 3: Вопрос об арестах
-    TestStates.card_arrests_question: {
-        "type": "yes_no",
-        "text": "Есть ли у вас аресты по картам?",
-        "keyboard": get_yes_no_keyboard,
-        "success_path": TestStates.phone_number_question, # В любом случае идем дальше
-        "special_cases": { # Специальный обработчик для ответа 'Да'
-            "Да": {
-                "message": "Аресты это не проблема, служба поддержки подскажет как избежать ограничений."
-            }
-        }
-    },
-
-    # ШАГ 4: Вопрос о номере телефона
-    TestStates.phone_number_question: {
-        "type": "phone", # Уникальный тип для телефона
-        "text": (
-            "Пожалуйста, предоставьте ваш номер телефона.\n"
-            "Вы можете нажать кнопку ниже или ввести номер вручную."
-        ),
-        "keyboard": get_phone_keyboard
-    }
-}
+import asyncio
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Tuple, Union
+
+from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove
+
+from .keyboards import get_choice_keyboard, get_phone_keyboard, get_remove_keyboard
+
+logger = logging.getLogger(__name__)
+
+FLOW_PATH = Path(__file__).parent / "flow.json"
+
+# Строка состояния FSM: flow:<версия анкеты>:<шаг>. Версия в самом состоянии
+# позволяет найти нужную анкету по raw_state без чтения данных сессии.
+STATE_PREFIX = "flow"
+# Состояния TestStates из прежних версий бота, сохраненные в хранилище FSM
+LEGACY_STATE_PREFIX = "TestStates:"
 
-# Определяем правила валидации для каждого шага.
-VALIDATION_RULES = {
-    TestStates.citizenship_question: F.text.in_(["Да", "Нет"]),
-    TestStates.card_arrests_question: F.text.in_(["Да", "Нет"]),
-    # Для имени и телефона валидация встроена в их обработчики
+STEP_TYPES = ("text", "choice", "phone")
+
+# Сообщение кандидату, чей шаг пропал из анкеты (например, удален после перезапуска)
+RESTART_MESSAGE = "Анкета изменилась, поэтому пройдем тест заново."
+
+DEFAULT_ERRORS = {
+    "text": "Пожалуйста, ответьте текстом.",
+    "phone": "Номер телефона введен некорректно. Пожалуйста, введите корректный номер.",
 }
 
-# Определяем, какой ответ на каком шаге считается "провальным" (завершает тест)
-FAILURE_ANSWERS = {
-    TestStates.citizenship_question: "Нет",
-    # У вопроса об арестах теперь нет провального ответа
-}
\ No newline at end of file
+
+@dataclass(frozen=True)
+class Step:
+    # Идентификатор шага, он же ключ ответа в данных анкеты
+    id: str
+    type: str
+    text: str
+    # Строка состояния FSM этого шага
+    state: str
+    # Клавиатура из реестра MARKUPS, общая для всех сообщений и версий анкеты
+    keyboard: Union[ReplyKeyboardMarkup, ReplyKeyboardRemove]
+    # Сообщение на ответ, который не подходит под тип шага
+    error: str
+    next: Optional[str] = None
+    options: Tuple[str, ...] = ()
+    # Ответы, завершающие тест, и сообщения для них
+    fail: Mapping[str, str] = field(default_factory=dict)
+    # Дополнительные сообщения на отдельные ответы
+    messages: Mapping[str, str] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class Flow:
+    version: str
+    start: str
+    finish_message: str
+    steps: Mapping[str, Step]
+
+    @property
+    def first_step(self) -> Step:
+        return self.steps[self.start]
+
+    def next_step(self, step: Step) -> Optional[Step]:
+        """Следующий шаг или None, если шаг последний."""
+        return self.steps[step.next] if step.next else None
+
+
+def _require_str(value: Any, where: str) -> str:
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"{where}: ожидается непустая строка")
+    return value
+
+
+def _answer_messages(config: Dict[str, Any], name: str, step_id: str, options: Tuple[str, ...]) -> Mapping[str, str]:
+    messages = config.get(name, {})
+    if not isinstance(messages, dict):
+        raise ValueError(f"Шаг '{step_id}': поле '{name}' должно быть объектом")
+    for answer, message in messages.items():
+        if answer not in options:
+            raise ValueError(f"Шаг '{step_id}': ответа '{answer}' из '{name}' нет среди вариантов")
+        _require_str(message, f"Шаг '{step_id}', {name}['{answer}']")
+    return MappingProxyType(dict(messages))
+
+
+def compile_flow(definition: Dict[str, Any], version: str) -> Flow:
+    """
+    Проверяет описание анкеты и собирает из него неизменяемую таблицу шагов.
+    Вызывает ValueError с описанием первой найденной ошибки.
+    """
+    if not isinstance(definition, dict):
+        raise ValueError("Описание анкеты должно быть объектом")
+    raw_steps = definition.get("steps")
+    if not isinstance(raw_steps, dict) or not raw_steps:
+        raise ValueError("В анкете нет шагов")
+
+    steps = {}
+    for step_id, config in raw_steps.items():
+        if not step_id.isidentifier():
+            raise ValueError(f"Шаг '{step_id}': идентификатор должен состоять из букв, цифр и '_'")
+        if not isinstance(config, dict):
+            raise ValueError(f"Шаг '{step_id}': описание должно быть объектом")
+        step_type = config.get("type")
+        if step_type not in STEP_TYPES:
+            raise ValueError(f"Шаг '{step_id}': неизвестный тип '{step_type}'")
+
+        options: Tuple[str, ...] = ()
+        if step_type == "choice":
+            options = tuple(config.get("options") or ())
+            if len(options) < 2:
+                raise ValueError(f"Шаг '{step_id}': нужно не меньше двух вариантов ответа")
+            for option in options:
+                _require_str(option, f"Шаг '{step_id}', вариант ответа")
+            keyboard: Union[ReplyKeyboardMarkup, ReplyKeyboardRemove] = get_choice_keyboard(options)
+            default_error = "Пожалуйста, используйте кнопки " + " или ".join(f"'{o}'" for o in options) + " для ответа."
+        elif step_type == "phone":
+            keyboard = get_phone_keyboard()
+            default_error = DEFAULT_ERRORS["phone"]
+        else:
+            keyboard = get_remove_keyboard()
+            default_error = DEFAULT_ERRORS["text"]
+
+        next_id = config.get("next")
+        if next_id is not None and next_id not in raw_steps:
+            raise ValueError(f"Шаг '{step_id}': следующий шаг '{next_id}' не описан")
+
+        steps[step_id] = Step(
+            id=step_id,
+            type=step_type,
+            text=_require_str(config.get("text"), f"Шаг '{step_id}', text"),
+            state=f"{STATE_PREFIX}:{version}:{step_id}",
+            keyboard=keyboard,
+            error=config.get("error") or default_error,
+            next=next_id,
+            options=options,
+            fail=_answer_messages(config, "fail", step_id, options),
+            messages=_answer_messages(config, "messages", step_id, options),
+        )
+
+    start = definition.get("start")
+    if start not in steps:
+        raise ValueError(f"Первый шаг '{start}' не описан")
+    # Анкета должна заканчиваться: проход по next от первого шага не зацикливается
+    seen, current = set(), start
+    while current is not None:
+        if current in seen:
+            raise ValueError(f"Шаги анкеты зациклены на '{current}'")
+        seen.add(current)
+        current = steps[current].next
+
+    return Flow(
+        version=version,
+        start=start,
+        finish_message=_require_str(definition.get("finish_message"), "finish_message"),
+        steps=MappingProxyType(steps),
+    )
+
+
+def load_flow(path: Path) -> Flow:
+    """Читает и компилирует анкету из файла. Версия - хэш содержимого файла."""
+    content = path.read_bytes()
+    version = hashlib.sha1(content).hexdigest()[:8]
+    try:
+        definition = json.loads(content)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Некорректный JSON: {e}") from e
+    return compile_flow(definition, version)
+
+
+class FlowRegistry:
+    """
+    Текущая анкета и не больше max_versions последних загруженных версий.
+    Подмена текущей анкеты - одно присваивание, обработчик видит либо старую, либо новую версию целиком.
+    Прохождения забытых версий продолжаются по текущей, как после перезапуска.
+    """
+
+    def __init__(self, flow: Flow, max_versions: int = 16):
+        self.current = flow
+        self.max_versions = max(1, max_versions)
+        self._versions: "OrderedDict[str, Flow]" = OrderedDict({flow.version: flow})
+
+    def install(self, flow: Flow) -> None:
+        self._versions[flow.version] = flow
+        self._versions.move_to_end(flow.version)
+        while len(self._versions) > self.max_versions:
+            self._versions.popitem(last=False)
+        self.current = flow
+
+    @staticmethod
+    def is_flow_state(raw_state: Optional[str]) -> bool:
+        """Состояние FSM относится к анкете (текущей, прежней или TestStates)."""
+        return bool(raw_state) and raw_state.startswith((STATE_PREFIX + ":", LEGACY_STATE_PREFIX))
+
+    def resolve(self, raw_state: Optional[str]) -> Optional[Tuple[Flow, Step]]:
+        """
+        Находит анкету и шаг по строке состояния FSM.
+        None - это не шаг анкеты или шага нет в найденной версии.
+        """
+        if not raw_state:
+            return None
+        if raw_state.startswith(LEGACY_STATE_PREFIX):
+            flow = self.current
+            step_id = raw_state[len(LEGACY_STATE_PREFIX):].replace("_question", "")
+        elif raw_state.startswith(STATE_PREFIX + ":"):
+            _, version, step_id = raw_state.split(":", 2)
+            # Версии, загруженные до перезапуска, неизвестны: продолжаем по текущей
+            flow = self._versions.get(version, self.current)
+        else:
+            return None
+        step = flow.steps.get(step_id)
+        return (flow, step) if step else None
+
+
+FLOWS = FlowRegistry(load_flow(FLOW_PATH))
+
+_watch_task: Optional[asyncio.Task] = None
+
+
+async def reload_flow(path: Path = FLOW_PATH) -> bool:
+    """Перечитывает анкету. Ошибочное описание не применяется, текущая анкета остается."""
+    try:
+        flow = await asyncio.to_thread(load_flow, path)
+    except (OSError, ValueError) as e:
+        logger.error(f"Анкета {path} не загружена, используется версия {FLOWS.current.version}: {e}")
+        return False
+    if flow.version != FLOWS.current.version:
+        FLOWS.install(flow)
+        logger.info(f"Загружена анкета версии {flow.version}.")
+    return True
+
+
+async def _watch_loop(path: Path, interval: float) -> None:
+    mtime = path.stat().st_mtime_ns if path.exists() else None
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            current = path.stat().st_mtime_ns
+        except OSError:
+            continue
+        if current != mtime:
+            mtime = current
+            await reload_flow(path)
+
+
+async def start_flow_watch(path: Path = FLOW_PATH, interval: float = 5.0) -> None:
+    """Запускает отслеживание изменений файла анкеты."""
+    global _watch_task
+    if _watch_task is not None or interval <= 0:
+        return
+    _watch_task = asyncio.create_task(_watch_loop(path, interval), name="flow-watch")
+
+
+async def stop_flow_watch() -> None:
+    global _watch_task
+    if _watch_task is None:
+        return
+    task, _watch_task = _watch_task, None
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
@@ -2,134 +2,125 @@
 
 """
 Обработчики для прохождения теста.
-Используют конфигурационно-управляемый подход из test_flow.py.
+Шаги анкеты описаны в flow.json и выполняются одним общим обработчиком (см. test_flow.py).
 """
 import logging
+from typing import Any, Dict, Optional
 
-from aiogram import Router, F, Bot, types
-from aiogram.types import CallbackQuery, Message, ReplyKeyboardRemove
-from aiogram.filters import StateFilter
+from aiogram import Router, F, Bot
+from aiogram.types import CallbackQuery, Message, User
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State
 
-from .states import TestStates
-from .utils import finish_test, validate_phone_number
-from .test_flow import TEST_FLOW, FAILURE_ANSWERS
+from .filters import InFlowStep, InStaleFlowStep
+from .keyboards import get_remove_keyboard
+from .utils import finish_test, update_data_and_set_state, validate_phone_number
+from .test_flow import FLOWS, RESTART_MESSAGE, Flow, Step
+from database.store import ResultStore
 
 logger = logging.getLogger(__name__)
 test_router = Router(name="test_router")
 
 
-async def proceed_to_next_step(message: Message, state: FSMContext, next_state: State):
-    """Хелпер-функция для перехода к следующему шагу теста."""
-    step_config = TEST_FLOW[next_state]
-    keyboard = step_config.get("keyboard")
-    
-    await message.answer(
-        text=step_config["text"],
-        reply_markup=keyboard() if keyboard else ReplyKeyboardRemove()
-    )
-    await state.set_state(next_state)
+async def proceed_to_next_step(
+    message: Message,
+    state: FSMContext,
+    next_step: Step,
+    data: Optional[Dict[str, Any]] = None
+):
+    """
+    Хелпер-функция для перехода к следующему шагу теста.
+    Ответ на текущий шаг (data) сохраняется вместе со сменой состояния.
+    """
+    await message.answer(text=next_step.text, reply_markup=next_step.keyboard)
+    if data:
+        await update_data_and_set_state(state, next_step.state, data)
+    else:
+        await state.set_state(next_step.state)
+
+
+def read_answer(step: Step, message: Message) -> Optional[str]:
+    """Извлекает ответ из сообщения по типу шага. None - ответ не подходит."""
+    if step.type == "phone":
+        if message.contact:
+            return message.contact.phone_number
+        if message.text and validate_phone_number(message.text):
+            return message.text
+        return None
+    if step.type == "choice":
+        return message.text if message.text in step.options else None
+    return message.text or None
+
+
+def initial_data(user: User) -> Dict[str, Any]:
+    """Данные новой анкеты: кто ее проходит."""
+    return {
+        "user_id": user.id,
+        "username": user.username or "Без username",
+    }
 
 
 @test_router.callback_query(F.data == "start_test")
 async def start_test_handler(callback: CallbackQuery, state: FSMContext) -> None:
     """
     Обработчик нажатия на кнопку "Пройти тест".
-    Запускает первый шаг теста из новой конфигурации.
+    Запускает первый шаг текущей версии анкеты.
     """
-    first_step_state = TestStates.name_question
-    await proceed_to_next_step(callback.message, state, first_step_state)
+    await proceed_to_next_step(callback.message, state, FLOWS.current.first_step, initial_data(callback.from_user))
     await callback.answer()
     logger.info(f"Пользователь {callback.from_user.id} (@{callback.from_user.username}) начал тест")
 
 
-@test_router.message(StateFilter(TestStates.name_question), F.text)
-async def process_name_answer(message: Message, state: FSMContext):
-    """Обработчик ответа на вопрос об имени."""
-    await state.update_data(
-        name=message.text,
-        user_id=message.from_user.id,
-        username=message.from_user.username or "Без username"
-    )
-    logger.info(f"Пользователь {message.from_user.id} ввел имя: {message.text}")
-
-    current_config = TEST_FLOW[TestStates.name_question]
-    await proceed_to_next_step(message, state, current_config["success_path"])
-
-
-@test_router.message(
-    StateFilter(TestStates.citizenship_question, TestStates.card_arrests_question),
-    F.text.in_(["Да", "Нет"])
-)
-async def process_yes_no_answer(message: Message, state: FSMContext, bot: Bot):
+@test_router.message(InFlowStep())
+async def process_answer(
+    message: Message,
+    state: FSMContext,
+    bot: Bot,
+    result_store: ResultStore,
+    flow: Flow,
+    step: Step
+) -> None:
     """
-    УНИВЕРСАЛЬНЫЙ обработчик для всех шагов теста типа "Да/Нет".
+    УНИВЕРСАЛЬНЫЙ обработчик ответа на любой шаг анкеты.
+    Анкета и шаг определены фильтром по raw_state, повторного чтения состояния нет.
     """
-    current_state_str = await state.get_state()
-    current_state = TestStates.get_by_state_str(current_state_str)
-    
-    if not current_state:
-        logger.error(f"Ошибка: не удалось определить состояние для {current_state_str}")
+    answer = read_answer(step, message)
+    if answer is None:
+        await message.answer(step.error)
         return
 
-    answer = message.text
-    step_config = TEST_FLOW[current_state]
-    
-    state_key = current_state.state.split(':')[-1].replace('_question', '')
-    await state.update_data({state_key: answer})
-    logger.info(f"Пользователь {message.from_user.id} на шаге '{state_key}' ответил: {answer}")
-
-    if answer == FAILURE_ANSWERS.get(current_state):
-        failure_config = step_config["failure_path"]
-        await message.answer(failure_config["message"], reply_markup=ReplyKeyboardRemove())
-        await finish_test(message.from_user.id, state, bot)
+    logger.info(f"Пользователь {message.from_user.id} на шаге '{step.id}' ответил: {answer}")
+    data = {step.id: answer}
+
+    fail_message = step.fail.get(answer)
+    if fail_message:
+        await state.update_data(data)
+        await message.answer(fail_message, reply_markup=get_remove_keyboard())
+        await finish_test(message.from_user.id, state, bot, result_store)
         return
 
-    special_cases = step_config.get("special_cases", {})
-    if answer in special_cases:
-        await message.answer(special_cases[answer]["message"])
+    special_message = step.messages.get(answer)
+    if special_message:
+        await message.answer(special_message)
 
-    await proceed_to_next_step(message, state, step_config["success_path"])
+    next_step = flow.next_step(step)
+    if next_step is not None:
+        await proceed_to_next_step(message, state, next_step, data)
+        return
 
+    # Последний шаг: сообщаем об успешном прохождении и завершаем тест
+    await state.update_data(data)
+    await message.answer(flow.finish_message, reply_markup=get_remove_keyboard(), parse_mode=None)
+    await finish_test(message.from_user.id, state, bot, result_store)
 
-# ===> ИЗМЕНЕНИЯ ЗДЕСЬ <===
-@test_router.message(StateFilter(TestStates.phone_number_question))
-async def process_phone_number(message: Message, state: FSMContext, bot: Bot) -> None:
-    """Обработчик получения номера телефона."""
-    phone_number = None
-    if message.contact:
-        phone_number = message.contact.phone_number
-    elif message.text and validate_phone_number(message.text):
-        phone_number = message.text
-    else:
-        await message.answer(
-            "Номер телефона введен некорректно. Пожалуйста, введите корректный номер."
-        )
-        return
 
-    await state.update_data(phone_number=phone_number)
-    logger.info(f"Пользователь {message.from_user.id} предоставил номер: {phone_number}")
-    
-    # 1. Формируем новое финальное сообщение
-    registration_link_placeholder = "(ссылка на регистрацию)"
-    instruction_link = "https://clck.ru/3QMBsz"
-    support_user_placeholder = "@Lavka_Job_Support"
-
-    final_text = (
-        f"✅ Тест пройден! Вот Ваша ссылка на регистрацию - {registration_link_placeholder}.\n\n"
-        f"Инструкция по регистрации - {instruction_link}.\n"
-        f"Поддержка - {support_user_placeholder}."
-    )
-    
-    # 2. Отправляем его пользователю
-    await message.answer(final_text, reply_markup=ReplyKeyboardRemove(), parse_mode=None)
-
-    # 3. Завершаем тест (отправляем данные админу и т.д.)
-    await finish_test(message.from_user.id, state, bot)
-
-
-@test_router.message(StateFilter(TestStates.citizenship_question, TestStates.card_arrests_question))
-async def invalid_yes_no_answer(message: Message) -> None:
-    """Обработчик некорректного ответа (не 'Да'/'Нет')."""
-    await message.answer("Пожалуйста, используйте кнопки 'Да' или 'Нет' для ответа.")
\ No newline at end of file
+@test_router.message(InStaleFlowStep())
+async def restart_stale_flow(message: Message, state: FSMContext) -> None:
+    """
+    Шаг сохраненного состояния не найден в анкете: без этого обработчика
+    кандидат остался бы без ответа. Прежние ответы сбрасываются, тест начинается
+    с первого шага текущей версии.
+    """
+    logger.info(f"Шаг пользователя {message.from_user.id} не найден в анкете, тест начат заново")
+    await state.set_data(initial_data(message.from_user))
+    await message.answer(RESTART_MESSAGE)
+    await proceed_to_next_step(message, state, FLOWS.current.first_step)
@@ -0,0 +1,129 @@
+# your_bot/handlers/throttling.py
+
+"""
+Защита от флуда: внешний middleware диспетчера ограничивает, сколько сообщений
+и нажатий кнопок пользователя обрабатывается за скользящее окно.
+Он стоит перед middleware FSM, поэтому лишние обновления отбрасываются
+до блокировки пользователя и чтения его состояния из хранилища FSM
+и не тратят лимит Bot API; пользователь один раз за окно получает
+предупреждение (или не получает ничего, если оно не задано).
+Счетчики хранятся в ограниченном кэше и сами исчезают через окно бездействия.
+"""
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, Mapping, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import CallbackQuery, Message, TelegramObject, Update, User
+
+from database.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_WARNING = "⏳ Слишком много сообщений. Подождите немного и попробуйте снова."
+
+# Типы обновлений, которые ограничиваются; остальные проходят без учета
+THROTTLED_EVENTS = frozenset({"message", "callback_query"})
+
+
+class _Window:
+    """Время последних limit пропущенных обновлений пользователя."""
+
+    __slots__ = ("hits", "warned")
+
+    def __init__(self, limit: int):
+        self.hits: Deque[float] = deque(maxlen=limit)
+        self.warned = False
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Пропускает не больше limit обновлений пользователя за window секунд
+    (0 - без ограничения). В limits задаются личные лимиты отдельных
+    пользователей (например, админов), пользователи из exempt не ограничиваются.
+    Одновременно отслеживается не больше maxsize пользователей; давно
+    неактивные вытесняются первыми.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        window: float,
+        warning: Optional[str] = THROTTLE_WARNING,
+        exempt: Iterable[int] = (),
+        maxsize: int = 10000,
+        limits: Optional[Mapping[int, int]] = None,
+    ):
+        self.limit = max(0, limit)
+        self.window = window
+        self.warning = warning
+        self.limits = {user_id: max(0, user_limit) for user_id, user_limit in (limits or {}).items()}
+        self.limits.update(dict.fromkeys(exempt, 0))
+        # Окно без новых обновлений дольше window ничего не ограничивает, его можно забыть
+        self._windows = TTLCache(maxsize=maxsize, ttl=window)
+        self.dropped = 0
+
+    def limit_for(self, user_id: int) -> int:
+        """Лимит пользователя за окно; 0 - без ограничения."""
+        return self.limits.get(user_id, self.limit)
+
+    def allow(self, user_id: int, now: Optional[float] = None) -> bool:
+        """Учитывает обновление пользователя; False - лимит окна исчерпан."""
+        limit = self.limit_for(user_id)
+        if not limit:
+            return True
+        now = time.monotonic() if now is None else now
+        entry = self._windows.get(user_id)
+        if entry is None:
+            entry = _Window(limit)
+        elif len(entry.hits) == limit and now - entry.hits[0] < self.window:
+            return False
+        entry.hits.append(now)
+        entry.warned = False
+        self._windows.put(user_id, entry)
+        return True
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Update) and event.event_type not in THROTTLED_EVENTS:
+            return await handler(event, data)
+        user: Optional[User] = data.get("event_from_user")
+        if user is None or self.allow(user.id):
+            return await handler(event, data)
+
+        self.dropped += 1
+        entry = self._windows.get(user.id)
+        if entry is None or entry.warned:
+            return None
+        entry.warned = True
+        logger.warning(f"Пользователь {user.id} превысил лимит {self.limit_for(user.id)} обновлений за {self.window} с.")
+        # Предупреждение - ответ на само сообщение или нажатие, а не на обновление
+        target = event.event if isinstance(event, Update) else event
+        if self.warning is None or not isinstance(target, (Message, CallbackQuery)):
+            return None
+        try:
+            await target.answer(self.warning)
+        except Exception as e:
+            logger.error(f"Не удалось предупредить пользователя {user.id}: {e}")
+        return None
+
+
+def setup_throttling(dispatcher: Dispatcher, middleware: ThrottlingMiddleware) -> ThrottlingMiddleware:
+    """
+    Подключает ограничение к обновлениям диспетчера перед middleware FSM
+    (диспетчер регистрирует его сам при создании, поэтому он переставляется в конец).
+    Данные о пользователе к этому моменту уже заполнены middleware диспетчера.
+    """
+    middlewares = dispatcher.update.outer_middleware
+    fsm_registered = dispatcher.fsm in middlewares
+    if fsm_registered:
+        middlewares.unregister(dispatcher.fsm)
+    middlewares.register(middleware)
+    if fsm_registered:
+        middlewares.register(dispatcher.fsm)
+    return middleware
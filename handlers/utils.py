@@ -8,35 +8,108 @@ import logging
 import re
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Sequence
 
 from aiogram import Bot
 from aiogram.enums import ParseMode
 from aiogram.fsm.context import FSMContext
-from aiogram.exceptions import TelegramAPIError
+from aiogram.fsm.storage.base import StateType
 
 # Важно: в config.py должна быть переменная ADMIN_IDS = [id1, id2]
-from config import ADMIN_IDS
-from database.db_manager import save_test_result
+from config import ADMIN_IDS, NOTIFY_CONCURRENCY, NOTIFY_MAX_RETRIES
+from .delivery import DeliveryResult, fan_out
+from .digest import AdminDigest, UrgentFilter, format_digest_entry
+from .outbound import Priority, send_priority
+from database.store import ResultStore, SQLiteResultStore
 
 logger = logging.getLogger(__name__)
 
+# Буфер сводки; None - каждый результат отправляется отдельным сообщением
+_digest: Optional[AdminDigest] = None
 
-async def notify_admins(bot: Bot, state_data: Dict[str, Any]) -> None:
+
+def _completion_time(completed_at: Optional[str] = None) -> str:
+    """Время завершения по Москве: из ISO-строки (местное время сервера) или текущее."""
+    moment = datetime.fromisoformat(completed_at).astimezone(timezone.utc) if completed_at else datetime.now(timezone.utc)
+    try:
+        return moment.astimezone(ZoneInfo("Europe/Moscow")).strftime('%Y-%m-%d %H:%M:%S')
+    except Exception as e:
+        # Если вдруг проблема с tzdata, берем UTC
+        logger.error(f"Ошибка временной зоны: {e}")
+        return moment.strftime('%Y-%m-%d %H:%M:%S UTC')
+
+
+async def send_to_admins(bot: Bot, text: str, admin_ids: Optional[Sequence[int]] = None) -> List[DeliveryResult]:
+    """
+    Отправляет HTML-сообщение всем администраторам параллельно, возвращает результат по каждому.
+    В планировщике исходящих сообщений уведомления уступают очередь ответам кандидатам.
+    """
+    with send_priority(Priority.ADMIN):
+        results = await fan_out(
+            bot,
+            ADMIN_IDS if admin_ids is None else admin_ids,
+            text,
+            concurrency=NOTIFY_CONCURRENCY,
+            max_retries=NOTIFY_MAX_RETRIES,
+            parse_mode=ParseMode.HTML
+        )
+    for result in results:
+        if result.ok:
+            logger.info(f"Уведомление отправлено админу {result.chat_id}")
+        else:
+            logger.error(f"Не удалось отправить сообщение администратору {result.chat_id} "
+                         f"(попыток: {result.attempts}): {result.error}")
+    return results
+
+
+async def start_admin_digest(
+    bot: Bot,
+    interval: float,
+    batch_size: int = 50,
+    urgent: UrgentFilter = lambda data: False
+) -> None:
+    """Включает режим сводки: результаты уходят админам пачкой раз в interval секунд или по batch_size штук."""
+    global _digest
+    if _digest is not None or interval <= 0:
+        return
+    _digest = AdminDigest(
+        lambda text, chat_ids: send_to_admins(bot, text, chat_ids),
+        interval=interval,
+        batch_size=batch_size,
+        urgent=urgent
+    )
+    _digest.start()
+
+
+async def stop_admin_digest() -> None:
+    """Выключает режим сводки, отправив накопленные результаты."""
+    global _digest
+    if _digest is None:
+        return
+    digest, _digest = _digest, None
+    await digest.stop()
+
+
+async def notify_admins(
+    bot: Bot,
+    state_data: Dict[str, Any],
+    admin_ids: Optional[Sequence[int]] = None
+) -> List[DeliveryResult]:
     """
     Отправляет отформатированный результат теста всем администраторам из списка ADMIN_IDS.
+    Администраторам сообщения уходят параллельно; возвращает результат доставки по каждому.
+    В режиме сводки несрочный результат сохраняется в сводку в базе, результат доставки пуст:
+    дальше за доставку отвечает сводка.
+    admin_ids - отправить только этим админам (повтор недоставленных уведомлений).
     """
     if not ADMIN_IDS:
         logger.warning("Переменная ADMIN_IDS пуста. Уведомления не будут отправлены.")
-        return
+        return []
 
-    # Получаем текущее время по Москве
-    try:
-        completion_time = datetime.now(timezone.utc).astimezone(ZoneInfo("Europe/Moscow")).strftime('%Y-%m-%d %H:%M:%S')
-    except Exception as e:
-        # Если вдруг проблема с tzdata, берем UTC
-        logger.error(f"Ошибка временной зоны: {e}")
-        completion_time = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+    completion_time = _completion_time(state_data.get("completion_date"))
+    if _digest is not None and not _digest.urgent(state_data):
+        await _digest.add(format_digest_entry(state_data, completion_time), ADMIN_IDS if admin_ids is None else admin_ids)
+        return []
     
     text = (
         f"✅ <b>Новый результат теста</b>\n\n"
@@ -47,37 +120,63 @@ async def notify_admins(bot: Bot, state_data: Dict[str, Any]) -> None:
         f"<b>Телефон:</b> <code>{state_data.get('phone_number', 'Не указан')}</code>\n\n"
         f"<b>Время завершения (МСК):</b> {completion_time}"
     )
+    return await send_to_admins(bot, text, admin_ids)
+
+
+async def deliver_result(bot: Bot, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Обработчик события outbox о сохраненном результате: вывод в консоль и уведомление админов.
+    Если часть админов не получила уведомление, событие повторяется только для них.
+    """
+    pending = payload.get("pending_admins")
+    if pending is None:
+        print_test_result(payload)
+    results = await notify_admins(bot, payload, pending)
+    failed = [result.chat_id for result in results if not result.ok]
+    return {**payload, "pending_admins": failed} if failed else None
+
+
+async def update_data_and_set_state(state: FSMContext, next_state: StateType, data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Дополняет данные анкеты и переводит её на следующий шаг.
+    Если хранилище умеет делать это одной операцией (Redis - одним конвейером),
+    используется она, иначе - два последовательных вызова.
+    """
+    combined = getattr(state.storage, "update_data_and_set_state", None)
+    if combined is not None:
+        return await combined(state.key, data, next_state)
+    result = await state.update_data(data)
+    await state.set_state(next_state)
+    return result
 
-    # Цикл отправки всем админам
-    for admin_id in ADMIN_IDS:
-        try:
-            await bot.send_message(
-                chat_id=admin_id,
-                text=text,
-                parse_mode=ParseMode.HTML
-            )
-            logger.info(f"Уведомление отправлено админу {admin_id}")
-        except TelegramAPIError as e:
-            logger.error(f"Не удалось отправить сообщение администратору {admin_id}: {e}")
-        except Exception as e:
-            logger.error(f"Непредвиденная ошибка при отправке сообщения администратору {admin_id}: {e}")
-
-
-async def finish_test(user_id: int, state: FSMContext, bot: Bot) -> None:
+
+async def finish_test(
+    user_id: int,
+    state: FSMContext,
+    bot: Bot,
+    result_store: Optional[ResultStore] = None
+) -> None:
     """
-    Сохраняет данные, выводит в консоль, уведомляет админов и очищает состояние.
+    Сохраняет данные и очищает состояние.
+    Хранилище результатов передается из workflow data диспетчера, по умолчанию - SQLite.
+    SQLite записывает вместе с результатом событие outbox: вывод в консоль и уведомления
+    админам выполняет фоновый воркер (см. deliver_result), кандидат их не ждет.
+    Для хранилищ без outbox они выполняются здесь же.
+    Состояние очищается только после того, как save дождался коммита результата
+    и события outbox: если запись не удалась, анкета остается в хранилище FSM.
     """
     data = await state.get_data()
     logger.info(f"Завершение теста для пользователя {user_id}. Данные: {data}")
+    store = result_store or SQLiteResultStore()
     
     # 1. Сохраняем в базу
-    await save_test_result(data)
-    
-    # 2. Выводим в консоль (для отладки)
-    print_test_result(data)
+    await store.save(data)
     
-    # 3. Шлем уведомления всем админам
-    await notify_admins(bot, data)
+    if not store.outbox:
+        # 2. Выводим в консоль (для отладки)
+        print_test_result(data)
+        # 3. Шлем уведомления всем админам
+        await notify_admins(bot, data)
     
     # 4. Очищаем память
     await state.clear()
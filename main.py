@@ -1,29 +1,47 @@
 import asyncio
 import logging
+import secrets
 import sys
+from pathlib import Path
+from typing import Optional, Tuple
 
 from aiogram import Bot, Dispatcher
 from aiogram.filters import Command
 from aiogram.types import Message
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiohttp import web
 
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, DB_READERS, DB_WRITE_BATCH_SIZE, DB_WRITE_FLUSH_INTERVAL,
+    RETENTION_DAYS, RETENTION_INTERVAL_HOURS, RESULT_STORE,
+    FSM_STORAGE, FSM_CACHE_SIZE, FSM_SESSION_TTL_HOURS, FSM_MAX_SESSIONS, FSM_LOCK_STRIPES, REDIS_URL,
+    FLOW_PATH, FLOW_RELOAD_INTERVAL, NOTIFY_DIGEST_INTERVAL, NOTIFY_DIGEST_SIZE, NOTIFY_URGENT,
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST,
+    OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL, OUTBOX_MAX_ATTEMPTS,
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WORKERS, WORKER_QUEUE_SIZE,
+    ADMIN_IDS, THROTTLE_LIMIT, THROTTLE_ADMIN_LIMIT, THROTTLE_WINDOW, THROTTLE_WARN
+)
 from handlers import test_router, admin_router 
 from handlers.keyboards import get_start_test_keyboard
-from database.db_manager import init_db
+from handlers.outbound import OutboundScheduler, ScheduledSession
+from handlers.throttling import THROTTLE_WARNING, ThrottlingMiddleware, setup_throttling
+from handlers.test_flow import reload_flow, start_flow_watch, stop_flow_watch
+from handlers.digest import parse_urgent_rules
+from handlers.utils import deliver_result, start_admin_digest, stop_admin_digest
+from database.db_manager import (
+    init_db, open_db, close_db, start_write_queue, stop_write_queue, start_backfills, stop_backfills,
+    start_retention, stop_retention, start_outbox, stop_outbox
+)
+from database.fsm_storage import StripedEventIsolation, create_fsm_storage
+from database.outbox import RESULT_SAVED
+from database.store import create_result_store
+from webhook import build_webhook_app
+from cluster import ShardRouter, build_ingress_app, poll_updates, start_workers, stop_workers, watch_workers
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-dp = Dispatcher(storage=MemoryStorage())
-
-# Подключаем роутеры
-dp.include_router(test_router)
-dp.include_router(admin_router)
-
-
-@dp.message(Command("start"))
 async def command_start_handler(message: Message) -> None:
     await message.answer(
         text=(
@@ -41,15 +59,175 @@ async def command_start_handler(message: Message) -> None:
     logger.info(f"Пользователь {message.from_user.id} запустил бота")
 
 
-async def on_startup():
+async def on_startup(bot: Bot, worker_index: int = 0):
     await init_db()
+    await open_db(readers=DB_READERS)
+    await start_write_queue(batch_size=DB_WRITE_BATCH_SIZE, flush_interval=DB_WRITE_FLUSH_INTERVAL)
+    await reload_flow(Path(FLOW_PATH))
+    await start_flow_watch(Path(FLOW_PATH), interval=FLOW_RELOAD_INTERVAL)
+    # Фоновые задачи над общей базой выполняет один процесс (в многопроцессном режиме - первый)
+    if worker_index != 0:
+        return
+    await start_backfills()
+    await start_retention(RETENTION_DAYS, interval=RETENTION_INTERVAL_HOURS * 3600)
+    await start_admin_digest(
+        bot,
+        interval=NOTIFY_DIGEST_INTERVAL,
+        batch_size=NOTIFY_DIGEST_SIZE,
+        urgent=parse_urgent_rules(NOTIFY_URGENT)
+    )
+    # Уведомления о результатах, в том числе не отправленные до прошлой остановки
+    await start_outbox(
+        {RESULT_SAVED: lambda payload: deliver_result(bot, payload)},
+        batch_size=OUTBOX_BATCH_SIZE,
+        poll_interval=OUTBOX_POLL_INTERVAL,
+        max_attempts=OUTBOX_MAX_ATTEMPTS
+    )
+
+
+async def on_shutdown():
+    # Хранилище FSM и блокировки пользователей закрывает сам диспетчер (dp.fsm.close)
+    await stop_flow_watch()
+    await stop_outbox()
+    await stop_admin_digest()
+    await stop_retention()
+    await stop_backfills()
+    await stop_write_queue()
+    await close_db()
+
+
+def create_dispatcher(shard: Optional[Tuple[int, int]] = None) -> Dispatcher:
+    """
+    Собирает диспетчер: хранилища, роутеры, защиту от флуда, обработчики запуска и остановки.
+    Роутеры handlers - объекты модулей, а роутер подключается только к одному диспетчеру,
+    поэтому функция вызывается один раз на процесс (в многопроцессном режиме -
+    во входном процессе и в каждом процессе-обработчике).
+    shard - (index, count) процесса-обработчика: чистка сессий FSM трогает только его пользователей.
+    """
+    # Схема БД применяется в on_startup до первого обращения к хранилищу FSM.
+    # Чистка сессий берет ту же блокировку пользователя, что и обработка его обновлений
+    events_isolation = StripedEventIsolation(FSM_LOCK_STRIPES)
+    dp = Dispatcher(storage=create_fsm_storage(
+        FSM_STORAGE,
+        cache_size=FSM_CACHE_SIZE,
+        session_ttl=FSM_SESSION_TTL_HOURS * 3600,
+        max_sessions=FSM_MAX_SESSIONS,
+        redis_url=REDIS_URL,
+        isolation=events_isolation,
+        shard=shard
+    ), events_isolation=events_isolation)
+    # Хранилище результатов доступно обработчикам как аргумент result_store
+    dp["result_store"] = create_result_store(RESULT_STORE)
+
+    dp.message.register(command_start_handler, Command("start"))
+    # Подключаем роутеры
+    dp.include_router(test_router)
+    dp.include_router(admin_router)
+
+    # Защита от флуда: до middleware FSM, у админов свой лимит
+    if THROTTLE_LIMIT > 0 or THROTTLE_ADMIN_LIMIT > 0:
+        setup_throttling(dp, ThrottlingMiddleware(
+            THROTTLE_LIMIT,
+            THROTTLE_WINDOW,
+            warning=THROTTLE_WARNING if THROTTLE_WARN else None,
+            limits=dict.fromkeys(ADMIN_IDS, THROTTLE_ADMIN_LIMIT)
+        ))
 
-async def main() -> None:
     dp.startup.register(on_startup)
-    bot = Bot(token=BOT_TOKEN)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+def create_bot(global_share: float = 1.0) -> Bot:
+    """
+    Бот, все отправки которого в чаты проходят через общий планировщик с ограничением скорости.
+    global_share - доля общего лимита Telegram, доступная этому процессу.
+    """
+    scheduler = OutboundScheduler(
+        global_rate=OUTBOUND_GLOBAL_RATE * global_share,
+        chat_rate=OUTBOUND_CHAT_RATE,
+        chat_burst=OUTBOUND_CHAT_BURST
+    )
+    return Bot(token=BOT_TOKEN, session=ScheduledSession(scheduler))
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """Поднимает HTTP-сервер и регистрирует webhook в Telegram; работает до остановки процесса."""
+    secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    app = build_webhook_app(
+        dp, bot,
+        path=WEBHOOK_PATH,
+        secret_token=secret_token,
+        workers=WEBHOOK_WORKERS,
+        queue_size=WEBHOOK_QUEUE_SIZE
+    )
+    await serve_webhook(dp, bot, app, secret_token)
+
+
+async def serve_webhook(dp: Dispatcher, bot: Bot, app: web.Application, secret_token: str) -> None:
+    runner = web.AppRunner(app)
+    # setup() выполняет on_startup диспетчера, поэтому запросы начинают приниматься после него
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=secret_token,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        logger.info(f"Webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_cluster(dp: Dispatcher, bot: Bot) -> None:
+    """
+    Многопроцессный режим: этот процесс только получает обновления и раскладывает
+    их по WORKERS процессам-обработчикам по user_id (см. cluster.py).
+    Если процесс-обработчик завершился, входной процесс останавливается с ошибкой,
+    а не копит обновления для него: перезапуском занимается супервизор (systemd, docker).
+    """
+    # Миграции применяются один раз до старта процессов, а не в каждом из них одновременно
+    await init_db()
+    processes, queues = start_workers(WORKERS, queue_size=WORKER_QUEUE_SIZE)
+    router = ShardRouter(queues)
+    logger.info(f"Запущено процессов-обработчиков: {WORKERS}")
+    if BOT_MODE == "webhook":
+        secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        app = build_ingress_app(dp, bot, router, path=WEBHOOK_PATH, secret_token=secret_token)
+        ingress = serve_webhook(dp, bot, app, secret_token)
+    else:
+        await bot.delete_webhook()
+        ingress = poll_updates(bot, router, allowed_updates=dp.resolve_used_update_types())
+    tasks = [
+        asyncio.create_task(ingress, name="cluster-ingress"),
+        asyncio.create_task(watch_workers(processes), name="cluster-watch"),
+    ]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(stop_workers, processes, queues)
+
+
+async def main() -> None:
+    dp = create_dispatcher()
+    bot = create_bot()
     logger.info("Бот запущен и готов к работе!")
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if WORKERS > 1:
+            await run_cluster(dp, bot)
+        elif BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # Webhook, оставшийся от запуска в режиме webhook, не дал бы получать обновления
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
         await bot.session.close()
         logger.info("Бот остановлен")
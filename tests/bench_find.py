@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Бенчмарк поиска /find: полнотекстовый индекс против сканирования через LIKE.
+Использование: python tests/bench_find.py [количество_записей]
+"""
+
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import aiosqlite
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from database import db_manager  # noqa: E402
+
+FIRST_NAMES = ["Иван", "Петр", "Анна", "Мария", "Сергей", "Ольга", "Дмитрий", "Елена", "Алексей", "Наталья"]
+LAST_NAMES = ["Иванов", "Петров", "Смирнов", "Кузнецов", "Попов", "Соколов", "Лебедев", "Козлов", "Новиков"]
+QUERIES = ["Наталья Козлов", "ольг", "Смирнов", "Зинаида", "+7 916 123", "89031234567"]
+
+
+def make_row(i: int, rng: random.Random) -> tuple:
+    phone = f"79{rng.randrange(10 ** 9):09d}"
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    return (i, f"user_{i}", name, phone, phone, "2025-01-01T00:00:00")
+
+
+async def fill(db_path: Path, total: int) -> None:
+    rng = random.Random(42)
+    async with aiosqlite.connect(db_path) as db:
+        for start in range(0, total, 50_000):
+            await db.executemany(
+                "INSERT INTO test_results (user_id, username, name, phone_number, phone_normalized, completion_date) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [make_row(i, rng) for i in range(start, min(start + 50_000, total))]
+            )
+        await db.commit()
+
+
+async def like_scan(db_path: Path, query: str) -> list:
+    pattern = f"%{query}%"
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute(
+            "SELECT id FROM test_results WHERE name LIKE ? OR username LIKE ? OR phone_normalized LIKE ? LIMIT 10",
+            (pattern, pattern, pattern)
+        ) as cursor:
+            return await cursor.fetchall()
+
+
+async def main(total: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "find.db"
+        with patch.object(db_manager, "DB_PATH", db_path):
+            await db_manager.init_db()
+            started = time.perf_counter()
+            await fill(db_path, total)
+            print(f"Записей: {total}, заполнение с индексом: {time.perf_counter() - started:.1f} с")
+
+            await db_manager.open_db(readers=1)
+            try:
+                print(f"{'запрос':<20}{'найдено':>10}{'FTS, мс':>12}{'LIKE, мс':>12}")
+                for query in QUERIES:
+                    started = time.perf_counter()
+                    found = await db_manager.find_results(query)
+                    fts_ms = (time.perf_counter() - started) * 1000
+
+                    started = time.perf_counter()
+                    await like_scan(db_path, query)
+                    like_ms = (time.perf_counter() - started) * 1000
+                    print(f"{query:<20}{len(found):>10}{fts_ms:>12.1f}{like_ms:>12.1f}")
+            finally:
+                await db_manager.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000))
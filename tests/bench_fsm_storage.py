@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Бенчмарк шага анкеты в хранилищах FSM: MemoryStorage против Redis
+с раздельными вызовами (update_data + set_state) и одним конвейером.
+Использование: python tests/bench_fsm_storage.py [количество_шагов]
+Для замера на настоящем Redis задайте REDIS_URL, иначе используется fakeredis.
+"""
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from database.redis_storage import RedisHashStorage  # noqa: E402
+from handlers.states import TestStates  # noqa: E402
+from handlers.utils import update_data_and_set_state  # noqa: E402
+
+STEPS = [TestStates.name_question, TestStates.citizenship_question, TestStates.card_arrests_question]
+
+
+async def separate_calls(state: FSMContext, i: int) -> None:
+    await state.update_data({"step": i})
+    await state.set_state(STEPS[i % len(STEPS)])
+
+
+async def pipelined(state: FSMContext, i: int) -> None:
+    await update_data_and_set_state(state, STEPS[i % len(STEPS)], {"step": i})
+
+
+async def run_case(storage: BaseStorage, step: Callable[[FSMContext, int], Awaitable[None]], total: int) -> float:
+    """Прогоняет total шагов анкеты по 100 пользователям, возвращает среднее время шага в мкс."""
+    states = [FSMContext(storage=storage, key=StorageKey(bot_id=1, chat_id=i, user_id=i)) for i in range(100)]
+    started = time.perf_counter()
+    for i in range(total):
+        await step(states[i % len(states)], i)
+    return (time.perf_counter() - started) / total * 1_000_000
+
+
+def make_redis() -> RedisHashStorage:
+    url = os.getenv("REDIS_URL")
+    if url:
+        return RedisHashStorage.from_url(url)
+    import fakeredis
+    return RedisHashStorage(fakeredis.FakeAsyncRedis())
+
+
+async def main(total: int) -> None:
+    redis_storage = make_redis()
+    try:
+        results = [
+            ("MemoryStorage", await run_case(MemoryStorage(), separate_calls, total)),
+            ("Redis, раздельно", await run_case(redis_storage, separate_calls, total)),
+            ("Redis, конвейер", await run_case(redis_storage, pipelined, total)),
+        ]
+    finally:
+        await redis_storage.close()
+
+    print(f"Шагов анкеты: {total} ({'REDIS_URL' if os.getenv('REDIS_URL') else 'fakeredis'})")
+    print(f"{'хранилище':<20}{'мкс/шаг':>12}")
+    for title, micros in results:
+        print(f"{title:<20}{micros:>12.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
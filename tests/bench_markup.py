@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Бенчмарк подготовки сообщения шага анкеты: клавиатура собирается заново
+и сериализуется при каждой отправке против готовой клавиатуры из реестра
+с закэшированным JSON.
+Использование: python tests/bench_markup.py [количество_сообщений]
+"""
+
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import SendMessage
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from handlers.keyboards import MarkupCachingSession, get_yes_no_keyboard  # noqa: E402
+
+BOT = Bot("42:BENCH")
+
+
+def build_yes_no_keyboard() -> ReplyKeyboardMarkup:
+    """Клавиатура в том виде, в каком ее собирал каждый шаг до реестра."""
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text="Да"), KeyboardButton(text="Нет")]],
+        resize_keyboard=True,
+        one_time_keyboard=True,
+        input_field_placeholder="Выберите ответ"
+    )
+
+
+def rebuilt(session: AiohttpSession) -> Callable[[int], object]:
+    def step(i: int) -> object:
+        method = SendMessage(chat_id=i, text="Есть ли у Вас Российское гражданство?", reply_markup=build_yes_no_keyboard())
+        return session.build_form_data(BOT, method)
+    return step
+
+
+def shared(session: AiohttpSession) -> Callable[[int], object]:
+    def step(i: int) -> object:
+        method = SendMessage(chat_id=i, text="Есть ли у Вас Российское гражданство?", reply_markup=get_yes_no_keyboard())
+        return session.build_form_data(BOT, method)
+    return step
+
+
+def run_case(step: Callable[[int], object], total: int) -> Tuple[float, float]:
+    """Возвращает среднее время (мкс) и объем выделенной памяти (байт) на сообщение."""
+    step(0)
+    started = time.perf_counter()
+    for i in range(total):
+        step(i)
+    micros = (time.perf_counter() - started) / total * 1_000_000
+
+    # Память меряем отдельным проходом: tracemalloc сильно замедляет выполнение
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    allocated = 0
+    for i in range(min(total, 1000)):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        step(i)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return micros, allocated / min(total, 1000)
+
+
+def main(total: int) -> None:
+    results = [
+        ("сборка + сериализация", run_case(rebuilt(AiohttpSession()), total)),
+        ("реестр, без кэша JSON", run_case(shared(AiohttpSession()), total)),
+        ("реестр + кэш JSON", run_case(shared(MarkupCachingSession()), total)),
+    ]
+
+    print(f"Сообщений: {total}")
+    print(f"{'вариант':<26}{'мкс/сообщение':>16}{'байт/сообщение':>18}")
+    for title, (micros, allocated) in results:
+        print(f"{title:<26}{micros:>16.1f}{allocated:>18.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
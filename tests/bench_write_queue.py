@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Бенчмарк записи результатов: коммит на каждую строку против групповой записи.
+Кроме пропускной способности под нагрузкой замеряется задержка одиночного
+сохранения, когда в очереди больше никого нет.
+Использование: python tests/bench_write_queue.py [количество_результатов]
+"""
+
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Tuple
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from database import db_manager  # noqa: E402
+
+
+def make_result(i: int) -> dict:
+    return {
+        "user_id": 1000 + i,
+        "username": f"bench_{i}",
+        "name": "Бенчмарк",
+        "citizenship": "Да",
+        "card_arrests": "Нет",
+        "phone_number": "+79991234567",
+    }
+
+
+async def run_case(db_path: Path, total: int, use_queue: bool) -> Tuple[float, float]:
+    """Сохраняет total результатов конкурентно, возвращает время ожидания и время до записи на диск."""
+    with patch.object(db_manager, "DB_PATH", db_path):
+        await db_manager.init_db()
+        await db_manager.open_db(readers=1)
+        if use_queue:
+            await db_manager.start_write_queue(batch_size=100, flush_interval=0.05)
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(db_manager.save_test_result(make_result(i)) for i in range(total)))
+            user_wait = time.perf_counter() - started
+            # Время до момента, когда все строки гарантированно на диске
+            await db_manager.stop_write_queue()
+            elapsed = time.perf_counter() - started
+        finally:
+            await db_manager.close_db()
+    return user_wait, elapsed
+
+
+async def run_single_writer(db_path: Path, samples: int, use_queue: bool) -> float:
+    """Сохраняет samples результатов по одному, возвращает среднюю задержку сохранения."""
+    with patch.object(db_manager, "DB_PATH", db_path):
+        await db_manager.init_db()
+        await db_manager.open_db(readers=1)
+        if use_queue:
+            # Интервал как в рабочей конфигурации: одиночная строка не должна его ждать
+            await db_manager.start_write_queue(batch_size=100, flush_interval=0.5)
+        try:
+            started = time.perf_counter()
+            for i in range(samples):
+                await db_manager.save_test_result(make_result(i))
+            elapsed = time.perf_counter() - started
+        finally:
+            await db_manager.stop_write_queue()
+            await db_manager.close_db()
+    return elapsed / samples
+
+
+async def main(total: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        per_row = await run_case(Path(tmp) / "per_row.db", total, use_queue=False)
+        batched = await run_case(Path(tmp) / "batched.db", total, use_queue=True)
+        single_per_row = await run_single_writer(Path(tmp) / "single_per_row.db", 20, use_queue=False)
+        single_batched = await run_single_writer(Path(tmp) / "single_batched.db", 20, use_queue=True)
+
+    print(f"Результатов: {total}")
+    print(f"{'режим':<20}{'ожидание, мс':>15}{'запись, мс':>15}{'строк/с':>12}")
+    for title, (user_wait, elapsed) in (("коммит на строку", per_row), ("групповая запись", batched)):
+        print(f"{title:<20}{user_wait * 1000:>15.1f}{elapsed * 1000:>15.1f}{total / elapsed:>12.0f}")
+
+    print("\nОдиночное сохранение без нагрузки")
+    print(f"{'режим':<20}{'задержка, мс':>15}")
+    for title, latency in (("коммит на строку", single_per_row), ("групповая запись", single_batched)):
+        print(f"{title:<20}{latency * 1000:>15.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
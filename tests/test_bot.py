@@ -4,10 +4,14 @@
 """
 
 import pytest
+import pytest_asyncio
 import asyncio
+import time
+import json
 import tempfile
 import os
 from unittest.mock import Mock, AsyncMock, patch, MagicMock
+from pydantic import ValidationError
 from datetime import datetime
 from pathlib import Path
 
@@ -17,9 +21,13 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.storage.base import StorageKey
 from aiogram.types import User, Chat, Message, CallbackQuery
 
-from handlers.states import TestStates, AdminStates
+from handlers.states import TestStates
 from handlers.utils import validate_phone_number, finish_test
-from handlers.keyboards import get_yes_no_keyboard, get_phone_keyboard, get_users_keyboard
+from handlers.keyboards import (
+    MARKUPS, MarkupCachingSession, get_start_test_keyboard, get_yes_no_keyboard, get_phone_keyboard,
+    get_users_page_keyboard
+)
+from handlers.callbacks import UsersPage, UserCard
 
 # Фикстуры для тестов
 
@@ -127,22 +135,53 @@ class TestKeyboards:
         assert keyboard.keyboard[0][0].request_contact == True
         assert "телефон" in keyboard.keyboard[0][0].text.lower()
     
-    def test_users_keyboard(self):
-        """Тест клавиатуры списка пользователей для админа"""
-        mock_users = [
-            {"id": 1, "user_id": 111, "username": "user1"},
-            {"id": 2, "user_id": 222, "username": "user2"}
+    def test_users_page_keyboard(self):
+        """Тест инлайн-клавиатуры страницы пользователей"""
+        users = [
+            {"id": 7, "user_id": 111, "username": "user7"},
+            {"id": 5, "user_id": 222, "username": "user5"}
         ]
-        
-        keyboard = get_users_keyboard(mock_users)
-        
-        assert keyboard is not None
-        # Должно быть 2 пользователя + кнопка "Отмена" = 3 кнопки
-        assert len(keyboard.keyboard) == 3
-        # Проверяем формат кнопок пользователей
-        assert "(ID: 1)" in keyboard.keyboard[0][0].text
-        assert "(ID: 2)" in keyboard.keyboard[1][0].text
-        assert keyboard.keyboard[-1][0].text == "Отмена"
+
+        keyboard = get_users_page_keyboard(users, has_prev=True, has_next=True)
+
+        rows = keyboard.inline_keyboard
+        assert len(rows) == 3  # 2 пользователя + строка навигации
+        assert UserCard.unpack(rows[0][0].callback_data).record_id == 7
+        assert UsersPage.unpack(rows[-1][0].callback_data).after == 7
+        assert UsersPage.unpack(rows[-1][1].callback_data).before == 5
+
+    def test_static_keyboards_are_shared_and_frozen(self):
+        """Постоянные клавиатуры берутся из реестра и не изменяются"""
+        keyboard = get_yes_no_keyboard()
+
+        assert get_yes_no_keyboard() is keyboard
+        assert get_phone_keyboard() is get_phone_keyboard()
+        assert keyboard in MARKUPS
+        assert get_yes_no_keyboard("Другая подсказка") is not keyboard
+        with pytest.raises(ValidationError):
+            keyboard.resize_keyboard = False
+        with pytest.raises(ValidationError):
+            keyboard.keyboard[0][0].text = "Нет"
+
+    def test_session_sends_cached_markup(self):
+        """Сессия отправляет тот же JSON, что и стандартная сериализация, и кэширует его"""
+        from aiogram import Bot
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.methods import SendMessage
+
+        bot = Bot("42:TEST")
+        method = SendMessage(chat_id=1, text="Привет", reply_markup=get_start_test_keyboard())
+
+        expected = AiohttpSession().build_form_data(bot, method)._fields
+        session = MarkupCachingSession()
+        with patch.object(session, "prepare_value", wraps=session.prepare_value) as prepare_value:
+            fields = session.build_form_data(bot, method)._fields
+            session.build_form_data(bot, method)
+
+        assert sorted(f[0]["name"] for f in fields) == sorted(f[0]["name"] for f in expected)
+        assert dict((f[0]["name"], f[2]) for f in fields) == dict((f[0]["name"], f[2]) for f in expected)
+        # Разметка сериализована один раз на оба запроса
+        assert sum(1 for call in prepare_value.call_args_list if call.args[0] is method.reply_markup) == 1
 
 
 # === ТЕСТЫ РАБОТЫ С БД ===
@@ -167,7 +206,7 @@ class TestDatabase:
         test_db = tmp_path / "test_database.db"
         
         with patch('database.db_manager.DB_PATH', test_db):
-            from database.db_manager import init_db, save_test_result, get_all_results
+            from database.db_manager import init_db, save_test_result, get_results_page
             
             await init_db()
             
@@ -184,7 +223,7 @@ class TestDatabase:
             await save_test_result(test_data)
             
             # Получаем все результаты
-            results = await get_all_results()
+            results = await get_results_page(limit=1000)
             
             assert len(results) == 1
             assert results[0]["user_id"] == 123456789
@@ -241,7 +280,7 @@ class TestDatabase:
         test_db = tmp_path / "test_database.db"
         
         with patch('database.db_manager.DB_PATH', test_db):
-            from database.db_manager import init_db, save_test_result, get_all_results
+            from database.db_manager import init_db, save_test_result, get_results_page
             
             await init_db()
             
@@ -257,68 +296,2194 @@ class TestDatabase:
                 await save_test_result(test_data)
             
             # Проверяем что все сохранились
-            results = await get_all_results()
+            results = await get_results_page(limit=1000)
             assert len(results) == 3
             
             # Проверяем порядок (ORDER BY id DESC)
             assert results[0]["username"] == "user_2"  # Последний добавленный
             assert results[2]["username"] == "user_0"  # Первый добавленный
 
+    async def test_repeat_attempt_updates_candidate(self, tmp_path):
+        """Повторное прохождение обновляет запись кандидата, а не создает дубль"""
+        test_db = tmp_path / "test_database.db"
+
+        with patch('database.db_manager.DB_PATH', test_db):
+            from database.db_manager import init_db, save_test_result, get_results_page, get_result_by_id
+
+            await init_db()
+            await save_test_result({"user_id": 42, "username": "first", "citizenship": "Нет"})
+            await save_test_result({"user_id": 7, "username": "other"})
+            await save_test_result({"user_id": 42, "username": "second", "citizenship": "Да"})
+
+            results = await get_results_page(limit=1000)
+            assert len(results) == 2
+
+            record = await get_result_by_id(1)
+            assert record["user_id"] == 42
+            assert record["username"] == "second"
+            assert record["citizenship"] == "Да"
+            assert record["attempts"] == 2
+
+    async def test_dedup_migration(self, tmp_path):
+        """Миграция оставляет последнюю запись кандидата и число его попыток"""
+        import aiosqlite
+        from database.migrations import MIGRATIONS
+
+        test_db = tmp_path / "test_database.db"
+        async with aiosqlite.connect(test_db) as db:
+            for statement in MIGRATIONS[0].statements:
+                await db.execute(statement)
+            await db.execute("PRAGMA user_version = 1")
+            await db.executemany(
+                "INSERT INTO test_results (user_id, username, completion_date) VALUES (?, ?, 'now')",
+                [(1, "a1"), (2, "b1"), (1, "a2"), (1, "a3")]
+            )
+            await db.commit()
+
+        with patch('database.db_manager.DB_PATH', test_db):
+            from database.db_manager import init_db, get_results_page, get_result_by_id
+
+            await init_db()
+            results = await get_results_page(limit=1000)
+            assert [(r["id"], r["username"]) for r in results] == [(4, "a3"), (2, "b1")]
+            assert (await get_result_by_id(4))["attempts"] == 3
+            assert (await get_result_by_id(2))["attempts"] == 1
+
+        async with aiosqlite.connect(test_db) as db:
+            with pytest.raises(aiosqlite.IntegrityError):
+                await db.execute("INSERT INTO test_results (user_id, completion_date) VALUES (2, 'now')")
+
+    async def test_keyset_pagination(self, tmp_path):
+        """Тест постраничного просмотра записей по ключу"""
+        test_db = tmp_path / "test_database.db"
+
+        with patch('database.db_manager.DB_PATH', test_db):
+            from database.db_manager import init_db, save_test_result
+            from handlers.admin_handlers import load_users_page
+            from database.store import SQLiteResultStore
+
+            store = SQLiteResultStore()
+
+            await init_db()
+            for i in range(25):
+                await save_test_result({"user_id": i, "username": f"user_{i}"})
+
+            with patch('handlers.admin_handlers.USERS_PAGE_SIZE', 10):
+                first = await load_users_page(store)
+                assert [u["id"] for u in first["users"]] == list(range(25, 15, -1))
+                assert not first["has_prev"] and first["has_next"]
+
+                last_id = first["users"][-1]["id"]
+                second = await load_users_page(store, before_id=last_id)
+                assert [u["id"] for u in second["users"]] == list(range(15, 5, -1))
+                assert second["has_prev"] and second["has_next"]
+
+                third = await load_users_page(store, before_id=second["users"][-1]["id"])
+                assert [u["id"] for u in third["users"]] == [5, 4, 3, 2, 1]
+                assert not third["has_next"]
+
+                back = await load_users_page(store, after_id=second["users"][0]["id"])
+                assert back["users"] == first["users"]
+                assert not back["has_prev"]
 
-# === ТЕСТЫ FSM СОСТОЯНИЙ ===
 
 @pytest.mark.asyncio
-class TestFSMStates:
-    """Тесты переходов между состояниями"""
-    
-    async def test_state_transitions(self, storage):
-        """Тест переходов состояний в процессе теста"""
-        user_id = 123
-        chat_id = 123
-        
-        # Создаем контекст FSM
-        state = FSMContext(
-            storage=storage,
-            key=StorageKey(bot_id=1, chat_id=chat_id, user_id=user_id)
-        )
-        
-        # Тест перехода в первое состояние
-        await state.set_state(TestStates.citizenship_question)
-        current_state = await state.get_state()
-        assert current_state == TestStates.citizenship_question
-        
-        # Сохраняем данные
-        await state.update_data(citizenship="Да", user_id=user_id, username="test")
-        
-        # Переход ко второму вопросу
-        await state.set_state(TestStates.card_blocks_question)
-        current_state = await state.get_state()
-        assert current_state == TestStates.card_blocks_question
-        
-        # Проверяем что данные сохранились
-        data = await state.get_data()
-        assert data["citizenship"] == "Да"
-        assert data["user_id"] == user_id
-    
-    async def test_admin_states(self, storage):
-        """Тест состояний админ-панели"""
-        admin_id = 999
-        chat_id = 999
-        
-        state = FSMContext(
-            storage=storage,
-            key=StorageKey(bot_id=1, chat_id=chat_id, user_id=admin_id)
+class TestConnectionPool:
+    """Тесты пула соединений SQLite"""
+
+    async def test_pool_uses_wal(self, tmp_path):
+        """Пул переводит базу в режим WAL и обслуживает запись и чтение"""
+        test_db = tmp_path / "test_database.db"
+
+        with patch('database.db_manager.DB_PATH', test_db):
+            from database.db_manager import (
+                init_db, open_db, close_db, save_test_result, get_result_by_id, _read_connection
+            )
+
+            await init_db()
+            await open_db(readers=2)
+            try:
+                async with _read_connection() as db:
+                    async with db.execute("PRAGMA journal_mode") as cursor:
+                        assert (await cursor.fetchone())[0] == "wal"
+
+                await save_test_result({"user_id": 1, "username": "pooled"})
+                result = await get_result_by_id(1)
+                assert result["username"] == "pooled"
+            finally:
+                await close_db()
+
+    async def test_reads_do_not_wait_for_writer(self, tmp_path):
+        """Чтение не блокируется, пока соединение-писатель занято"""
+        from database.pool import ConnectionPool
+
+        test_db = tmp_path / "test_database.db"
+        with patch('database.db_manager.DB_PATH', test_db):
+            from database.db_manager import init_db
+            await init_db()
+
+        pool = ConnectionPool(test_db, readers=2)
+        await pool.open()
+        try:
+            async with pool.writer() as writer:
+                await writer.execute(
+                    "INSERT INTO test_results (user_id, completion_date) VALUES (1, 'now')"
+                )
+                # Пока транзакция писателя открыта, читатели видят последний коммит
+                async with pool.reader() as reader:
+                    async with reader.execute("SELECT COUNT(*) FROM test_results") as cursor:
+                        assert (await cursor.fetchone())[0] == 0
+                await writer.commit()
+
+            async with pool.reader() as reader:
+                async with reader.execute("SELECT COUNT(*) FROM test_results") as cursor:
+                    assert (await cursor.fetchone())[0] == 1
+        finally:
+            await pool.close()
+
+
+@pytest.mark.asyncio
+class TestWriteQueue:
+    """Тесты групповой записи результатов"""
+
+    async def test_flush_by_batch_size(self):
+        """Пачка записывается, как только набрано batch_size строк"""
+        from database.write_queue import ResultWriteQueue
+
+        batches = []
+
+        async def flush(rows):
+            batches.append(list(rows))
+
+        queue = ResultWriteQueue(flush, batch_size=3, flush_interval=10)
+        queue.start()
+        for i in range(3):
+            queue.put(i)
+        await asyncio.sleep(0.05)
+        assert batches == [[0, 1, 2]]
+        await queue.stop()
+
+    async def test_idle_queue_flushes_without_waiting(self):
+        """Одиночная строка записывается сразу, а не по таймеру; остаток - при остановке"""
+        from database.write_queue import ResultWriteQueue
+
+        batches = []
+
+        async def flush(rows):
+            batches.append(list(rows))
+
+        queue = ResultWriteQueue(flush, batch_size=100, flush_interval=10)
+        queue.start()
+        await asyncio.wait_for(queue.write("a"), timeout=0.5)
+        assert batches == [["a"]]
+
+        queue.put("b")
+        queue.put("c")
+        await queue.stop()
+        assert batches == [["a"], ["b", "c"]]
+        assert not queue.is_running
+
+    async def test_rows_arriving_during_commit_form_next_batch(self):
+        """Строки, поставленные во время записи пачки, уходят следующей пачкой целиком"""
+        from database.write_queue import ResultWriteQueue
+
+        batches = []
+
+        async def flush(rows):
+            batches.append(list(rows))
+            await asyncio.sleep(0.05)
+
+        queue = ResultWriteQueue(flush, batch_size=100, flush_interval=10)
+        queue.start()
+        first = asyncio.create_task(queue.write(0))
+        await asyncio.sleep(0.01)
+        await asyncio.gather(first, *(queue.write(i) for i in range(1, 10)))
+        assert batches == [[0], list(range(1, 10))]
+        await queue.stop()
+
+    async def test_write_waits_for_commit(self):
+        """write возвращается только после записи пачки, ошибка записи доходит до вызывающего"""
+        from database.write_queue import ResultWriteQueue
+
+        written = []
+
+        async def flush(rows):
+            if "bad" in rows:
+                raise ValueError("constraint failed")
+            await asyncio.sleep(0.05)
+            written.extend(rows)
+
+        queue = ResultWriteQueue(flush, batch_size=10, flush_interval=10, retry_delay=0)
+        queue.start()
+        await asyncio.gather(queue.write("a"), queue.write("b"))
+        assert written == ["a", "b"]
+        # Без dead_letter незаписанная строка теряется - вызывающий узнает об этом
+        with pytest.raises(ValueError):
+            await queue.write("bad")
+        await queue.stop()
+
+    async def test_bad_row_does_not_drop_batch(self):
+        """Пачка с одной плохой строкой записывается по строкам, плохая уходит в dead_letter"""
+        from database.write_queue import ResultWriteQueue
+
+        written, failed = [], []
+
+        async def flush(rows):
+            if "bad" in rows:
+                raise ValueError("constraint failed")
+            written.extend(rows)
+
+        async def dead_letter(row, error):
+            failed.append((row, str(error)))
+
+        queue = ResultWriteQueue(flush, batch_size=10, flush_interval=10, retry_delay=0, dead_letter=dead_letter)
+        queue.start()
+        for row in ("a", "bad", "c"):
+            queue.put(row)
+        await queue.stop()
+
+        assert written == ["a", "c"]
+        assert failed == [("bad", "constraint failed")]
+
+    async def test_transient_errors_are_retried_until_written(self):
+        """Временные ошибки повторяются дольше max_retries, строки не теряются"""
+        import sqlite3
+        from database.db_manager import _is_transient_error
+        from database.write_queue import ResultWriteQueue
+
+        attempts = []
+
+        async def flush(rows):
+            attempts.append(list(rows))
+            if len(attempts) <= 5:
+                raise sqlite3.OperationalError("database is locked")
+
+        queue = ResultWriteQueue(
+            flush, batch_size=10, flush_interval=10, max_retries=2, retry_delay=0.001,
+            is_transient=_is_transient_error
         )
-        
-        # Переход в состояние выбора пользователя
-        await state.set_state(AdminStates.choosing_user)
-        current_state = await state.get_state()
-        assert current_state == AdminStates.choosing_user
-        
-        # Очистка состояния
-        await state.clear()
-        current_state = await state.get_state()
-        assert current_state is None
+        queue.start()
+        queue.put("a")
+        queue.put("b")
+        await queue.stop()
+
+        assert len(attempts) == 6
+        assert attempts[-1] == ["a", "b"]
+
+    async def test_unwritable_result_is_quarantined(self, tmp_path):
+        """Результат, который не записывается, сохраняется в failed_results"""
+        import json
+        import aiosqlite
+        import database.db_manager as db_manager
+        from database.models import ResultRow
+
+        test_db = tmp_path / "test_database.db"
+        with patch('database.db_manager.DB_PATH', test_db):
+            await db_manager.init_db()
+            await db_manager._quarantine_result(
+                ResultRow.from_state_data({"user_id": 5, "name": "Иван"}), ValueError("boom")
+            )
+            async with aiosqlite.connect(test_db) as db:
+                async with db.execute("SELECT payload, error FROM failed_results") as cursor:
+                    payload, error = await cursor.fetchone()
+        assert json.loads(payload)["user_id"] == 5
+        assert "boom" in error
+
+    async def test_queued_results_reach_db_on_shutdown(self, tmp_path):
+        """Все результаты из очереди оказываются в БД после остановки"""
+        test_db = tmp_path / "test_database.db"
+
+        with patch('database.db_manager.DB_PATH', test_db):
+            from database.db_manager import (
+                init_db, open_db, close_db, start_write_queue, stop_write_queue,
+                save_test_result, get_results_page
+            )
+
+            await init_db()
+            await open_db()
+            await start_write_queue(batch_size=10, flush_interval=5)
+            try:
+                # Кандидаты завершают тест одновременно: их результаты пишутся общими пачками
+                saves = [
+                    asyncio.create_task(save_test_result({"user_id": i, "username": f"user_{i}"}))
+                    for i in range(25)
+                ]
+                await asyncio.sleep(0.1)
+                await stop_write_queue()
+                await asyncio.gather(*saves)
+                results = await get_results_page(limit=1000)
+                assert len(results) == 25
+            finally:
+                await stop_write_queue()
+                await close_db()
+
+
+class TestRecordCardCache:
+    """Тесты кэша карточек записей"""
+
+    def test_lru_eviction_and_counters(self):
+        """Кэш ограничен по размеру и считает попадания и промахи"""
+        from database.cache import TTLCache
+
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.put(1, "card 1")
+        cache.put(2, "card 2")
+        assert cache.get(1) == "card 1"  # 1 становится самой свежей
+        cache.put(3, "card 3")  # вытесняется 2
+
+        assert cache.get(2) is None
+        assert cache.get(3) == "card 3"
+        assert cache.stats() == {"size": 2, "hits": 2, "misses": 1}
+
+    def test_ttl_expiry(self):
+        """Устаревшая запись не возвращается"""
+        from database.cache import TTLCache
+
+        cache = TTLCache(maxsize=10, ttl=60)
+        with patch('database.cache.time.monotonic', return_value=1000.0):
+            cache.put(1, "card")
+        with patch('database.cache.time.monotonic', return_value=1061.0):
+            assert cache.get(1) is None
+        assert len(cache) == 0
+
+    def test_counters_in_stats_report(self):
+        """Счетчики кэша попадают в отчет /stats"""
+        from handlers.admin_handlers import format_stats
+        from database.stats import STATS_COUNTERS, TOTAL_BUCKET
+
+        report = format_stats({TOTAL_BUCKET: dict.fromkeys(STATS_COUNTERS, 1)}, cards={"size": 5, "hits": 3, "misses": 1})
+        assert "в кэше 5, попаданий 3, промахов 1 (75.0% попаданий)" in report
+
+    @pytest.mark.asyncio
+    async def test_save_invalidates_card(self, tmp_path):
+        """Запись результата сбрасывает карточку с тем же ID"""
+        from database.cache import record_cards
+
+        test_db = tmp_path / "test_database.db"
+        with patch('database.db_manager.DB_PATH', test_db):
+            from database.db_manager import init_db, save_test_result
+
+            await init_db()
+            record_cards.put(1, "stale card")
+            await save_test_result({"user_id": 1, "username": "fresh"})
+            assert record_cards.get(1) is None
+
+
+@pytest.mark.asyncio
+class TestMigrations:
+    """Тесты версионных миграций схемы"""
+
+    async def test_legacy_db_is_migrated_and_backfilled(self, tmp_path):
+        """Старая база без версии доводится до последней схемы, данные заполняются в фоне"""
+        import aiosqlite
+        from database.migrations import latest_version
+
+        test_db = tmp_path / "test_database.db"
+        # База в том виде, как её создавала старая версия init_db
+        async with aiosqlite.connect(test_db) as db:
+            await db.execute('''
+                CREATE TABLE test_results (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    username TEXT,
+                    name TEXT,
+                    citizenship TEXT,
+                    card_arrests TEXT,
+                    phone_number TEXT,
+                    completion_date TEXT NOT NULL
+                )
+            ''')
+            await db.executemany(
+                "INSERT INTO test_results (user_id, phone_number, completion_date) VALUES (?, ?, 'now')",
+                [(i, f"8 (999) 123-45-{i:02d}") for i in range(7)]
+            )
+            await db.commit()
+
+        with patch('database.db_manager.DB_PATH', test_db):
+            import database.db_manager as db_manager
+            from database.db_manager import init_db, start_backfills
+
+            await init_db()
+            await start_backfills(chunk_size=3)
+            await db_manager._backfill_task
+
+            async with aiosqlite.connect(test_db) as db:
+                async with db.execute("PRAGMA user_version") as cursor:
+                    assert (await cursor.fetchone())[0] == latest_version()
+                async with db.execute("SELECT phone_normalized FROM test_results ORDER BY id") as cursor:
+                    phones = [row[0] for row in await cursor.fetchall()]
+                async with db.execute("SELECT done FROM schema_backfills WHERE name = 'phone_normalized'") as cursor:
+                    assert (await cursor.fetchone())[0] == 1
+
+            assert phones == [f"799912345{i:02d}" for i in range(7)]
+            # Индекс /find видит номера, заполненные в фоне
+            found = await db_manager.find_results("8 999 123-45-03")
+            assert [row["user_id"] for row in found] == [3]
+
+    async def test_init_db_is_idempotent(self, tmp_path):
+        """Повторный запуск не применяет миграции заново"""
+        test_db = tmp_path / "test_database.db"
+
+        with patch('database.db_manager.DB_PATH', test_db):
+            from database.db_manager import init_db
+
+            await init_db()
+            await init_db()
+
+    async def test_large_db_is_not_vacuumed_on_startup(self, tmp_path):
+        """Большая база не перестраивается при запуске, auto_vacuum включает /vacuum"""
+        import aiosqlite
+
+        async def auto_vacuum_mode():
+            async with aiosqlite.connect(test_db) as db:
+                async with db.execute("PRAGMA auto_vacuum") as cursor:
+                    return (await cursor.fetchone())[0]
+
+        test_db = tmp_path / "test_database.db"
+        with patch('database.db_manager.DB_PATH', test_db), \
+                patch('database.migrations.VACUUM_ON_MIGRATION_MAX_BYTES', 0):
+            import database.db_manager as db_manager
+
+            await db_manager.init_db()
+            assert await auto_vacuum_mode() == 0  # VACUUM пропущен
+            before, after = await db_manager.vacuum_db()
+            assert before > 0 and after > 0
+            assert await auto_vacuum_mode() == 2  # INCREMENTAL
+
+
+class TestExport:
+    """Тесты потоковой выгрузки результатов"""
+
+    @pytest.mark.asyncio
+    async def test_export_by_period(self, tmp_path):
+        """Выгрузка за период в CSV и gzip JSONL"""
+        import csv
+        import gzip
+        import json
+        import aiosqlite
+        from handlers.export import export_to_file
+
+        test_db = tmp_path / "test_database.db"
+        with patch('database.db_manager.DB_PATH', test_db):
+            from database.db_manager import init_db, iter_results
+
+            await init_db()
+            async with aiosqlite.connect(test_db) as db:
+                await db.executemany(
+                    "INSERT INTO test_results (user_id, username, completion_date) VALUES (?, ?, ?)",
+                    [(i, f"user_{i}", f"2025-01-{i:02d}T12:00:00") for i in range(1, 11)]
+                )
+                await db.commit()
+
+            path, count = await export_to_file(iter_results("2025-01-03", "2025-01-06", chunk_size=2), "csv")
+            try:
+                with open(path, encoding="utf-8-sig") as file:
+                    rows = list(csv.DictReader(file))
+            finally:
+                path.unlink()
+            assert count == 3
+            assert [row["username"] for row in rows] == ["user_3", "user_4", "user_5"]
+            assert rows[0]["attempts"] == "1"
+
+            path, count = await export_to_file(iter_results(), "jsonl")
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as file:
+                    records = [json.loads(line) for line in file]
+            finally:
+                path.unlink()
+            assert count == 10
+            assert records[0]["user_id"] == 1
+
+    @pytest.mark.asyncio
+    async def test_export_does_not_hold_reader_between_pages(self, tmp_path):
+        """Пока выгрузка стоит между страницами, единственный читатель пула свободен"""
+        import aiosqlite
+
+        test_db = tmp_path / "test_database.db"
+        with patch('database.db_manager.DB_PATH', test_db):
+            from database.db_manager import close_db, get_result_by_id, init_db, iter_results, open_db
+
+            await init_db()
+            async with aiosqlite.connect(test_db) as db:
+                await db.executemany(
+                    "INSERT INTO test_results (user_id, username, completion_date) VALUES (?, ?, ?)",
+                    [(i, f"user_{i}", "2025-01-01T12:00:00") for i in range(1, 8)]
+                )
+                await db.commit()
+
+            await open_db(readers=1)
+            try:
+                ids = []
+                async for row in iter_results(chunk_size=3):
+                    ids.append(row["id"])
+                    # Медленный получатель выгрузки не блокирует другие чтения
+                    assert await asyncio.wait_for(get_result_by_id(row["id"]), 1) is not None
+                # Одинаковые даты: порядок и отсутствие пропусков держит id
+                assert ids == list(range(1, 8))
+            finally:
+                await close_db()
+
+    def test_parse_export_args(self):
+        """Разбор аргументов команды /export"""
+        from handlers.export import parse_export_args
+
+        assert parse_export_args(None) == ("csv", None, None, False)
+        assert parse_export_args("jsonl 2025-01-01 2025-01-31") == ("jsonl", "2025-01-01", "2025-02-01", False)
+        assert parse_export_args("2025-01-01 archive") == ("csv", "2025-01-01", None, True)
+        with pytest.raises(ValueError):
+            parse_export_args("csv 2025-02-01 2025-01-01")
+        with pytest.raises(ValueError):
+            parse_export_args("xml")
+
+
+@pytest.mark.asyncio
+class TestStats:
+    """Тесты инкрементальных агрегатов"""
+
+    async def test_stats_follow_saves(self, tmp_path):
+        """Агрегаты обновляются вместе с записью результатов"""
+        test_db = tmp_path / "test_database.db"
+
+        with patch('database.db_manager.DB_PATH', test_db):
+            from database.db_manager import init_db, save_test_result, get_stats
+            from database.stats import TOTAL_BUCKET, day_bucket
+
+            await init_db()
+            await save_test_result({"user_id": 1, "citizenship": "Да", "card_arrests": "Нет", "phone_number": "+79991234567"})
+            await save_test_result({"user_id": 2, "citizenship": "Да", "card_arrests": "Да", "phone_number": None})
+            await save_test_result({"user_id": 3, "citizenship": "Нет"})
+
+            stats = await get_stats()
+            total = stats[TOTAL_BUCKET]
+            assert total["total"] == 3
+            assert (total["citizenship_yes"], total["citizenship_no"]) == (2, 1)
+            assert (total["arrests_yes"], total["arrests_no"]) == (1, 1)
+            assert total["with_phone"] == 1
+            assert stats[day_bucket(datetime.now())]["total"] == 3
+
+    async def test_repeat_attempt_replaces_counters(self, tmp_path):
+        """Повторное прохождение в той же пачке заменяет прежние ответы, а не добавляется к ним"""
+        test_db = tmp_path / "test_database.db"
+
+        with patch('database.db_manager.DB_PATH', test_db):
+            from database.db_manager import init_db, _upsert_results, get_stats
+            from database.models import ResultRow
+            from database.stats import TOTAL_BUCKET
+
+            await init_db()
+            await _upsert_results([
+                ResultRow.from_state_data({"user_id": 1, "citizenship": "Да", "phone_number": "+79991234567"}),
+                ResultRow.from_state_data({"user_id": 2, "citizenship": "Да"}),
+                ResultRow.from_state_data({"user_id": 1, "citizenship": "Нет"}),
+            ])
+
+            total = (await get_stats())[TOTAL_BUCKET]
+            assert total["total"] == 2
+            assert (total["citizenship_yes"], total["citizenship_no"]) == (1, 1)
+            assert total["with_phone"] == 0
+
+    async def test_migration_counts_existing_rows(self, tmp_path):
+        """Агрегаты по уже накопленным данным пересчитываются фоновым заполнением"""
+        import aiosqlite
+        from database.migrations import MIGRATIONS
+
+        test_db = tmp_path / "test_database.db"
+        async with aiosqlite.connect(test_db) as db:
+            for statement in MIGRATIONS[0].statements:
+                await db.execute(statement)
+            await db.execute("PRAGMA user_version = 1")
+            await db.executemany(
+                "INSERT INTO test_results (user_id, citizenship, completion_date) VALUES (?, ?, ?)",
+                [(1, "Да", "2025-01-01T10:00:00"), (2, "Нет", "2025-01-01T11:00:00"), (3, None, "2025-01-02T10:00:00")]
+            )
+            await db.commit()
+
+        async def read_stats():
+            async with aiosqlite.connect(test_db) as db:
+                async with db.execute("SELECT bucket, total, citizenship_yes FROM result_stats ORDER BY bucket") as cursor:
+                    return [tuple(row) for row in await cursor.fetchall()]
+
+        with patch('database.db_manager.DB_PATH', test_db):
+            import database.db_manager as db_manager
+            from database.migrations import run_backfills
+
+            await db_manager.init_db()
+            # Запуск не ждет пересчета: он идет фоновым заполнением
+            assert await read_stats() == []
+            # Запись после миграции учитывается сразу и не считается повторно
+            await db_manager.save_test_result({"user_id": 4, "citizenship": "Да"})
+            await run_backfills(db_manager._write_connection, chunk_size=2, pause=0)
+
+        rows = await read_stats()
+        assert ("all", 4, 2) in rows
+        assert ("day:2025-01-01", 2, 1) in rows
+        assert ("hour:2025-01-02T10", 1, 0) in rows
+
+
+@pytest.mark.asyncio
+class TestArchive:
+    """Тесты архивации старых результатов"""
+
+    async def test_old_results_move_to_segments(self, tmp_path):
+        """Старые записи переносятся в сегменты и остаются доступны по запросу"""
+        import aiosqlite
+        from datetime import timedelta
+
+        test_db = tmp_path / "test_database.db"
+        archive_dir = tmp_path / "archive"
+        recent = datetime.now().isoformat()
+        with patch('database.db_manager.DB_PATH', test_db), patch('database.db_manager.ARCHIVE_DIR', archive_dir):
+            from database.db_manager import (
+                init_db, archive_results, get_results_page, get_result_by_id, iter_results
+            )
+
+            await init_db()
+            async with aiosqlite.connect(test_db) as db:
+                await db.executemany(
+                    "INSERT INTO test_results (user_id, username, completion_date) VALUES (?, ?, ?)",
+                    [
+                        (1, "jan", "2024-01-10T10:00:00"),
+                        (2, "feb", "2024-02-10T10:00:00"),
+                        (3, "fresh", recent),
+                    ]
+                )
+                await db.commit()
+
+            assert await archive_results(max_age_days=30) == 2
+            assert [r["username"] for r in await get_results_page(limit=1000)] == ["fresh"]
+            assert sorted(p.name for p in archive_dir.iterdir()) == [
+                "test_results-2024-01.jsonl.gz", "test_results-2024-02.jsonl.gz"
+            ]
+
+            assert await get_result_by_id(1) is None
+            assert (await get_result_by_id(1, include_archive=True))["username"] == "jan"
+
+            rows = [row async for row in iter_results(include_archive=True)]
+            assert [row["username"] for row in rows] == ["jan", "feb", "fresh"]
+            rows = [row async for row in iter_results("2024-02-01", "2024-03-01", include_archive=True)]
+            assert [row["username"] for row in rows] == ["feb"]
+
+            # Повторный запуск ничего не переносит
+            assert await archive_results(max_age_days=30) == 0
+
+        async with aiosqlite.connect(test_db) as db:
+            async with db.execute("PRAGMA auto_vacuum") as cursor:
+                assert (await cursor.fetchone())[0] == 2  # INCREMENTAL
+
+
+    async def test_archiving_returns_space_to_file(self, tmp_path):
+        """Освобожденные архивацией страницы возвращаются файлу, а не остаются в freelist"""
+        import aiosqlite
+
+        test_db = tmp_path / "test_database.db"
+        with patch('database.db_manager.DB_PATH', test_db), patch('database.db_manager.ARCHIVE_DIR', tmp_path / "archive"):
+            from database.db_manager import init_db, archive_results
+
+            await init_db()
+            async with aiosqlite.connect(test_db) as db:
+                await db.executemany(
+                    "INSERT INTO test_results (user_id, username, name, completion_date) VALUES (?, ?, ?, ?)",
+                    [(i, f"user{i}", "Кандидат " * 20, "2024-01-10T10:00:00") for i in range(3000)]
+                )
+                await db.commit()
+                async with db.execute("PRAGMA page_count") as cursor:
+                    pages_before = (await cursor.fetchone())[0]
+
+            assert await archive_results(max_age_days=30) == 3000
+
+        async with aiosqlite.connect(test_db) as db:
+            async with db.execute("PRAGMA freelist_count") as cursor:
+                assert (await cursor.fetchone())[0] == 0
+            async with db.execute("PRAGMA page_count") as cursor:
+                assert (await cursor.fetchone())[0] < pages_before / 2
+
+@pytest_asyncio.fixture(params=["memory", "sqlite"])
+async def result_store(request, tmp_path):
+    """Каждый бэкенд хранилища результатов проходит один и тот же набор тестов"""
+    from database.store import create_result_store
+
+    if request.param == "memory":
+        yield create_result_store("memory")
+        return
+    with patch('database.db_manager.DB_PATH', tmp_path / "test_database.db"):
+        from database.db_manager import init_db
+        await init_db()
+        yield create_result_store("sqlite")
+
+
+def make_state_data(user_id):
+    return {
+        "user_id": user_id,
+        "username": f"user{user_id}",
+        "name": f"Кандидат {user_id}",
+        "citizenship": "Да",
+        "card_arrests": "Нет",
+        "phone_number": "+79991234567",
+    }
+
+
+@pytest.mark.asyncio
+class TestResultStore:
+    """Общие тесты совместимости и производительности бэкендов ResultStore"""
+
+    async def test_implements_protocol(self, result_store):
+        from database.store import ResultStore
+        assert isinstance(result_store, ResultStore)
+
+    async def test_save_get_and_repeat_attempt(self, result_store):
+        """Повторное прохождение обновляет запись кандидата и увеличивает счетчик попыток"""
+        await result_store.save(make_state_data(1))
+        await result_store.save({**make_state_data(1), "card_arrests": "Да"})
+        await result_store.save(make_state_data(2))
+
+        assert await result_store.count() == 2
+        record = await result_store.get(1)
+        assert record["username"] == "user1"
+        assert record["card_arrests"] == "Да"
+        assert record["attempts"] == 2
+        assert await result_store.get(999) is None
+
+    async def test_repeat_attempt_invalidates_card(self, result_store):
+        """Повторное сохранение сбрасывает закэшированную карточку записи в любом бэкенде"""
+        from database.cache import record_cards
+
+        await result_store.save(make_state_data(1))
+        record_cards.put(1, "stale card")
+        await result_store.save({**make_state_data(1), "card_arrests": "Да"})
+        assert record_cards.get(1) is None
+
+    async def test_stats(self, result_store):
+        """Счетчики /stats ведет само хранилище; повторное прохождение заменяет прежние ответы"""
+        from database.stats import TOTAL_BUCKET, day_bucket
+
+        await result_store.save(make_state_data(1))
+        await result_store.save({**make_state_data(1), "citizenship": "Нет"})
+        await result_store.save({**make_state_data(2), "phone_number": None})
+
+        stats = await result_store.stats(days=7, hours=24)
+        assert stats[TOTAL_BUCKET] == {
+            "total": 2, "citizenship_yes": 1, "citizenship_no": 1,
+            "arrests_yes": 0, "arrests_no": 2, "with_phone": 1,
+        }
+        assert stats[day_bucket(datetime.now())]["total"] == 2
+        assert len([bucket for bucket in stats if bucket.startswith("hour:")]) == 24
+
+    async def test_keyset_pages(self, result_store):
+        """Страницы идут от новых записей к старым и не пересекаются"""
+        for user_id in range(1, 8):
+            await result_store.save(make_state_data(user_id))
+
+        first = await result_store.page(limit=3)
+        assert [row["user_id"] for row in first] == [7, 6, 5]
+        older = await result_store.page(before_id=first[-1]["id"], limit=3)
+        assert [row["user_id"] for row in older] == [4, 3, 2]
+        newer = await result_store.page(after_id=older[0]["id"], limit=3)
+        assert [row["user_id"] for row in newer] == [7, 6, 5]
+        assert await result_store.page(before_id=1) == []
+
+    async def test_stream_by_period(self, result_store):
+        """Выгрузка отдает записи в порядке прохождения с учетом периода"""
+        from datetime import date, timedelta
+
+        for user_id in range(1, 4):
+            await result_store.save(make_state_data(user_id))
+
+        rows = [row async for row in result_store.stream()]
+        assert [row["user_id"] for row in rows] == [1, 2, 3]
+
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        assert [row async for row in result_store.stream(date_from=tomorrow)] == []
+        rows = [row async for row in result_store.stream(date_to=tomorrow)]
+        assert len(rows) == 3
+
+    async def test_search(self, result_store):
+        """Поиск по имени, username и телефону в любом формате ввода"""
+        await result_store.save({**make_state_data(1), "name": "Иван Петров", "phone_number": "89161112233"})
+        await result_store.save({**make_state_data(2), "name": "Петр Иванов", "phone_number": "+7 903 444-55-66"})
+        await result_store.save({**make_state_data(3), "name": "Анна Смирнова", "username": "anna_s"})
+
+        async def found(query):
+            return sorted(row["user_id"] for row in await result_store.search(query))
+
+        assert await found("иван") == [1, 2]
+        assert await found("Иван Петр") == [1, 2]
+        assert await found("петров") == [1]
+        assert await found("anna") == [3]
+        assert await found("+7 (916) 111") == [1]
+        assert await found("903444") == [2]
+        assert await found("Ольга") == []
+        assert await found('"* OR') == []
+        assert len(await result_store.search("user", limit=2)) == 2
+
+    async def test_throughput(self, result_store):
+        """Замер пропускной способности: сохранение и полный обход страницами"""
+        import time
+
+        total = 300
+        started = time.perf_counter()
+        for user_id in range(1, total + 1):
+            await result_store.save(make_state_data(user_id))
+        save_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        seen, before_id = 0, None
+        while page := await result_store.page(before_id=before_id, limit=10):
+            seen += len(page)
+            before_id = page[-1]["id"]
+        page_time = time.perf_counter() - started
+
+        assert seen == total
+        print(f"\n{type(result_store).__name__}: save {total / save_time:.0f} оп/с, "
+              f"page {total / 10 / page_time:.0f} стр/с")
+
+
+class TestSearch:
+    """Тесты полнотекстового поиска /find"""
+
+    def test_build_match_query(self):
+        from database.search import build_match_query
+
+        assert build_match_query("Иван Петров") == '"иван"* "петров"*'
+        assert build_match_query("@test_user") == '"test"* "user"*'
+        assert build_match_query("8 (916) 111-22") == 'phone : "791611122"*'
+        assert build_match_query("916") == 'phone : "7916"*'
+        # Операторы FTS5 становятся обычными словами
+        assert build_match_query('" OR *') == '"or"*'
+        assert build_match_query('"*()') is None
+
+    @pytest.mark.asyncio
+    async def test_index_follows_table(self, tmp_path):
+        """Триггеры обновляют индекс при повторном прохождении и удалении записи"""
+        import aiosqlite
+
+        test_db = tmp_path / "test_database.db"
+        with patch('database.db_manager.DB_PATH', test_db):
+            from database.db_manager import init_db, save_test_result, find_results
+
+            await init_db()
+            await save_test_result({**make_state_data(1), "name": "Иван"})
+            assert [row["user_id"] for row in await find_results("иван")] == [1]
+
+            await save_test_result({**make_state_data(1), "name": "Сергей"})
+            assert await find_results("иван") == []
+            assert [row["user_id"] for row in await find_results("сергей")] == [1]
+
+            async with aiosqlite.connect(test_db) as db:
+                await db.execute("DELETE FROM test_results WHERE user_id = 1")
+                await db.commit()
+                async with db.execute(
+                    "INSERT INTO test_results_fts (test_results_fts, rank) VALUES ('integrity-check', 1)"
+                ):
+                    pass
+            assert await find_results("сергей") == []
+
+
+    @pytest.mark.asyncio
+    async def test_existing_rows_are_indexed_in_background(self, tmp_path):
+        """Накопленные записи индексируются фоновым заполнением, до его конца поиск идет без индекса"""
+        import aiosqlite
+        from database.migrations import MIGRATIONS, run_backfills
+
+        test_db = tmp_path / "test_database.db"
+        # База на версии до полнотекстового индекса
+        async with aiosqlite.connect(test_db) as db:
+            for migration in MIGRATIONS[:6]:
+                if migration.version == 6:
+                    continue
+                for statement in migration.statements:
+                    await db.execute(statement)
+            await db.execute("PRAGMA user_version = 6")
+            await db.executemany(
+                "INSERT INTO test_results (user_id, name, username, phone_normalized, completion_date) "
+                "VALUES (?, ?, ?, ?, '2025-01-01')",
+                [(i, f"Иван {i}", f"user{i}", f"7999000000{i}") for i in range(1, 6)]
+            )
+            await db.commit()
+
+        with patch('database.db_manager.DB_PATH', test_db):
+            import database.db_manager as db_manager
+
+            await db_manager.init_db()
+            # Индекс еще пуст, но поиск находит записи просмотром таблицы
+            assert len(await db_manager.find_results("иван")) == 5
+            assert [row["user_id"] for row in await db_manager.find_results("79990000003")] == [3]
+
+            # Изменение записи до её индексации не ломает индекс
+            await db_manager.save_test_result({**make_state_data(2), "name": "Сергей"})
+            await db_manager.save_test_result({**make_state_data(6), "name": "Сергей"})
+            await run_backfills(db_manager._write_connection, chunk_size=2, pause=0)
+
+            assert [row["user_id"] for row in await db_manager.find_results("иван")] == [5, 4, 3, 1]
+            assert sorted(row["user_id"] for row in await db_manager.find_results("сергей")) == [2, 6]
+            async with aiosqlite.connect(test_db) as db:
+                await db.execute("INSERT INTO test_results_fts (test_results_fts, rank) VALUES ('integrity-check', 1)")
+
+@pytest.mark.asyncio
+class TestSQLiteStorage:
+    """Тесты хранилища FSM в базе данных"""
+
+    async def test_session_survives_restart(self, tmp_path):
+        """Состояние и данные анкеты читаются новым экземпляром хранилища"""
+        from database.fsm_storage import SQLiteStorage
+
+        key = StorageKey(bot_id=1, chat_id=123, user_id=123)
+        with patch('database.db_manager.DB_PATH', tmp_path / "test_database.db"):
+            from database.db_manager import init_db
+            await init_db()
+
+            storage = SQLiteStorage()
+            assert await storage.get_state(key) is None
+            assert await storage.get_data(key) == {}
+
+            await storage.set_state(key, TestStates.name_question)
+            await storage.update_data(key, {"name": "Иван", "user_id": 123})
+            await storage.close()
+
+            restarted = SQLiteStorage()
+            assert await restarted.get_state(key) == TestStates.name_question.state
+            assert await restarted.get_data(key) == {"name": "Иван", "user_id": 123}
+
+            # Завершенная анкета не оставляет строк в таблице
+            await restarted.set_state(key, None)
+            await restarted.set_data(key, {})
+            assert await SQLiteStorage().get_state(key) is None
+
+            import aiosqlite
+            async with aiosqlite.connect(tmp_path / "test_database.db") as db:
+                async with db.execute("SELECT COUNT(*) FROM fsm_sessions") as cursor:
+                    assert (await cursor.fetchone())[0] == 0
+
+    async def test_step_transition_is_one_write(self, tmp_path):
+        """Ответ и следующее состояние записываются в базу одной командой"""
+        from database.fsm_storage import SQLiteStorage
+        import database.db_manager as db_manager
+
+        key = StorageKey(bot_id=1, chat_id=8, user_id=8)
+        with patch('database.db_manager.DB_PATH', tmp_path / "test_database.db"):
+            await db_manager.init_db()
+            storage = SQLiteStorage()
+            await storage.update_data(key, {"name": "Иван"})
+
+            with patch.object(db_manager, "save_fsm_field", wraps=db_manager.save_fsm_field) as field, \
+                    patch.object(db_manager, "save_fsm_session", wraps=db_manager.save_fsm_session) as session:
+                data = await storage.update_data_and_set_state(
+                    key, {"citizenship": "Да"}, TestStates.card_arrests_question
+                )
+            assert field.call_count == 0
+            assert session.call_count == 1
+            assert data == {"name": "Иван", "citizenship": "Да"}
+
+            restarted = SQLiteStorage()
+            assert await restarted.get_state(key) == TestStates.card_arrests_question.state
+            assert await restarted.get_data(key) == data
+
+    async def test_hot_keys_are_served_from_cache(self, tmp_path):
+        """Повторное чтение сессии не обращается к базе, запись идет сквозь кэш"""
+        from database.fsm_storage import SQLiteStorage
+        import database.db_manager as db_manager
+
+        key = StorageKey(bot_id=1, chat_id=7, user_id=7)
+        with patch('database.db_manager.DB_PATH', tmp_path / "test_database.db"):
+            await db_manager.init_db()
+            storage = SQLiteStorage()
+            await storage.set_state(key, TestStates.citizenship_question)
+
+            with patch.object(db_manager, "load_fsm_session", wraps=db_manager.load_fsm_session) as load:
+                for _ in range(10):
+                    assert await storage.get_state(key) == TestStates.citizenship_question.state
+                await storage.set_data(key, {"citizenship": "Да"})
+                data = await storage.get_data(key)
+                assert data == {"citizenship": "Да"}
+                # Изменение копии не портит кэш
+                data["citizenship"] = "Нет"
+                assert await storage.get_data(key) == {"citizenship": "Да"}
+                assert load.call_count == 0
+
+
+@pytest.mark.asyncio
+class TestExpiringStorage:
+    """Тесты ограничения времени жизни и количества сессий FSM"""
+
+    async def test_idle_sessions_are_swept(self):
+        """Сессия без обращений дольше ttl удаляется, активная остается"""
+        from database.session_limits import ExpiringStorage
+
+        storage = ExpiringStorage(MemoryStorage(), ttl=60, max_sessions=0)
+        idle, active = (StorageKey(bot_id=1, chat_id=i, user_id=i) for i in (1, 2))
+        with patch('database.session_limits.time.time', return_value=1000.0):
+            await storage.set_state(idle, TestStates.name_question)
+            await storage.set_data(idle, {"name": "Иван"})
+            await storage.set_state(active, TestStates.name_question)
+        with patch('database.session_limits.time.time', return_value=1050.0):
+            assert await storage.get_state(active) == TestStates.name_question.state
+        assert await storage.sweep(now=1070.0) == 1
+
+        assert await storage.get_state(idle) is None
+        assert await storage.get_data(idle) == {}
+        assert await storage.get_state(active) == TestStates.name_question.state
+        stats = await storage.stats()
+        assert stats["sessions"] == 1
+        assert stats["evicted_idle"] == 1
+        await storage.close()
+
+    async def test_cap_evicts_least_recently_used(self):
+        """Сверх лимита вытесняется давно не использованная сессия, объем учитывается"""
+        from database.session_limits import ExpiringStorage
+
+        storage = ExpiringStorage(MemoryStorage(), ttl=0, max_sessions=2)
+        keys = [StorageKey(bot_id=1, chat_id=i, user_id=i) for i in range(3)]
+        for now, key in enumerate(keys[:2]):
+            with patch('database.session_limits.time.time', return_value=1000.0 + now):
+                await storage.set_state(key, TestStates.name_question)
+        with patch('database.session_limits.time.time', return_value=1010.0):
+            await storage.get_state(keys[0])
+            await storage.set_data(keys[2], {"name": "Анна"})
+        assert await storage.sweep() == 1
+
+        assert await storage.get_state(keys[1]) is None
+        assert await storage.get_state(keys[0]) == TestStates.name_question.state
+        stats = await storage.stats()
+        assert stats["sessions"] == 2
+        assert stats["evicted_overflow"] == 1
+        assert stats["bytes"] == len(TestStates.name_question.state) + len('{"name": "Анна"}'.encode())
+
+        # Завершенная анкета перестает учитываться
+        await storage.set_state(keys[0], None)
+        assert (await storage.stats())["sessions"] == 1
+        await storage.close()
+
+    async def test_combined_step_falls_back_to_separate_calls(self):
+        """Обертка переводит шаг анкеты и над хранилищем без конвейера"""
+        from database.session_limits import ExpiringStorage
+
+        storage = ExpiringStorage(MemoryStorage(), ttl=0, max_sessions=10)
+        key = StorageKey(bot_id=1, chat_id=1, user_id=1)
+        data = await storage.update_data_and_set_state(key, {"name": "Иван"}, TestStates.citizenship_question)
+
+        assert data == {"name": "Иван"}
+        assert await storage.get_state(key) == TestStates.citizenship_question.state
+        assert (await storage.stats())["sessions"] == 1
+        await storage.close()
+
+    async def test_sqlite_sessions_expire_after_restart(self, tmp_path):
+        """Время обращения хранится в таблице: сессии до перезапуска удаляются запросом к базе"""
+        from database.fsm_storage import SQLiteStorage
+        from database.session_limits import ExpiringStorage
+        import database.db_manager as db_manager
+
+        idle, active = (StorageKey(bot_id=1, chat_id=i, user_id=i) for i in (1, 2))
+        with patch('database.db_manager.DB_PATH', tmp_path / "test_database.db"):
+            await db_manager.init_db()
+            storage = ExpiringStorage(SQLiteStorage(), ttl=60, max_sessions=0)
+            with patch('database.db_manager.time.time', return_value=1000.0):
+                await storage.update_data_and_set_state(idle, {"name": "Иван"}, TestStates.citizenship_question)
+            with patch('database.db_manager.time.time', return_value=1050.0):
+                await storage.set_state(active, TestStates.name_question)
+            await storage.close()
+
+            restarted = ExpiringStorage(SQLiteStorage(), ttl=60, max_sessions=0)
+            assert (await restarted.stats())["sessions"] == 2
+            assert await restarted.get_state(idle) == TestStates.citizenship_question.state
+            assert await restarted.sweep(now=1070.0) == 1
+
+            assert await restarted.get_state(idle) is None
+            assert await restarted.get_data(idle) == {}
+            assert await restarted.get_state(active) == TestStates.name_question.state
+            assert (await restarted.stats())["sessions"] == 1
+            await restarted.close()
+
+    async def test_eviction_waits_for_user_lock(self, tmp_path):
+        """Чистка ждет обработку обновления пользователя и не удаляет сессию, в которую тот записал"""
+        from database.fsm_storage import SQLiteStorage, StripedEventIsolation
+        from database.session_limits import ExpiringStorage
+        import database.db_manager as db_manager
+
+        key = StorageKey(bot_id=1, chat_id=5, user_id=5)
+        isolation = StripedEventIsolation(stripes=4)
+        with patch('database.db_manager.DB_PATH', tmp_path / "test_database.db"):
+            await db_manager.init_db()
+            storage = ExpiringStorage(SQLiteStorage(), ttl=60, max_sessions=0, isolation=isolation)
+            with patch('database.db_manager.time.time', return_value=1000.0):
+                await storage.set_state(key, TestStates.name_question)
+
+            async with isolation.lock(key):
+                sweep = asyncio.create_task(storage.sweep(now=1070.0))
+                await asyncio.sleep(0.05)
+                assert not sweep.done()
+                # Обработчик пользователя успевает перейти к следующему шагу
+                await storage.update_data_and_set_state(key, {"name": "Иван"}, TestStates.citizenship_question)
+            assert await sweep == 0
+
+            assert await storage.get_state(key) == TestStates.citizenship_question.state
+            assert await storage.get_data(key) == {"name": "Иван"}
+            await storage.close()
+
+    async def test_workers_sweep_only_their_users(self, tmp_path):
+        """Процесс-обработчик не удаляет сессии пользователей другого процесса, даже записанные до учета владельцев"""
+        import aiosqlite
+        from aiogram.fsm.storage.base import DefaultKeyBuilder
+        from database.fsm_storage import SQLiteStorage, StripedEventIsolation
+        from database.session_limits import ExpiringStorage
+        import database.db_manager as db_manager
+
+        test_db = tmp_path / "test_database.db"
+        # Пользователи с нечетным ID обрабатывает второй процесс
+        active, legacy_read, legacy_idle = (StorageKey(bot_id=1, chat_id=i, user_id=i) for i in (3, 5, 7))
+        with patch('database.db_manager.DB_PATH', test_db):
+            await db_manager.init_db()
+            first, second = (
+                ExpiringStorage(
+                    SQLiteStorage(shard=(index, 2)), ttl=60, max_sessions=0,
+                    isolation=StripedEventIsolation(stripes=4)
+                )
+                for index in range(2)
+            )
+            with patch('database.db_manager.time.time', return_value=1000.0):
+                await second.update_data_and_set_state(active, {"name": "Иван"}, TestStates.citizenship_question)
+            async with aiosqlite.connect(test_db) as db:
+                await db.executemany(
+                    "INSERT INTO fsm_sessions (key, state, data, updated_at) VALUES (?, ?, '{}', 1000.0)",
+                    [(DefaultKeyBuilder().build(key), TestStates.name_question.state) for key in (legacy_read, legacy_idle)]
+                )
+                await db.commit()
+            # Второй процесс держит в кэше сессию без владельца - она закрепляется за ним
+            assert await second.get_state(legacy_read) == TestStates.name_question.state
+
+            # Чистка первого процесса удаляет только никем не прочитанную сессию без владельца
+            assert await first.sweep(now=1070.0) == 1
+            assert await second.get_data(active) == {"name": "Иван"}
+            assert await second.get_state(legacy_read) == TestStates.name_question.state
+            assert (await first.stats())["sessions"] == 2
+
+            assert await second.sweep(now=1070.0) == 2
+            assert await second.get_state(active) is None
+            assert await second.get_state(legacy_read) is None
+            assert (await second.stats())["sessions"] == 0
+            await first.close()
+            await second.close()
+
+
+@pytest.mark.asyncio
+class TestRedisStorage:
+    """Тесты хранилища FSM в Redis (на fakeredis)"""
+
+    @pytest.fixture
+    def redis_storage(self):
+        fakeredis = pytest.importorskip("fakeredis")
+        from database.redis_storage import RedisHashStorage
+        return RedisHashStorage(fakeredis.FakeAsyncRedis(), session_ttl=3600)
+
+    async def test_state_and_data(self, redis_storage):
+        key = StorageKey(bot_id=1, chat_id=5, user_id=5)
+        assert await redis_storage.get_state(key) is None
+        assert await redis_storage.get_data(key) == {}
+
+        await redis_storage.set_state(key, TestStates.name_question)
+        await redis_storage.set_data(key, {"name": "Иван", "user_id": 5})
+        assert await redis_storage.update_data(key, {"citizenship": "Да"}) == {
+            "name": "Иван", "user_id": 5, "citizenship": "Да"
+        }
+        assert await redis_storage.get_state(key) == TestStates.name_question.state
+        assert 0 < await redis_storage.redis.ttl("fsm:5:5:data") <= 3600
+
+        await redis_storage.set_state(key, None)
+        await redis_storage.set_data(key, {})
+        assert await redis_storage.get_state(key) is None
+        assert await redis_storage.get_data(key) == {}
+        await redis_storage.close()
+
+    async def test_step_is_one_round_trip(self, redis_storage):
+        """Ответ на шаг и переход к следующему уходят в Redis одним конвейером"""
+        from redis.asyncio.client import Pipeline
+        from handlers.utils import update_data_and_set_state
+
+        key = StorageKey(bot_id=1, chat_id=6, user_id=6)
+        state = FSMContext(storage=redis_storage, key=key)
+        await state.update_data(name="Иван")
+
+        with patch.object(Pipeline, "execute", autospec=True, side_effect=Pipeline.execute) as execute, \
+                patch.object(redis_storage.redis, "execute_command", wraps=redis_storage.redis.execute_command) as single:
+            data = await update_data_and_set_state(state, TestStates.citizenship_question, {"citizenship": "Да"})
+
+        assert execute.call_count == 1
+        assert single.call_count == 0
+        assert data == {"name": "Иван", "citizenship": "Да"}
+        assert await state.get_state() == TestStates.citizenship_question.state
+        await redis_storage.close()
+
+
+class TestFlowSteps:
+    """Тесты анкеты из файла: компиляция, горячая подмена и общий обработчик"""
+
+    @staticmethod
+    def definition():
+        import json
+        from handlers.test_flow import FLOW_PATH
+        return json.loads(FLOW_PATH.read_text(encoding="utf-8"))
+
+    def test_compiled_steps(self):
+        from handlers.test_flow import FLOWS
+
+        flow = FLOWS.current
+        citizenship = flow.steps["citizenship"]
+        assert flow.first_step.id == "name"
+        assert citizenship.state == f"flow:{flow.version}:citizenship"
+        assert flow.next_step(citizenship).id == "card_arrests"
+        assert "Нет" in citizenship.fail
+        assert "Да" in flow.steps["card_arrests"].messages
+        assert flow.next_step(flow.steps["phone_number"]) is None
+        # Клавиатура собрана при компиляции, а не на каждый шаг
+        assert citizenship.keyboard.keyboard[0][0].text == "Да"
+
+        with pytest.raises(TypeError):
+            flow.steps["other"] = citizenship
+
+    @pytest.mark.parametrize("broken, error", [
+        ({"start": "missing"}, "Первый шаг"),
+        ({"steps": {"name": {"type": "slider", "text": "?"}}}, "неизвестный тип"),
+        ({"steps": {"name": {"type": "text", "text": "?", "next": "nowhere"}}}, "не описан"),
+        ({"steps": {"name": {"type": "choice", "text": "?", "options": ["Да"]}}}, "двух вариантов"),
+        ({"steps": {"name": {"type": "choice", "text": "?", "options": ["Да", "Нет"], "fail": {"Может": "!"}}}},
+         "нет среди вариантов"),
+        ({"steps": {"name": {"type": "text", "text": "?", "next": "name"}}}, "зациклены"),
+    ])
+    def test_invalid_definitions_are_rejected(self, broken, error):
+        from handlers.test_flow import compile_flow
+
+        definition = {**self.definition(), **broken}
+        if "steps" in broken:
+            definition["start"] = "name"
+        with pytest.raises(ValueError, match=error):
+            compile_flow(definition, "test")
+
+    def test_resolve_state(self):
+        from handlers.test_flow import FLOWS
+
+        flow = FLOWS.current
+        assert FLOWS.resolve(f"flow:{flow.version}:card_arrests") == (flow, flow.steps["card_arrests"])
+        # Сессии, начатые до перехода на файл анкеты, продолжаются по текущей версии
+        assert FLOWS.resolve(TestStates.card_arrests_question.state) == (flow, flow.steps["card_arrests"])
+        assert FLOWS.resolve(f"flow:{flow.version}:unknown") is None
+        assert FLOWS.resolve("AdminStates:choosing_user") is None
+        assert FLOWS.resolve(None) is None
+
+    @pytest.mark.asyncio
+    async def test_hot_reload_keeps_started_users_on_their_version(self, tmp_path):
+        """Новая версия применяется к новым прохождениям, начатые идут по своей"""
+        import json
+        from handlers.test_flow import FlowRegistry, load_flow, reload_flow
+
+        path = tmp_path / "flow.json"
+        path.write_text(json.dumps(self.definition(), ensure_ascii=False), encoding="utf-8")
+        registry = FlowRegistry(load_flow(path))
+        old = registry.current
+        started_state = old.steps["citizenship"].state
+
+        changed = self.definition()
+        changed["steps"]["citizenship"]["text"] = "Вы гражданин РФ?"
+        path.write_text(json.dumps(changed, ensure_ascii=False), encoding="utf-8")
+        with patch('handlers.test_flow.FLOWS', registry):
+            assert await reload_flow(path)
+            new = registry.current
+            assert new.version != old.version
+            assert new.first_step.state != old.first_step.state
+            assert registry.resolve(started_state) == (old, old.steps["citizenship"])
+
+            # Ошибочный файл не ломает работающую анкету
+            path.write_text("{", encoding="utf-8")
+            assert not await reload_flow(path)
+            assert registry.current is new
+
+    def test_registry_keeps_last_versions(self):
+        """Реестр помнит ограниченное число версий, остальные продолжаются по текущей"""
+        from handlers.test_flow import FlowRegistry, compile_flow
+
+        registry = FlowRegistry(compile_flow(self.definition(), "v0"), max_versions=3)
+        for i in range(1, 10):
+            registry.install(compile_flow(self.definition(), f"v{i}"))
+
+        assert list(registry._versions) == ["v7", "v8", "v9"]
+        flow, _ = registry.resolve(compile_flow(self.definition(), "v0").first_step.state)
+        assert flow is registry.current
+
+    @pytest.mark.asyncio
+    async def test_started_step_continues_after_restart(self, tmp_path):
+        """После перезапуска прежняя версия неизвестна: шаг, который есть в текущей анкете, продолжается"""
+        import json
+        from handlers.filters import InFlowStep, InStaleFlowStep
+        from handlers.test_flow import FlowRegistry, compile_flow, load_flow
+
+        started_state = compile_flow(self.definition(), "old").steps["citizenship"].state
+        changed = self.definition()
+        changed["steps"]["citizenship"]["text"] = "Вы гражданин РФ?"
+        path = tmp_path / "flow.json"
+        path.write_text(json.dumps(changed, ensure_ascii=False), encoding="utf-8")
+        restarted = FlowRegistry(load_flow(path))
+
+        with patch('handlers.filters.FLOWS', restarted):
+            resolved = await InFlowStep()(AsyncMock(), raw_state=started_state)
+            assert resolved == {"flow": restarted.current, "step": restarted.current.steps["citizenship"]}
+            assert not await InStaleFlowStep()(AsyncMock(), raw_state=started_state)
+
+    @pytest.mark.asyncio
+    async def test_removed_step_restarts_flow(self, storage):
+        """Шага нет в анкете: кандидат получает сообщение и начинает тест заново, а не остается без ответа"""
+        from handlers.filters import InFlowStep, InStaleFlowStep
+        from handlers.test_flow import RESTART_MESSAGE, FlowRegistry, compile_flow
+        from handlers.test_handlers import restart_stale_flow
+
+        started_state = compile_flow(self.definition(), "old").steps["card_arrests"].state
+        changed = self.definition()
+        del changed["steps"]["card_arrests"]
+        changed["steps"]["citizenship"]["next"] = "phone_number"
+        restarted = FlowRegistry(compile_flow(changed, "new"))
+        flow = restarted.current
+
+        state = FSMContext(storage=storage, key=StorageKey(bot_id=1, chat_id=1, user_id=1))
+        await state.set_state(started_state)
+        await state.set_data({"user_id": 1, "username": "ivan", "name": "Иван", "citizenship": "Да"})
+        message = AsyncMock()
+        message.text = "Да"
+        message.from_user.id = 1
+        message.from_user.username = "ivan"
+
+        with patch('handlers.filters.FLOWS', restarted), patch('handlers.test_handlers.FLOWS', restarted):
+            assert not await InFlowStep()(message, raw_state=started_state)
+            assert await InStaleFlowStep()(message, raw_state=started_state)
+            # Состояния не из анкеты обработчик не перехватывает
+            assert not await InStaleFlowStep()(message, raw_state="AdminStates:choosing_user")
+            await restart_stale_flow(message, state)
+
+        assert await state.get_state() == flow.first_step.state
+        assert await state.get_data() == {"user_id": 1, "username": "ivan"}
+        restart, question = message.answer.call_args_list
+        assert restart.args == (RESTART_MESSAGE,)
+        assert question.kwargs["text"] == flow.first_step.text
+
+    @pytest.mark.asyncio
+    async def test_answer_moves_to_next_step(self, storage):
+        """Ответ сохраняется вместе с переходом, состояние повторно не читается"""
+        from handlers.test_flow import FLOWS
+        from handlers.test_handlers import process_answer
+
+        flow = FLOWS.current
+        step = flow.steps["card_arrests"]
+        state = FSMContext(storage=storage, key=StorageKey(bot_id=1, chat_id=1, user_id=1))
+        await state.set_state(step.state)
+        message = AsyncMock()
+        message.text = "Да"
+        message.from_user.id = 1
+
+        with patch.object(storage, "get_state", wraps=storage.get_state) as get_state:
+            await process_answer(message, state, bot=AsyncMock(), result_store=AsyncMock(), flow=flow, step=step)
+            assert get_state.call_count == 0
+
+        assert await state.get_state() == flow.steps["phone_number"].state
+        assert await state.get_data() == {"card_arrests": "Да"}
+        # Специальное сообщение и вопрос следующего шага
+        assert message.answer.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_invalid_answer_keeps_step(self, storage):
+        from handlers.test_flow import FLOWS
+        from handlers.test_handlers import process_answer
+
+        flow = FLOWS.current
+        step = flow.steps["citizenship"]
+        state = FSMContext(storage=storage, key=StorageKey(bot_id=1, chat_id=1, user_id=1))
+        await state.set_state(step.state)
+        message = AsyncMock()
+        message.text = "Может быть"
+
+        await process_answer(message, state, bot=AsyncMock(), result_store=AsyncMock(), flow=flow, step=step)
+
+        message.answer.assert_called_once_with("Пожалуйста, используйте кнопки 'Да' или 'Нет' для ответа.")
+        assert await state.get_state() == step.state
+
+
+class TestNotifyAdmins:
+    """Тесты рассылки уведомлений администраторам"""
+
+    @pytest.mark.asyncio
+    async def test_admins_are_notified_concurrently(self):
+        from handlers.utils import notify_admins
+
+        in_flight, peak = 0, 0
+
+        async def send_message(**kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.05)
+            in_flight -= 1
+
+        bot = AsyncMock()
+        bot.send_message.side_effect = send_message
+        with patch('handlers.utils.ADMIN_IDS', [1, 2, 3, 4]), \
+                patch('handlers.utils.NOTIFY_CONCURRENCY', 2):
+            results = await notify_admins(bot, {"user_id": 5, "username": "user"})
+
+        assert [r.chat_id for r in results] == [1, 2, 3, 4]
+        assert all(r.ok for r in results)
+        assert peak == 2
+
+    @pytest.mark.asyncio
+    async def test_retry_after_and_failures_are_reported(self):
+        from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+        from aiogram.methods import SendMessage
+        from handlers.utils import notify_admins
+
+        method = SendMessage(chat_id=1, text="x")
+        calls = {1: 0, 2: 0}
+
+        async def send_message(chat_id, **kwargs):
+            calls[chat_id] += 1
+            if chat_id == 1 and calls[1] == 1:
+                raise TelegramRetryAfter(method, "Flood control exceeded", retry_after=0)
+            if chat_id == 2:
+                raise TelegramForbiddenError(method, "bot was blocked by the user")
+
+        bot = AsyncMock()
+        bot.send_message.side_effect = send_message
+        with patch('handlers.utils.ADMIN_IDS', [1, 2]):
+            first, second = await notify_admins(bot, {"user_id": 5})
+
+        assert first.ok and first.attempts == 2
+        # Заблокированный бот - повторять бесполезно
+        assert not second.ok and second.attempts == 1 and "blocked" in second.error
+
+
+class TestAdminDigest:
+    """Тесты режима сводки уведомлений"""
+
+    def test_chunks_respect_message_limit(self):
+        from handlers.digest import build_digest_chunks, format_digest_entry
+
+        entries = [
+            format_digest_entry({"user_id": i, "username": f"user{i}", "name": "<Иван>"}, "2024-01-01 12:00:00")
+            for i in range(100)
+        ]
+        chunks = build_digest_chunks(entries, limit=1000)
+
+        assert len(chunks) > 1
+        assert all(len(chunk) <= 1100 for chunk in chunks)
+        assert chunks[0].startswith("📋 <b>Сводка результатов: 100</b> (1/")
+        # Записи не разрываются между сообщениями, ответы экранированы
+        assert sum(chunk.count("• @") for chunk in chunks) == 100
+        assert "&lt;Иван&gt;" in chunks[0]
+
+    def test_urgent_rules(self):
+        from handlers.digest import parse_urgent_rules
+
+        urgent = parse_urgent_rules("card_arrests=Да, citizenship=Нет")
+        assert urgent({"card_arrests": "Да"})
+        assert urgent({"citizenship": "Нет"})
+        assert not urgent({"card_arrests": "Нет", "citizenship": "Да"})
+        assert not parse_urgent_rules("")({"card_arrests": "Да"})
+        with pytest.raises(ValueError):
+            parse_urgent_rules("card_arrests")
+
+    @pytest.mark.asyncio
+    async def test_results_are_sent_as_digest(self, tmp_path):
+        from handlers.digest import parse_urgent_rules
+        from handlers.utils import notify_admins, start_admin_digest, stop_admin_digest
+        import database.db_manager as db_manager
+
+        bot = AsyncMock()
+        with patch('database.db_manager.DB_PATH', tmp_path / "test_database.db"), \
+                patch('handlers.utils.ADMIN_IDS', [1, 2]):
+            await db_manager.init_db()
+            await start_admin_digest(bot, interval=60, batch_size=3, urgent=parse_urgent_rules("card_arrests=Да"))
+            try:
+                for i in range(3):
+                    assert await notify_admins(bot, {"user_id": i, "card_arrests": "Нет"}) == []
+                # Срочный результат уходит сразу, отдельным сообщением
+                urgent = await notify_admins(bot, {"user_id": 9, "card_arrests": "Да"})
+                assert [r.chat_id for r in urgent] == [1, 2]
+                await asyncio.sleep(0.1)
+            finally:
+                await stop_admin_digest()
+            assert await db_manager.load_digest_entries(max_attempts=10) == []
+
+        texts = [call.kwargs["text"] for call in bot.send_message.call_args_list]
+        assert len(texts) == 4
+        digests = [text for text in texts if text.startswith("📋")]
+        assert len(digests) == 2  # по одной сводке каждому админу
+        assert all(text.count("• @") == 3 for text in digests)
+
+    @pytest.mark.asyncio
+    async def test_undelivered_digest_is_kept_until_sent(self, tmp_path):
+        """Сводка, не дошедшая до админа, остается в базе и уходит следующей сводкой, в том числе после перезапуска"""
+        from aiogram.exceptions import TelegramNetworkError
+        from aiogram.methods import SendMessage
+        from handlers.delivery import DeliveryResult
+        from handlers.digest import AdminDigest
+        import database.db_manager as db_manager
+
+        delivered = []
+        down = {2}
+
+        async def send(text, chat_ids):
+            results = []
+            for chat_id in chat_ids:
+                if chat_id in down:
+                    error = TelegramNetworkError(SendMessage(chat_id=chat_id, text=text), "timeout")
+                    results.append(DeliveryResult(chat_id, ok=False, attempts=1, error=str(error)))
+                else:
+                    delivered.append((chat_id, text))
+                    results.append(DeliveryResult(chat_id, ok=True, attempts=1))
+            return results
+
+        with patch('database.db_manager.DB_PATH', tmp_path / "test_database.db"):
+            await db_manager.init_db()
+            digest = AdminDigest(send, interval=60, batch_size=50)
+            await digest.add("• @first", [1, 2])
+            await digest.add("• @second", [2])
+            assert await digest.flush() == 1
+            assert [chat_id for chat_id, _ in delivered] == [1]
+
+            # Новый экземпляр - как после перезапуска бота
+            down.clear()
+            restarted = AdminDigest(send, interval=60, batch_size=50)
+            assert await restarted.flush() == 2
+            assert delivered[-1][0] == 2
+            assert "@first" in delivered[-1][1] and "@second" in delivered[-1][1]
+            assert await db_manager.load_digest_entries(max_attempts=10) == []
+
+
+class TestOutboundScheduler:
+    """Тесты планировщика исходящих сообщений"""
+
+    @pytest.mark.asyncio
+    async def test_user_replies_go_before_admin_notifications(self):
+        from handlers.outbound import OutboundScheduler, Priority
+
+        scheduler = OutboundScheduler(global_rate=20, chat_rate=100, chat_burst=1)
+        # Исчерпываем общее ведро, дальше запросы встают в очередь
+        for i in range(20):
+            await scheduler.acquire(i)
+        order = []
+
+        async def send(chat_id, priority):
+            await scheduler.acquire(chat_id, priority)
+            order.append(priority)
+
+        try:
+            tasks = [asyncio.create_task(send(100 + i, Priority.ADMIN)) for i in range(3)]
+            tasks += [asyncio.create_task(send(200 + i, Priority.USER)) for i in range(3)]
+            await asyncio.sleep(0)
+            assert scheduler.stats()["queued"] == {"user": 3, "admin": 3}
+            await asyncio.gather(*tasks)
+        finally:
+            await scheduler.close()
+
+        assert order == [Priority.USER] * 3 + [Priority.ADMIN] * 3
+        stats = scheduler.stats()
+        assert stats["sent"] == {"user": 23, "admin": 3}
+        assert stats["delayed"] == 6
+
+    @pytest.mark.asyncio
+    async def test_busy_chat_does_not_block_others(self):
+        from handlers.outbound import OutboundScheduler
+
+        scheduler = OutboundScheduler(global_rate=1000, chat_rate=5, chat_burst=1)
+        try:
+            await scheduler.acquire(1)
+            busy = asyncio.create_task(scheduler.acquire(1))
+            await asyncio.sleep(0)
+            started = time.monotonic()
+            await scheduler.acquire(2)
+            assert time.monotonic() - started < 0.1
+            await busy
+            # Второй запрос в тот же чат ждал свой токен (200 мс при 5 в секунду)
+            assert time.monotonic() - started >= 0.15
+        finally:
+            await scheduler.close()
+
+    @pytest.mark.asyncio
+    async def test_session_schedules_only_chat_requests(self):
+        from aiogram import Bot
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.methods import GetUpdates, SendMessage
+        from handlers.outbound import OutboundScheduler, Priority, ScheduledSession, send_priority
+
+        scheduler = OutboundScheduler()
+        session = ScheduledSession(scheduler)
+        bot = Bot("42:TEST", session=session)
+        with patch.object(AiohttpSession, "make_request", new_callable=AsyncMock) as make_request, \
+                patch.object(scheduler, "acquire", wraps=scheduler.acquire) as acquire:
+            await bot(SendMessage(chat_id=7, text="Привет"))
+            with send_priority(Priority.ADMIN):
+                await bot(SendMessage(chat_id=8, text="Уведомление"))
+            await bot(GetUpdates())
+
+        assert make_request.await_count == 3
+        assert [call.args for call in acquire.call_args_list] == [(7, Priority.USER), (8, Priority.ADMIN)]
+        await session.close()
+
+
+@pytest.mark.asyncio
+class TestOutbox:
+    """Тесты outbox уведомлений о результатах"""
+
+    @pytest_asyncio.fixture
+    async def test_db(self, tmp_path):
+        with patch('database.db_manager.DB_PATH', tmp_path / "test_database.db"):
+            from database.db_manager import init_db
+            await init_db()
+            yield tmp_path / "test_database.db"
+
+    async def outbox_rows(self, test_db):
+        import aiosqlite
+        async with aiosqlite.connect(test_db) as db:
+            async with db.execute("SELECT kind, payload, attempts, last_error FROM outbox") as cursor:
+                return await cursor.fetchall()
+
+    async def test_event_is_written_with_result(self, test_db):
+        from database.db_manager import save_test_result
+
+        await save_test_result(make_state_data(1))
+
+        [(kind, payload, attempts, _)] = await self.outbox_rows(test_db)
+        assert kind == "result_saved"
+        assert json.loads(payload)["phone_number"] == "+79991234567"
+        assert attempts == 0
+
+    async def test_event_is_rolled_back_with_result(self, test_db):
+        from database import db_manager
+
+        # Ошибка после записи результата откатывает и результат, и событие
+        with patch('database.db_manager.apply_stats', side_effect=RuntimeError("сбой")):
+            with pytest.raises(RuntimeError):
+                await db_manager.save_test_result(make_state_data(1))
+
+        assert await self.outbox_rows(test_db) == []
+        assert await db_manager.count_results() == 0
+
+    async def test_worker_delivers_and_retries(self, test_db):
+        from database import db_manager
+        from database.outbox import OutboxWorker
+
+        await db_manager.save_test_result(make_state_data(1))
+        await db_manager.save_test_result(make_state_data(2))
+
+        handled = []
+
+        async def handler(payload):
+            handled.append(payload["user_id"])
+            # Второму кандидату одного админа уведомить не удалось
+            return {**payload, "pending_admins": [42]} if payload["user_id"] == 2 else None
+
+        worker = OutboxWorker(db_manager._write_connection, {"result_saved": handler}, backoff=60)
+        assert await worker.process_batch() == 2
+        assert sorted(handled) == [1, 2]
+
+        [(_, payload, attempts, error)] = await self.outbox_rows(test_db)
+        assert json.loads(payload)["pending_admins"] == [42]
+        assert attempts == 1 and error
+        # Повтор отложен: до истечения задержки событие не берется
+        assert await worker.process_batch() == 0
+
+    async def test_deliver_result_retries_only_failed_admins(self):
+        from handlers.delivery import DeliveryResult
+        from handlers.utils import deliver_result
+
+        results = [DeliveryResult(1, ok=True, attempts=1), DeliveryResult(2, ok=False, attempts=4, error="timeout")]
+        with patch('handlers.utils.notify_admins', new_callable=AsyncMock, return_value=results) as notify:
+            retry = await deliver_result(AsyncMock(), {"user_id": 5})
+            assert retry == {"user_id": 5, "pending_admins": [2]}
+            notify.return_value = [DeliveryResult(2, ok=True, attempts=1)]
+            assert await deliver_result(AsyncMock(), retry) is None
+
+        assert notify.call_args.args[2] == [2]
+
+
+def make_update(update_id, text="Привет", user_id=1):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Кандидат"},
+            "text": text,
+        },
+    }
+
+
+@pytest.mark.asyncio
+class TestWebhook:
+    """Тесты режима webhook: синтетические обновления на локальный сервер"""
+
+    SECRET = "test_secret"
+
+    async def make_client(self, dispatcher, **kwargs):
+        from aiogram import Bot
+        from aiohttp.test_utils import TestClient, TestServer
+        from webhook import build_webhook_app
+
+        app = build_webhook_app(dispatcher, Bot("42:TEST"), path="/webhook", secret_token=self.SECRET, **kwargs)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        return client
+
+    async def test_updates_are_processed(self):
+        from aiogram import Dispatcher
+
+        dp = Dispatcher()
+        received = []
+
+        @dp.message()
+        async def echo(message: Message):
+            received.append(message.text)
+
+        client = await self.make_client(dp, workers=4)
+        try:
+            for i in range(5):
+                response = await client.post(
+                    "/webhook", json=make_update(i, f"сообщение {i}", user_id=i),
+                    headers={"X-Telegram-Bot-Api-Secret-Token": self.SECRET}
+                )
+                assert response.status == 200
+        finally:
+            # Остановка сервера дожидается обработки принятых обновлений
+            await client.close()
+
+        assert sorted(received) == [f"сообщение {i}" for i in range(5)]
+
+    async def test_wrong_secret_is_rejected(self):
+        from aiogram import Dispatcher
+
+        dp = Dispatcher()
+        handled = []
+
+        @dp.message()
+        async def record(message: Message):
+            handled.append(message.message_id)
+
+        client = await self.make_client(dp)
+        try:
+            response = await client.post("/webhook", json=make_update(1),
+                                         headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+            assert response.status == 401
+            response = await client.post("/webhook", json=make_update(2))
+            assert response.status == 401
+        finally:
+            await client.close()
+        assert handled == []
+
+    async def test_full_queue_asks_telegram_to_retry(self):
+        from aiogram import Dispatcher
+
+        dp = Dispatcher()
+        release = asyncio.Event()
+        processed = []
+
+        @dp.message()
+        async def slow(message: Message):
+            await release.wait()
+            processed.append(message.message_id)
+
+        client = await self.make_client(dp, workers=1, queue_size=1)
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.SECRET}
+        try:
+            statuses = []
+            for i in range(3):
+                response = await client.post("/webhook", json=make_update(i), headers=headers)
+                statuses.append(response.status)
+                await asyncio.sleep(0.01)
+            # Первое обновление в обработке, второе в очереди, третье отклонено
+            assert statuses == [200, 200, 503]
+            release.set()
+        finally:
+            await client.close()
+        assert processed == [0, 1]
+
+
+class TestCluster:
+    """Тесты многопроцессного режима: маршрутизация по пользователям и порядок обработки"""
+
+    def test_update_user_id(self):
+        from cluster import update_user_id
+
+        assert update_user_id(make_update(1, user_id=777)) == 777
+        callback = {"update_id": 2, "callback_query": {"id": "q", "from": {"id": 55}, "data": "yes"}}
+        assert update_user_id(callback) == 55
+        channel_post = {"update_id": 3, "channel_post": {"message_id": 1, "date": 0, "chat": {"id": -100}}}
+        assert update_user_id(channel_post) == -100
+        assert update_user_id({"update_id": 4}) == 0
+
+    def test_shard_is_stable_per_user(self):
+        from cluster import shard_for
+
+        shards = {shard_for(make_update(i, user_id=12345), 4) for i in range(10)}
+        assert len(shards) == 1
+        assert {shard_for(make_update(1, user_id=user), 4) for user in range(8)} == {0, 1, 2, 3}
+
+    @pytest.mark.asyncio
+    async def test_router_puts_user_updates_into_one_queue(self):
+        import queue
+        from cluster import ShardRouter
+
+        queues = [queue.Queue() for _ in range(3)]
+        router = ShardRouter(queues)
+        for i in range(9):
+            await router.route(make_update(i, user_id=i % 3))
+
+        for index, worker_queue in enumerate(queues):
+            updates = [worker_queue.get_nowait() for _ in range(worker_queue.qsize())]
+            assert [u["update_id"] for u in updates] == [i for i in range(9) if i % 3 == index]
+
+    @pytest.mark.asyncio
+    async def test_router_waits_when_worker_queue_is_full(self):
+        import queue
+        from cluster import ShardRouter
+
+        worker_queue = queue.Queue(maxsize=1)
+        router = ShardRouter([worker_queue])
+        await router.route(make_update(1))
+        pending = asyncio.create_task(router.route(make_update(2)))
+        await asyncio.sleep(0.05)
+        assert not pending.done()
+        assert worker_queue.get_nowait()["update_id"] == 1
+        await asyncio.wait_for(pending, 1)
+        assert worker_queue.get_nowait()["update_id"] == 2
+
+    @pytest.mark.asyncio
+    async def test_sequencer_keeps_order_per_user(self):
+        from cluster import UpdateSequencer
+
+        sequencer = UpdateSequencer(limit=16)
+        log = []
+
+        async def handle(user, n):
+            # Первые обновления медленнее последующих: без упорядочивания порядок бы нарушился
+            await asyncio.sleep(0.02 if n == 0 else 0)
+            log.append((user, n))
+
+        for n in range(5):
+            for user in range(3):
+                await sequencer.submit(user, lambda user=user, n=n: handle(user, n))
+        await sequencer.drain()
+
+        assert sequencer.active_keys == 0
+        for user in range(3):
+            assert [n for u, n in log if u == user] == list(range(5))
+
+    @pytest.mark.asyncio
+    async def test_sequencer_runs_users_in_parallel_within_limit(self):
+        from cluster import UpdateSequencer
+
+        sequencer = UpdateSequencer(limit=2)
+        running = 0
+        peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+
+        for user in range(6):
+            await sequencer.submit(user, handle)
+        await sequencer.drain()
+        assert peak == 2
+
+    @pytest.mark.asyncio
+    async def test_waiting_updates_do_not_hold_slots(self):
+        """Обновления, ждущие своего пользователя, не занимают места: другие пользователи не ждут"""
+        from cluster import UpdateSequencer
+
+        sequencer = UpdateSequencer(limit=2)
+        release = asyncio.Event()
+        handled = []
+
+        async def slow():
+            await release.wait()
+
+        async def fast():
+            handled.append(True)
+
+        for _ in range(3):
+            await sequencer.submit(1, slow)
+        await asyncio.wait_for(sequencer.submit(2, fast), 1)
+        await asyncio.sleep(0.05)
+        assert handled == [True]
+
+        release.set()
+        await sequencer.drain()
+
+    @pytest.mark.asyncio
+    async def test_dead_worker_stops_ingress(self):
+        """Завершившийся процесс-обработчик обнаруживается, а не копит обновления в очереди"""
+        from cluster import watch_workers
+
+        alive = MagicMock(**{"is_alive.return_value": True})
+        dead = MagicMock(exitcode=1, **{"is_alive.return_value": False})
+        dead.name = "bot-worker-1"
+        with pytest.raises(RuntimeError, match="bot-worker-1"):
+            await asyncio.wait_for(watch_workers([alive, dead], interval=0.01), 1)
+
+    @pytest.mark.asyncio
+    async def test_sequencer_continues_after_error(self):
+        from cluster import UpdateSequencer
+
+        sequencer = UpdateSequencer()
+        done = []
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        async def ok():
+            done.append(True)
+
+        await sequencer.submit(1, fail)
+        await sequencer.submit(1, ok)
+        await sequencer.drain()
+        assert done == [True]
+
+    @pytest.mark.asyncio
+    async def test_ingress_webhook_forwards_to_shard(self):
+        import queue
+        from aiogram import Bot, Dispatcher
+        from aiohttp.test_utils import TestClient, TestServer
+        from cluster import ShardRouter, build_ingress_app
+
+        queues = [queue.Queue(), queue.Queue()]
+        app = build_ingress_app(Dispatcher(), Bot("42:TEST"), ShardRouter(queues), path="/webhook", secret_token="s")
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            response = await client.post("/webhook", json=make_update(7, user_id=3),
+                                         headers={"X-Telegram-Bot-Api-Secret-Token": "s"})
+            assert response.status == 200
+        finally:
+            await client.close()
+        assert queues[0].empty()
+        assert queues[1].get_nowait()["update_id"] == 7
+
+
+@pytest.mark.asyncio
+class TestEventIsolation:
+    """Стресс-тесты порядка обработки: один пользователь - по очереди, разные - параллельно"""
+
+    USERS = 50
+    MESSAGES = 20
+
+    def make_dispatcher(self, storage, isolation=None):
+        dp = Dispatcher(storage=storage, events_isolation=isolation)
+        active = {"now": 0, "peak": 0}
+
+        @dp.message()
+        async def append_answer(message: Message, state: FSMContext):
+            active["now"] += 1
+            active["peak"] = max(active["peak"], active["now"])
+            data = await state.get_data()
+            # Переключение задачи между чтением и записью, как при ожидании Bot API
+            await asyncio.sleep(0.001)
+            await state.update_data(answers=data.get("answers", []) + [int(message.text)])
+            active["now"] -= 1
+
+        return dp, active
+
+    async def feed_all(self, dp):
+        from aiogram.types import Update
+
+        bot = Bot("42:TEST")
+        updates = [
+            Update.model_validate(make_update(n * self.USERS + user, str(n), user_id=user + 1))
+            for n in range(self.MESSAGES) for user in range(self.USERS)
+        ]
+        await asyncio.gather(*(dp.feed_update(bot, update) for update in updates))
+        return bot
+
+    async def answers(self, dp, bot, user_id):
+        key = StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
+        return (await dp.storage.get_data(key)).get("answers")
+
+    async def test_no_lost_updates_with_sqlite_storage(self, tmp_path):
+        from database.fsm_storage import SQLiteStorage, StripedEventIsolation
+
+        with patch('database.db_manager.DB_PATH', tmp_path / "test_database.db"):
+            from database.db_manager import init_db
+            await init_db()
+            dp, active = self.make_dispatcher(SQLiteStorage(), StripedEventIsolation(stripes=16))
+            bot = await self.feed_all(dp)
+
+            for user in range(self.USERS):
+                assert await self.answers(dp, bot, user + 1) == list(range(self.MESSAGES))
+        # Разные пользователи обрабатывались одновременно
+        assert active["peak"] > 1
+
+    async def test_updates_are_lost_without_isolation(self):
+        """Контроль: без изоляции тот же сценарий теряет ответы"""
+        dp, _ = self.make_dispatcher(MemoryStorage())
+        bot = await self.feed_all(dp)
+
+        lengths = [len(await self.answers(dp, bot, user + 1)) for user in range(self.USERS)]
+        assert min(lengths) < self.MESSAGES
+
+    async def test_stripes_bound_memory_and_close_resets_locks(self):
+        from database.fsm_storage import StripedEventIsolation
+
+        isolation = StripedEventIsolation(stripes=4)
+        keys = [StorageKey(bot_id=1, chat_id=user, user_id=user) for user in range(100)]
+        assert {id(isolation._stripe(key)) for key in keys} == {id(lock) for lock in isolation._locks}
+
+        async with isolation.lock(keys[0]):
+            assert isolation._stripe(keys[0]).locked()
+        await isolation.close()
+        assert len(isolation._locks) == 4 and not any(lock.locked() for lock in isolation._locks)
+
+
+@pytest.mark.asyncio
+class TestThrottling:
+    """Тесты защиты от флуда"""
+
+    def make_dispatcher(self, middleware, storage=None):
+        from aiogram import Router
+        from handlers.throttling import setup_throttling
+
+        dp = Dispatcher(storage=storage)
+        router = Router()
+        handled = []
+
+        @router.message()
+        async def record(message: Message):
+            handled.append((message.from_user.id, message.message_id))
+
+        setup_throttling(dp, middleware)
+        dp.include_router(router)
+        return dp, handled
+
+    async def feed(self, dp, bot, *updates):
+        from aiogram.types import Update
+
+        for update in updates:
+            await dp.feed_update(bot, Update.model_validate(update))
+
+    async def test_sliding_window(self):
+        from handlers.throttling import ThrottlingMiddleware
+
+        middleware = ThrottlingMiddleware(limit=3, window=10)
+        assert [middleware.allow(1, now=t) for t in (0, 1, 2, 3)] == [True, True, True, False]
+        # Окно скользит: через 10 с после первого обновления освобождается одно место
+        assert middleware.allow(1, now=9.9) is False
+        assert middleware.allow(1, now=10) is True
+        assert middleware.allow(1, now=10.5) is False
+        # Лимит у каждого пользователя свой
+        assert middleware.allow(2, now=3) is True
+
+    async def test_flood_is_dropped_with_one_warning(self):
+        from handlers.throttling import THROTTLE_WARNING, ThrottlingMiddleware
+
+        middleware = ThrottlingMiddleware(limit=3, window=60)
+        dp, handled = self.make_dispatcher(middleware)
+        bot = AsyncMock(spec=Bot)
+        bot.id = 42
+
+        with patch.object(Message, "answer", new_callable=AsyncMock) as answer:
+            await self.feed(dp, bot, *(make_update(i, user_id=1) for i in range(100)))
+            await self.feed(dp, bot, make_update(100, user_id=2))
+
+        assert handled == [(1, 0), (1, 1), (1, 2), (2, 100)]
+        answer.assert_called_once_with(THROTTLE_WARNING)
+        assert middleware.dropped == 97
+
+    async def test_silent_mode_and_exempt_users(self):
+        from handlers.throttling import ThrottlingMiddleware
+
+        middleware = ThrottlingMiddleware(limit=1, window=60, warning=None, exempt=[7])
+        dp, handled = self.make_dispatcher(middleware)
+        bot = AsyncMock(spec=Bot)
+        bot.id = 42
+
+        with patch.object(Message, "answer", new_callable=AsyncMock) as answer:
+            await self.feed(dp, bot, *(make_update(i, user_id=1) for i in range(5)))
+            await self.feed(dp, bot, *(make_update(10 + i, user_id=7) for i in range(5)))
+
+        answer.assert_not_called()
+        assert [user for user, _ in handled] == [1] + [7] * 5
+
+    async def test_dropped_updates_skip_fsm_storage(self):
+        from handlers.throttling import ThrottlingMiddleware
+
+        storage = MemoryStorage()
+        middleware = ThrottlingMiddleware(limit=2, window=60, warning=None)
+        dp, handled = self.make_dispatcher(middleware, storage=storage)
+        bot = AsyncMock(spec=Bot)
+        bot.id = 42
+
+        with patch.object(storage, "get_state", wraps=storage.get_state) as get_state:
+            await self.feed(dp, bot, *(make_update(i, user_id=1) for i in range(10)))
+
+        assert len(handled) == 2
+        # Состояние читается только для пропущенных обновлений
+        assert get_state.await_count == 2
+        assert middleware.dropped == 8
+
+    async def test_admins_have_own_limit(self):
+        from handlers.throttling import ThrottlingMiddleware
+
+        middleware = ThrottlingMiddleware(limit=1, window=60, warning=None, limits={7: 3, 8: 0})
+        dp, handled = self.make_dispatcher(middleware)
+        bot = AsyncMock(spec=Bot)
+        bot.id = 42
+
+        for user in (1, 7, 8):
+            await self.feed(dp, bot, *(make_update(user * 10 + i, user_id=user) for i in range(5)))
+
+        assert [user for user, _ in handled] == [1] + [7] * 3 + [8] * 5
+
+    async def test_windows_are_bounded_and_expire(self):
+        from handlers.throttling import ThrottlingMiddleware
+
+        middleware = ThrottlingMiddleware(limit=1, window=0.05, maxsize=100)
+        for user in range(1000):
+            middleware.allow(user)
+        assert len(middleware._windows) == 100
+
+        assert middleware.allow(5000) is True
+        assert middleware.allow(5000) is False
+        await asyncio.sleep(0.06)
+        assert middleware.allow(5000) is True
+
+
+# === ТЕСТЫ FSM СОСТОЯНИЙ ===
+
+@pytest.mark.asyncio
+class TestFSMStates:
+    """Тесты переходов между состояниями"""
+    
+    async def test_state_transitions(self, storage):
+        """Тест переходов состояний в процессе теста"""
+        user_id = 123
+        chat_id = 123
+        
+        # Создаем контекст FSM
+        state = FSMContext(
+            storage=storage,
+            key=StorageKey(bot_id=1, chat_id=chat_id, user_id=user_id)
+        )
+        
+        # Тест перехода в первое состояние
+        await state.set_state(TestStates.citizenship_question)
+        current_state = await state.get_state()
+        assert current_state == TestStates.citizenship_question
+        
+        # Сохраняем данные
+        await state.update_data(citizenship="Да", user_id=user_id, username="test")
+        
+        # Переход ко второму вопросу
+        await state.set_state(TestStates.card_blocks_question)
+        current_state = await state.get_state()
+        assert current_state == TestStates.card_blocks_question
+        
+        # Проверяем что данные сохранились
+        data = await state.get_data()
+        assert data["citizenship"] == "Да"
+        assert data["user_id"] == user_id
 
 
 # === ИНТЕГРАЦИОННЫЕ ТЕСТЫ ===
@@ -387,9 +2552,9 @@ class TestBotIntegration:
         # Завершаем тест
         await finish_test(user_id, state, bot)
         
-        # Проверяем что функции были вызваны
+        # Результат сохранен; уведомление админам отправит воркер outbox, а не обработчик
         mock_save.assert_called_once_with(test_data)
-        mock_notify.assert_called_once_with(bot, test_data)
+        mock_notify.assert_not_called()
         
         # Проверяем что состояние очищено
         data = await state.get_data()
@@ -0,0 +1,98 @@
+# your_bot/webhook.py
+
+"""
+Режим webhook: Telegram сам присылает обновления на HTTP-сервер бота.
+Запрос проверяется по секретному токену (заголовок X-Telegram-Bot-Api-Secret-Token)
+и сразу получает ответ, а обновление встает в ограниченную очередь, которую
+разбирают workers обработчиков. Если очередь заполнена, сервер отвечает 503
+и Telegram повторит доставку позже - так нагрузка не копится в памяти бота.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """Обработчик webhook с ограниченной очередью и фиксированным числом параллельных обработок."""
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        secret_token: str,
+        workers: int = 16,
+        queue_size: int = 1000,
+        **data: Any
+    ):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.workers = max(1, workers)
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=max(1, queue_size))
+        self._tasks: List[asyncio.Task] = []
+
+    def register(self, app: web.Application, /, path: str, **kwargs: Any) -> None:
+        # Принятые обновления дообрабатываются до остановки диспетчера (БД, хранилище FSM),
+        # а сессия бота закрывается последней, после on_shutdown диспетчера
+        app.on_startup.append(self._start_workers)
+        app.on_shutdown.append(self._stop_workers)
+        app.on_cleanup.append(self._handle_close)
+        app.router.add_route("POST", path, self.handle, **kwargs)
+
+    async def _start_workers(self, app: web.Application) -> None:
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"webhook-worker-{i}") for i in range(self.workers)
+        ]
+
+    async def _stop_workers(self, app: web.Application) -> None:
+        """Дообрабатывает принятые обновления и останавливает workers."""
+        if not self._tasks:
+            return
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self) -> None:
+        while True:
+            update = await self.queue.get()
+            try:
+                await self._background_feed_update(self.bot, update)
+            except Exception:
+                logger.exception(f"Ошибка обработки обновления {update.get('update_id')}")
+            finally:
+                self.queue.task_done()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning(f"Очередь webhook заполнена, обновление {update.get('update_id')} отклонено.")
+            return web.Response(status=503, text="Queue is full")
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+
+def build_webhook_app(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    path: str,
+    secret_token: str,
+    workers: int = 16,
+    queue_size: int = 1000
+) -> web.Application:
+    """
+    Собирает aiohttp-приложение с маршрутом webhook.
+    Старт и остановка приложения запускают on_startup/on_shutdown диспетчера.
+    """
+    app = web.Application()
+    handler = QueuedRequestHandler(dispatcher, bot, secret_token, workers=workers, queue_size=queue_size)
+    # Порядок важен: при остановке очередь обновлений разбирается до on_shutdown диспетчера
+    handler.register(app, path=path)
+    setup_application(app, dispatcher, bot=bot)
+    return app